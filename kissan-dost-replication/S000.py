@@ -2,19 +2,269 @@ from abc import ABC, abstractmethod
 from typing import Any
 import json
 import logging
+import logging.handlers
+import atexit
+import bisect
+import queue
 from dataclasses import dataclass, asdict
 import os
+import re
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
 
 T001 = False
 logName = "kissan_dost.log"
+# 二进制模型文件可被多个进程以只读内存映射方式共享
+BINARY_MODEL_SUFFIXES = (".joblib", ".pkl")
+# 异步日志：请求线程只入队，后台线程批量格式化、写盘并按大小轮转
+LOG_ASYNC = os.environ.get("KISSAN_LOG_ASYNC", "1") != "0"
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+# 日志队列上限：写盘跟不上时丢弃新记录并计数，不阻塞请求线程
+LOG_QUEUE_SIZE = 10000
+LOG_LEVELS = {
+    "DEBUG": logging.DEBUG,
+    "INFO": logging.INFO,
+    "WARNING": logging.WARNING,
+    "ERROR": logging.ERROR,
+    "CRITICAL": logging.CRITICAL
+}
+log_listener = None
+log_setup_lock = threading.Lock()
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class MetricsRegistry:
+    # 每个线程写自己的分片（无锁），抓取时再合并；计数器和直方图的单次记录只有几次字典操作
+    def __init__(self):
+        self.local = threading.local()
+        self.shards = []
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.gauges = {}
+
+    def shard(self):
+        values = {}
+        self.local.values = values
+        with self.lock:
+            self.shards.append(values)
+        return values
+
+    def counter(self, name, help_text):
+        return self.metrics.setdefault(name, Counter(self, name, help_text))
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self.metrics.setdefault(name, Histogram(self, name, help_text, buckets))
+
+    def gauge(self, name, help_text, func):
+        # 仪表盘值在抓取时回调获取；func 返回数值或 {标签元组: 数值}
+        self.gauges[name] = (help_text, func)
+
+    def merged(self):
+        with self.lock:
+            shards = list(self.shards)
+        totals = {}
+        for values in shards:
+            for key, value in list(values.items()):
+                if isinstance(value, list):
+                    merged = totals.get(key)
+                    if merged is None:
+                        totals[key] = list(value)
+                    else:
+                        for i, v in enumerate(value):
+                            merged[i] += v
+                else:
+                    totals[key] = totals.get(key, 0.0) + value
+        return totals
+
+    def render(self):
+        totals = self.merged()
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.help_text}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for (metric_name, labels), value in sorted(totals.items()):
+                if metric_name == name:
+                    lines.extend(metric.render(labels, value))
+        for name, (help_text, func) in self.gauges.items():
+            try:
+                value = func()
+            except Exception as e:
+                printLog(f"指标采集失败 {name}: {e}", "WARNING")
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, v in (value.items() if isinstance(value, dict) else [((), value)]):
+                lines.append(f"{name}{format_labels(labels)} {float(v)}")
+        return "\n".join(lines) + "\n"
+
+def format_labels(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, registry, name, help_text):
+        self.registry = registry
+        self.local = registry.local
+        self.name = name
+        self.help_text = help_text
+
+    def inc(self, amount=1.0, labels=()):
+        try:
+            values = self.local.values
+        except AttributeError:
+            values = self.registry.shard()
+        key = (self.name, labels)
+        values[key] = values.get(key, 0.0) + amount
+
+    def render(self, labels, value):
+        return [f"{self.name}{format_labels(labels)} {value}"]
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, registry, name, help_text, buckets):
+        self.registry = registry
+        self.local = registry.local
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labels=()):
+        try:
+            counts = self.local.values[(self.name, labels)]
+        except (AttributeError, KeyError):
+            values = getattr(self.local, "values", None)
+            if values is None:
+                values = self.registry.shard()
+            # 各桶计数 + 溢出桶 + 总和 + 总数
+            counts = values.setdefault((self.name, labels), [0] * (len(self.buckets) + 1) + [0.0, 0])
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    def render(self, labels, counts):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{format_labels(labels, ('le', bound))} {cumulative}")
+        lines.append(f"{self.name}_bucket{format_labels(labels, ('le', '+Inf'))} {counts[-1]}")
+        lines.append(f"{self.name}_sum{format_labels(labels)} {counts[-2]}")
+        lines.append(f"{self.name}_count{format_labels(labels)} {counts[-1]}")
+        return lines
+
+metrics = MetricsRegistry()
+LOG_RECORDS = metrics.counter("kissan_log_records_total", "写入日志的记录数")
+LOG_FLUSH_SECONDS = metrics.histogram("kissan_log_flush_seconds", "日志批量写盘耗时")
+LOG_DROPPED = metrics.counter("kissan_log_dropped_total", "日志队列已满时丢弃的记录数")
+LOG_LEVEL_LABELS = {levelno: (("level", name),) for name, levelno in LOG_LEVELS.items()}
+STAGE_SECONDS = metrics.histogram("kissan_stage_duration_seconds", "推理各阶段耗时")
+
+def observe_stage(stage, started):
+    STAGE_SECONDS.observe(time.perf_counter() - started, (("stage", stage),))
+
+class SizeTrackingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    # 自行累计已写字节数判断轮转，不再像父类 shouldRollover 那样每条记录 seek/tell（会触发刷盘）
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.bytes_written = os.path.getsize(self.baseFilename) if os.path.exists(self.baseFilename) else 0
+    
+    def emit(self, record):
+        try:
+            msg = self.format(record) + self.terminator
+            size = len(msg.encode(self.encoding or 'utf-8'))
+            if self.maxBytes > 0 and self.bytes_written and self.bytes_written + size > self.maxBytes:
+                self.doRollover()
+                self.bytes_written = 0
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(msg)
+            self.bytes_written += size
+            self.flush()
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+class BatchRotatingFileHandler(SizeTrackingRotatingFileHandler):
+    def flush(self):
+        pass
+    
+    def flush_batch(self):
+        super().flush()
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+    
+    def prepare(self, record):
+        return record
+    
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            LOG_DROPPED.inc()
+
+class BatchLogListener:
+    def __init__(self, log_queue, handler, batch_size=256):
+        self.log_queue = log_queue
+        self.handler = handler
+        self.batch_size = batch_size
+        self.thread = threading.Thread(target=self.run, name="log-writer", daemon=True)
+    
+    def start(self):
+        self.thread.start()
+    
+    def run(self):
+        running = True
+        while running:
+            batch = [self.log_queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.log_queue.get_nowait())
+                except queue.Empty:
+                    break
+            started = time.perf_counter()
+            for record in batch:
+                if record is None:
+                    running = False
+                    continue
+                try:
+                    self.handler.handle(record)
+                except Exception:
+                    self.handler.handleError(record)
+            self.handler.flush_batch()
+            LOG_FLUSH_SECONDS.observe(time.perf_counter() - started)
+    
+    def stop(self, timeout=10.0):
+        if self.thread.is_alive():
+            try:
+                self.log_queue.put(None, timeout=timeout)
+            except queue.Full:
+                return
+            self.thread.join(timeout)
 
 def setupLogging():
-    global T001
-    if not T001:
+    global T001, log_listener
+    with log_setup_lock:
+        if T001:
+            return
         logger = logging.getLogger()
         logger.setLevel(logging.INFO)
-        file_handler = logging.FileHandler(logName, mode='a', encoding='utf-8')
+        handler_class = BatchRotatingFileHandler if LOG_ASYNC else SizeTrackingRotatingFileHandler
+        file_handler = handler_class(
+            logName, mode='a', maxBytes=LOG_MAX_BYTES,
+            backupCount=LOG_BACKUP_COUNT, encoding='utf-8'
+        )
         formatter = logging.Formatter(
             '%(asctime)s - %(levelname)s - %(message)s',
             datefmt='%Y-%m-%d %H:%M:%S'
@@ -22,24 +272,24 @@ def setupLogging():
         file_handler.setFormatter(formatter)
         for handler in logger.handlers[:]:
             logger.removeHandler(handler)
-        logger.addHandler(file_handler)
+        if LOG_ASYNC:
+            log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+            log_listener = BatchLogListener(log_queue, file_handler)
+            log_listener.start()
+            atexit.register(log_listener.stop)
+            logger.addHandler(DeferredQueueHandler(log_queue))
+        else:
+            logger.addHandler(file_handler)
         T001 = True
 
 def printLog(message, level="INFO"):
-    setupLogging()
-    level = level.upper()
-    if level == "DEBUG":
-        logging.debug(message)
-    elif level == "INFO":
-        logging.info(message)
-    elif level == "WARNING":
-        logging.warning(message)
-    elif level == "ERROR":
-        logging.error(message)
-    elif level == "CRITICAL":
-        logging.critical(message)
-    else:
-        logging.info(message)
+    if not T001:
+        setupLogging()
+    levelno = LOG_LEVELS.get(level.upper(), logging.INFO)
+    if levelno < logging.root.level:
+        return
+    LOG_RECORDS.inc(labels=LOG_LEVEL_LABELS[levelno])
+    logging.root.log(levelno, message)
 
 def dict_to_json_file(dictionary, file_path, ensure_ascii=False, indent=4):
     try:
@@ -64,6 +314,132 @@ def json_file_to_dict(file_path):
         printLog(f"JSON文件读取失败: {e}")
         return None
 
+class LRUCache:
+    def __init__(self, max_size=1024, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.tags = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+    
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at, tag = entry
+            if self.ttl and expires_at < time.monotonic():
+                self.remove(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def set(self, key, value, tag=None):
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (value, time.monotonic() + (self.ttl or 0), tag)
+            if tag is not None:
+                self.tags.setdefault(tag, set()).add(key)
+            while len(self.entries) > self.max_size:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+    
+    def remove(self, key):
+        value, expires_at, tag = self.entries.pop(key)
+        if tag is not None:
+            keys = self.tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tags[tag]
+    
+    def invalidate_tag(self, tag):
+        with self.lock:
+            keys = list(self.tags.get(tag, ()))
+            for key in keys:
+                self.remove(key)
+            self.invalidations += len(keys)
+            return len(keys)
+    
+    def clear(self):
+        with self.lock:
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+            self.tags.clear()
+    
+    def get_stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+class IntentClassifier:
+    # 所有关键词编译成一个正则，一次扫描即可得到全部意图及位置
+    def __init__(self, intent_keywords=None):
+        self.intent_keywords = []
+        self.keyword_intents = {}
+        self.pattern = None
+        for intent, keywords in intent_keywords or []:
+            self.add_keywords(intent, keywords, rebuild=False)
+        self.rebuild()
+    
+    def add_keywords(self, intent, keywords, rebuild=True):
+        known = dict(self.intent_keywords)
+        if intent not in known:
+            self.intent_keywords.append((intent, []))
+            known[intent] = self.intent_keywords[-1][1]
+        for keyword in keywords:
+            keyword = keyword.lower()
+            if keyword and keyword not in self.keyword_intents:
+                self.keyword_intents[keyword] = intent
+                known[intent].append(keyword)
+        if rebuild:
+            self.rebuild()
+    
+    def load_config(self, config_path):
+        config = json_file_to_dict(config_path)
+        if not isinstance(config, dict):
+            return False
+        for intent, keywords in config.items():
+            self.add_keywords(intent, keywords, rebuild=False)
+        self.rebuild()
+        return True
+    
+    def rebuild(self):
+        keywords = sorted(self.keyword_intents, key=len, reverse=True)
+        self.pattern = re.compile('|'.join(re.escape(k) for k in keywords)) if keywords else None
+    
+    def classify(self, message):
+        if self.pattern is None:
+            return []
+        return [
+            (self.keyword_intents[match.group()], match.group(), match.start())
+            for match in self.pattern.finditer(message.lower())
+        ]
+    
+    def intents(self, message):
+        found = []
+        for intent, keyword, position in self.classify(message):
+            if intent not in found:
+                found.append(intent)
+        return found
+
 class BaseModel(ABC):
     def __init__(self, model_name: str):
         self.model_name = model_name
@@ -79,14 +455,22 @@ class BaseModel(ABC):
     
     def saveModel(self, model_path: str) -> None:
         try:
-            dict_to_json_file(self.__dict__, model_path)
+            if model_path.endswith(BINARY_MODEL_SUFFIXES):
+                import joblib
+                joblib.dump(self.__dict__, model_path)
+            else:
+                dict_to_json_file(self.__dict__, model_path)
             printLog(f"模型已保存到: {model_path}")
         except Exception as e:
             printLog(f"模型保存失败: {e}")
     
-    def loadModel(self, model_path: str) -> None:
+    def loadModel(self, model_path: str, mmap_mode: str = "r") -> None:
         try:
-            model_dict = json_file_to_dict(model_path)
+            if model_path.endswith(BINARY_MODEL_SUFFIXES):
+                import joblib
+                model_dict = joblib.load(model_path, mmap_mode=mmap_mode) if os.path.exists(model_path) else None
+            else:
+                model_dict = json_file_to_dict(model_path)
             if model_dict:
                 for key, value in model_dict.items():
                     setattr(self, key, value)
@@ -96,8 +480,48 @@ class BaseModel(ABC):
         except Exception as e:
             printLog(f"模型加载失败: {e}")
 
+# 规范读数指标，列顺序与 SensorDataModel.feature_columns 一致，批量容器可直接作为模型输入
+NAN = float('nan')
+READING_METRICS = (
+    'temperature', 'humidity', 'soil_moisture',
+    'soil_ph', 'npk_nitrogen', 'npk_phosphorus', 'npk_potassium'
+)
+READING_ALIASES = {
+    'ph': 'soil_ph',
+    'moisture': 'soil_moisture',
+    'nitrogen': 'npk_nitrogen',
+    'phosphorus': 'npk_phosphorus',
+    'potassium': 'npk_potassium'
+}
+
+def normalize_readings(readings):
+    # 统一的扁平读数格式：嵌套字典展开为 key_subkey，别名映射到规范名，只保留数值
+    values = {}
+    for key, value in (readings or {}).items():
+        if isinstance(value, bool):
+            continue
+        if isinstance(value, (int, float)):
+            values[READING_ALIASES.get(key, key)] = float(value)
+        elif isinstance(value, dict):
+            for sub_key, sub_value in value.items():
+                if isinstance(sub_value, (int, float)) and not isinstance(sub_value, bool):
+                    name = f"{key}_{sub_key}"
+                    values[READING_ALIASES.get(name, name)] = float(sub_value)
+    return values
+
+def parse_timestamp(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str) and value:
+        try:
+            return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+        except ValueError:
+            pass
+    return time.time()
+
 @dataclass
 class SensorReading:
+    __slots__ = ('sensor_id', 'location', 'timestamp') + READING_METRICS
     sensor_id: str
     location: str
     timestamp: str
@@ -112,8 +536,136 @@ class SensorReading:
     def to_dict(self):
         return asdict(self)
 
+def sensor_reading_dtype():
+    import numpy as np
+    # 每条读数 72 字节：传感器/地块用整数编码，时间戳为 epoch 秒，指标为定长 float64 子数组
+    return np.dtype([
+        ('sensor', np.int32),
+        ('location', np.int32),
+        ('timestamp', np.float64),
+        ('metrics', np.float64, (len(READING_METRICS),))
+    ])
+
+class SensorReadingBatch:
+    # 结构化数组（列式）批量容器：摄入时规范化一次，存储逐行读取，feature_matrix() 返回底层缓冲区视图直接作为模型输入
+    def __init__(self, capacity=1024):
+        import numpy as np
+        self.data = np.zeros(capacity, dtype=sensor_reading_dtype())
+        self.size = 0
+        self.sensor_ids = []
+        self.locations = []
+        self.sensor_codes = {}
+        self.location_codes = {}
+        # 派生特征（如趋势斜率）按列附加，不进入结构化数组
+        self.derived = {}
+
+    def __len__(self):
+        return self.size
+
+    def encode(self, names, codes, value):
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(names)
+            names.append(value)
+        return code
+
+    def reserve(self, count):
+        import numpy as np
+        if self.size + count > len(self.data):
+            grown = np.zeros(max(len(self.data) * 2, self.size + count), dtype=self.data.dtype)
+            grown[:self.size] = self.data[:self.size]
+            self.data = grown
+
+    def row(self, sensor_id, location, timestamp, values):
+        return (
+            self.encode(self.sensor_ids, self.sensor_codes, sensor_id),
+            self.encode(self.locations, self.location_codes, location),
+            parse_timestamp(timestamp),
+            [values.get(name, NAN) for name in READING_METRICS]
+        )
+
+    def append_rows(self, rows):
+        if not rows:
+            return
+        self.reserve(len(rows))
+        self.data[self.size:self.size + len(rows)] = rows
+        self.size += len(rows)
+
+    def extend(self, payloads, canonical=False):
+        # canonical=True 表示 readings 已是规范扁平读数（如异常筛查的输出），不再重复规范化
+        self.append_rows([
+            self.row(
+                str(payload.get('sensor_id', 'unknown')),
+                str(payload.get('location', 'unknown')),
+                payload.get('timestamp'),
+                payload.get('readings') if canonical else normalize_readings(payload.get('readings'))
+            )
+            for payload in payloads
+        ])
+
+    @classmethod
+    def from_payloads(cls, payloads, canonical=False):
+        batch = cls(max(len(payloads), 1))
+        batch.extend(payloads, canonical)
+        return batch
+
+    @classmethod
+    def from_readings(cls, readings_by_location, timestamps=None, sensor_id='*'):
+        # 按地块汇总的规范读数（各传感器最新值合并），sensor_id 记为 '*'
+        timestamps = timestamps or {}
+        batch = cls(max(len(readings_by_location), 1))
+        batch.append_rows([
+            batch.row(sensor_id, location, timestamps.get(location), values)
+            for location, values in readings_by_location.items()
+        ])
+        return batch
+
+    def feature_matrix(self):
+        return self.data['metrics'][:self.size]
+
+    def column(self, name):
+        return self.data['metrics'][:self.size, READING_METRICS.index(name)]
+
+    def location_names(self):
+        return [self.locations[code] for code in self.data['location'][:self.size].tolist()]
+
+    def rows(self):
+        # 一次性转成 Python 列表后逐行产出 (sensor_id, location, timestamp, 读数字典)，缺失指标不出现在字典中
+        data = self.data[:self.size]
+        for sensor, location, timestamp, metrics in zip(
+                data['sensor'].tolist(), data['location'].tolist(),
+                data['timestamp'].tolist(), data['metrics'].tolist()):
+            yield (
+                self.sensor_ids[sensor], self.locations[location], timestamp,
+                {name: value for name, value in zip(READING_METRICS, metrics) if value == value}
+            )
+
+    def reading(self, index):
+        row = self.data[index]
+        return SensorReading(
+            self.sensor_ids[row['sensor']],
+            self.locations[row['location']],
+            datetime.fromtimestamp(row['timestamp']).isoformat(),
+            *row['metrics'].tolist()
+        )
+
+    def to_payloads(self):
+        return [
+            {
+                'sensor_id': sensor_id,
+                'location': location,
+                'timestamp': datetime.fromtimestamp(timestamp).isoformat(),
+                'readings': values
+            }
+            for sensor_id, location, timestamp, values in self.rows()
+        ]
+
+    def nbytes(self):
+        return self.data[:self.size].nbytes
+
 @dataclass
 class AgricultureAdvice:
+    __slots__ = ('advice_id', 'sensor_reading', 'recommendation', 'confidence', 'urgency', 'actions')
     advice_id: str
     sensor_reading: SensorReading
     recommendation: str
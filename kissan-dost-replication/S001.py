@@ -1,13 +1,50 @@
 from S000 import *
 import random
+import time
 from datetime import datetime
-import requests
+
+# 土壤湿度 6 小时斜率（%/小时）低于该值视为持续变干
+DRYING_SLOPE = -1.0
+# 模型未保存训练中位数（旧模型文件或训练列全缺）时各特征的缺失值填充
+FEATURE_DEFAULTS = {
+    'temperature': 25.0,
+    'humidity': 60.0,
+    'soil_moisture': 50.0,
+    'soil_ph': 6.5,
+    'npk_nitrogen': 40.0,
+    'npk_phosphorus': 30.0,
+    'npk_potassium': 30.0
+}
+
+SENSOR_TYPE_FEATURES = {
+    'soil_moisture': 'soil_moisture',
+    'temperature': 'temperature',
+    'humidity': 'humidity',
+    'ph_sensor': 'soil_ph',
+    'npk_sensor': 'npk'
+}
 
 class IoTDataCollector:
     def __init__(self):
         self.sensors = {}
         self.data_buffer = []
         self.backend_url = "http://localhost:8000"
+        self.batch_size = 100
+        self.batch_max_age = 10.0
+        self.buffer_started_at = None
+        self.buffer_lock = threading.Lock()
+        self.flush_wakeup = threading.Event()
+        self.flusher = None
+        self.dropped_readings = 0
+        self.backend_client = None
+    
+    @property
+    def client(self):
+        # 只有真正向后端发送数据时才导入 requests 并建立连接池，服务端进程无需加载
+        if self.backend_client is None:
+            from S008 import BackendClient
+            self.backend_client = BackendClient(pool_size=int(os.environ.get("KISSAN_CLIENT_POOL_SIZE", 4)))
+        return self.backend_client
     
     def add_sensor(self, sensor_type, sensor_id, config):
         self.sensors[sensor_id] = {
@@ -42,10 +79,11 @@ class IoTDataCollector:
         return sensor_data
     
     def preprocess_data(self, raw_data):
+        from S007 import metric_in_range
         processed = {}
         for sensor_id, reading in raw_data.items():
             if isinstance(reading, (int, float)):
-                if 0 <= reading <= 100:
+                if metric_in_range(self.metric_name(sensor_id), reading):
                     processed[sensor_id] = reading
                 else:
                     printLog(f"传感器 {sensor_id} 数据异常: {reading}", "WARNING")
@@ -55,21 +93,39 @@ class IoTDataCollector:
                 printLog(f"传感器 {sensor_id} 数据格式错误", "WARNING")
         return processed
     
+    def metric_name(self, sensor_id):
+        sensor_info = self.sensors.get(sensor_id)
+        if sensor_info is None:
+            return sensor_id
+        return SENSOR_TYPE_FEATURES.get(sensor_info['type'], sensor_id)
+    
+    def canonical_readings(self, raw_data):
+        return normalize_readings({self.metric_name(sensor_id): reading for sensor_id, reading in raw_data.items()})
+    
+    def collect_by_location(self):
+        processed = self.preprocess_data(self.collect_data())
+        grouped = {}
+        for sensor_id, reading in processed.items():
+            location = self.sensors[sensor_id]['config'].get('location', 'default')
+            grouped.setdefault(location, {})[sensor_id] = reading
+        return {location: self.canonical_readings(raw) for location, raw in grouped.items()}
+    
+    def format_reading(self, data):
+        return {
+            "sensor_id": "agri_sensor_001",
+            "location": "field_3",
+            "timestamp": datetime.now().isoformat(),
+            "readings": self.canonical_readings(data),
+            "metadata": {"crop_type": "citrus", "growth_stage": "flowering"}
+        }
+    
     def send_to_backend(self, data):
         try:
-            formatted_data = {
-                "sensor_id": "agri_sensor_001",
-                "location": "field_3",
-                "timestamp": datetime.now().isoformat(),
-                "readings": data,
-                "metadata": {"crop_type": "citrus", "growth_stage": "flowering"}
-            }
-            response = requests.post(
-                f"{self.backend_url}/api/v1/ingest",
-                json=formatted_data,
-                headers={"Content-Type": "application/json"},
-                timeout=5
-            )
+            formatted_data = self.format_reading(data)
+            response = self.client.send(f"{self.backend_url}/api/v1/ingest", formatted_data)
+            if response is None:
+                printLog("数据发送失败，已暂存到本地待补发", "ERROR")
+                return False
             if response.status_code == 200:
                 printLog(f"数据发送成功: {len(data)}个传感器读数")
                 return True
@@ -79,6 +135,67 @@ class IoTDataCollector:
         except Exception as e:
             printLog(f"发送数据时出错: {e}", "ERROR")
             return False
+    
+    def buffer_reading(self, payload):
+        with self.buffer_lock:
+            if not self.data_buffer:
+                self.buffer_started_at = time.time()
+                self.flush_wakeup.set()
+            self.data_buffer.append(payload)
+            full = len(self.data_buffer) >= self.batch_size
+        if self.flusher is None:
+            self.start_flusher()
+        if full:
+            return self.flush_buffer()
+        return True
+    
+    def start_flusher(self):
+        # 缓冲区按时间刷新不能依赖下一条读数到来，后台线程在最早一条读数满 batch_max_age 时发送
+        with self.buffer_lock:
+            if self.flusher is not None:
+                return
+            self.flusher = threading.Thread(target=self.flush_loop, name="buffer-flusher", daemon=True)
+        self.flusher.start()
+    
+    def flush_loop(self):
+        while True:
+            with self.buffer_lock:
+                started_at = self.buffer_started_at
+            wait = self.batch_max_age if started_at is None else started_at + self.batch_max_age - time.time()
+            if wait > 0:
+                self.flush_wakeup.wait(wait)
+                self.flush_wakeup.clear()
+                continue
+            self.flush_buffer()
+    
+    def send_batched(self, data):
+        return self.buffer_reading(self.format_reading(data))
+    
+    def flush_buffer(self):
+        with self.buffer_lock:
+            if not self.data_buffer:
+                return True
+            batch = self.data_buffer
+            self.data_buffer = []
+            self.buffer_started_at = None
+        try:
+            response = self.client.send(f"{self.backend_url}/api/v1/ingest/batch", batch)
+            if response is None:
+                # 重试耗尽的批次已落盘，不再占用内存缓冲区
+                printLog(f"批量数据发送失败，{len(batch)}条已暂存到本地", "ERROR")
+                return False
+            if response.status_code == 200:
+                result = response.json()
+                for error in result.get("errors", []):
+                    printLog(f"批量读数 {error.get('index')} 被拒绝: {error.get('error')}", "WARNING")
+                printLog(f"批量数据发送成功: {result.get('accepted', len(batch))}/{len(batch)}条")
+                return True
+            # 可重试的状态码已由客户端重试并落盘；其余状态码（如 4xx）原样重发不会成功，直接丢弃
+            printLog(f"批量数据被后端拒绝: {response.status_code}，已丢弃{len(batch)}条", "ERROR")
+        except Exception as e:
+            printLog(f"批量发送数据时出错，已丢弃{len(batch)}条: {e}", "ERROR")
+        self.dropped_readings += len(batch)
+        return False
 
 class AgricultureAIModel(BaseModel):
     def __init__(self, model_name, model_type):
@@ -91,14 +208,7 @@ class AgricultureAIModel(BaseModel):
     def feature_engineering(self, data):
         try:
             if isinstance(data, dict):
-                features = {}
-                for key, value in data.items():
-                    if isinstance(value, (int, float)):
-                        features[key] = value
-                    elif isinstance(value, dict):
-                        for sub_key, sub_value in value.items():
-                            features[f"{key}_{sub_key}"] = sub_value
-                return features
+                return normalize_readings(data)
             else:
                 printLog("特征工程: 输入数据格式不支持", "WARNING")
                 return data
@@ -122,49 +232,146 @@ class SensorDataModel(AgricultureAIModel):
             'temperature', 'humidity', 'soil_moisture', 
             'soil_ph', 'npk_nitrogen', 'npk_phosphorus', 'npk_potassium'
         ]
+        self.trend_columns = ['soil_moisture_6h_slope']
         self.target_column = "crop_health_index"
+        # 训练集各特征列中位数，随模型一起保存，推理时用于填充缺失特征
+        self.feature_medians = None
     
     def train(self, train_data, **kwargs):
         try:
             printLog("开始训练传感器数据模型...")
-            self.model = "simulated_sensor_model"
-            printLog("模拟传感器模型训练完成")
+            frame = self.load_training_frame(train_data)
+            if frame is None:
+                self.model = "simulated_sensor_model"
+                printLog("模拟传感器模型训练完成")
+                return
+            
+            import numpy as np
+            from sklearn.ensemble import RandomForestRegressor
+            from sklearn.metrics import mean_squared_error, r2_score
+            from sklearn.model_selection import train_test_split
+            
+            frame = frame[frame[self.target_column].notna()]
+            features = self.to_feature_matrix(frame)
+            self.feature_medians = self.training_medians(features)
+            features = self.impute(features)
+            target = frame[self.target_column].to_numpy(dtype=np.float64)
+            x_train, x_test, y_train, y_test = train_test_split(
+                features, target, test_size=kwargs.get('test_size', 0.2), random_state=42
+            )
+            model = RandomForestRegressor(
+                n_estimators=kwargs.get('n_estimators', 100),
+                max_depth=kwargs.get('max_depth', 12),
+                n_jobs=kwargs.get('n_jobs', -1),
+                random_state=42
+            )
+            model.fit(x_train, y_train)
+            predictions = model.predict(x_test)
+            loss = float(mean_squared_error(y_test, predictions))
+            accuracy = float(r2_score(y_test, predictions))
+            self.log_training(1, loss, accuracy)
+            self.model = model
+            printLog(f"传感器数据模型训练完成: {len(frame)}条样本, MSE={loss:.4f}, R2={accuracy:.3f}")
         except Exception as e:
             printLog(f"模型训练失败: {e}", "ERROR")
             self.model = "fallback_sensor_model"
     
+    def load_training_frame(self, train_data):
+        import pandas as pd
+        if isinstance(train_data, str):
+            if not os.path.exists(train_data):
+                printLog(f"训练数据文件不存在: {train_data}", "WARNING")
+                return None
+            if train_data.endswith('.csv'):
+                frame = pd.read_csv(train_data)
+            else:
+                if train_data.endswith('.json'):
+                    records = json_file_to_dict(train_data)
+                else:
+                    with open(train_data, 'r', encoding='utf-8') as f:
+                        records = [json.loads(line) for line in f if line.strip()]
+                return self.load_training_frame(records)
+        elif isinstance(train_data, pd.DataFrame):
+            frame = train_data
+        elif isinstance(train_data, list):
+            rows = []
+            for record in train_data:
+                row = self.feature_engineering(record.get('readings', record))
+                row[self.target_column] = record.get(self.target_column)
+                rows.append(row)
+            frame = pd.DataFrame(rows)
+        else:
+            return None
+        if self.target_column not in frame.columns or frame.empty:
+            printLog(f"训练数据缺少目标列: {self.target_column}", "WARNING")
+            return None
+        return frame
+    
+    def training_medians(self, features):
+        import numpy as np
+        medians = []
+        for col, feature in enumerate(self.feature_columns):
+            values = features[:, col][~np.isnan(features[:, col])]
+            medians.append(float(np.median(values)) if len(values) else FEATURE_DEFAULTS[feature])
+        return medians
+
+    def impute(self, features):
+        import numpy as np
+        fill = self.feature_medians or [FEATURE_DEFAULTS[feature] for feature in self.feature_columns]
+        return np.where(np.isnan(features), np.asarray(fill, dtype=np.float64), features)
+    
     def predict(self, input_data, **kwargs):
         try:
-            processed_data = self.preprocess_sensor_data(input_data)
-            if self.model == "simulated_sensor_model" or self.model == "fallback_sensor_model":
-                moisture = processed_data.get('soil_moisture', 50)
-                if moisture < 30:
-                    return "needs_water"
-                elif moisture > 60:
-                    return "too_much_water"
-                else:
-                    return "healthy"
-            else:
-                prediction = self.model.predict([list(processed_data.values())])[0]
-                return self.interpret_prediction(prediction)
+            return self.predict_batch([input_data])[0]
         except Exception as e:
             printLog(f"预测出错: {e}", "ERROR")
             return "unknown"
     
-    def preprocess_sensor_data(self, raw_data):
-        processed = {}
+    def to_feature_matrix(self, data, columns=None):
+        import numpy as np
+        columns = columns or self.feature_columns
+        if isinstance(data, SensorReadingBatch):
+            if columns is self.feature_columns:
+                return data.feature_matrix()
+            return np.column_stack([
+                np.asarray(data.derived.get(name, [np.nan] * len(data)), dtype=np.float64) for name in columns
+            ]).reshape(len(data), len(columns))
+        if isinstance(data, np.ndarray):
+            if columns is not self.feature_columns:
+                return np.full((len(data), len(columns)), np.nan)
+            if data.dtype not in (np.float32, np.float64):
+                data = data.astype(np.float64)
+            return data.reshape(-1, len(columns))
+        if hasattr(data, 'reindex') and hasattr(data, 'columns'):
+            return data.reindex(columns=columns).to_numpy(dtype=np.float64)
+        matrix = np.full((len(data), len(columns)), np.nan)
+        # 读数在摄入时已规范化为扁平字典（存储/批量容器中的规范列），这里按列直接读取，不再重新展开
+        for row, record in enumerate(data):
+            for col, feature in enumerate(columns):
+                value = record.get(feature)
+                if value is not None:
+                    matrix[row, col] = value
+        return matrix
+    
+    def predict_batch(self, input_data, **kwargs):
+        import numpy as np
         try:
-            for key, value in raw_data.items():
-                if isinstance(value, (int, float)):
-                    processed[key] = value
-                elif isinstance(value, dict):
-                    for sub_key, sub_value in value.items():
-                        norm_key = f"npk_{sub_key}"
-                        processed[norm_key] = sub_value
-            return processed
+            features = self.impute(self.to_feature_matrix(input_data))
+            moisture = features[:, self.feature_columns.index('soil_moisture')]
+            # 趋势特征由滚动窗口引擎预先计算，这里只读取，不回扫历史
+            slope = self.to_feature_matrix(input_data, self.trend_columns)[:, 0]
+            drying = (moisture < 40) & (np.nan_to_num(slope, nan=0.0) <= DRYING_SLOPE)
+            if self.model is None or isinstance(self.model, str):
+                return np.select(
+                    [(moisture < 30) | drying, moisture > 60],
+                    ['needs_water', 'too_much_water'],
+                    'healthy'
+                ).tolist()
+            predictions = np.asarray(self.model.predict(features), dtype=np.float64)
+            return np.where(drying, 'needs_water', self.interpret_predictions(predictions)).tolist()
         except Exception as e:
-            printLog(f"数据预处理出错: {e}", "ERROR")
-            return {feature: 50 for feature in self.feature_columns}
+            printLog(f"批量预测出错: {e}", "ERROR")
+            return ["unknown"] * len(input_data)
     
     def interpret_prediction(self, prediction_value):
         if prediction_value < 0.3:
@@ -176,12 +383,52 @@ class SensorDataModel(AgricultureAIModel):
         else:
             return "excellent"
 
+    def interpret_predictions(self, prediction_values):
+        import numpy as np
+        return np.select(
+            [prediction_values < 0.3, prediction_values < 0.5, prediction_values < 0.7],
+            ['needs_water', 'needs_nutrients', 'healthy'],
+            'excellent'
+        )
+
 class LanguageTranslationModel(AgricultureAIModel):
+    INTENT_KEYWORDS = [
+        ('greeting', ['你好', '您好', 'hello', 'hi', '嗨']),
+        ('thanks', ['谢谢', '感谢', '多谢']),
+        ('water', ['浇水', '灌溉', '水分', '湿度']),
+        ('fertilizer', ['施肥', '肥料', '营养', 'npk']),
+        ('pest', ['病虫害', '虫害', '病害', '防治']),
+        ('temperature', ['温度', '气温', '天气']),
+        ('soil', ['土壤', 'ph', '酸碱']),
+        ('status', ['怎么样', '情况', '状态', '如何'])
+    ]
+    INTENT_CONFIG_PATH = "intent_keywords.json"
+    GENERIC_INTENTS = ('status', 'unknown')
+    # 各意图的回复文本实际用到的读数；缓存键只包含这些读数，建议文本始终用原始读数生成
+    INTENT_METRICS = {
+        'water': ('soil_moisture', 'soil_moisture_6h_slope'),
+        'fertilizer': ('npk_nitrogen', 'npk_phosphorus', 'npk_potassium'),
+        'temperature': ('temperature',),
+        'soil': ('soil_ph',),
+        'status': ('soil_moisture', 'soil_moisture_6h_slope', 'temperature'),
+        'unknown': ('soil_moisture', 'soil_moisture_6h_slope', 'temperature')
+    }
+    SIGNATURE_METRICS = (
+        'soil_moisture', 'soil_moisture_6h_slope', 'temperature', 'soil_ph',
+        'npk_nitrogen', 'npk_phosphorus', 'npk_potassium'
+    )
+    TREND_ALERT_SLOPE = -0.5
+    
     def __init__(self):
         super().__init__("agriculture_language_model", "translation")
         self.agriculture_knowledge_base = {}
         self.language_templates = {}
         self.user_context = {}
+        self.response_cache = LRUCache(max_size=2048, ttl=300)
+        self.location_signatures = {}
+        self.intent_classifier = IntentClassifier(self.INTENT_KEYWORDS)
+        if os.path.exists(self.INTENT_CONFIG_PATH):
+            self.intent_classifier.load_config(self.INTENT_CONFIG_PATH)
         self.load_agriculture_templates()
         self.build_agriculture_knowledge_base()
     
@@ -194,45 +441,122 @@ class LanguageTranslationModel(AgricultureAIModel):
             printLog(f"语言模型训练失败: {e}", "ERROR")
             self.model = "fallback_language_model"
     
-    def predict(self, model_a_output, sensor_data=None, user_message=None, **kwargs):
+    def predict(self, model_a_output, sensor_data=None, user_message=None, language='zh-CN', **kwargs):
         try:
             if user_message:
-                return self.generate_contextual_response(user_message, model_a_output, sensor_data)
+                return self.generate_contextual_response(user_message, model_a_output, sensor_data, language)
             else:
                 return self.generate_detailed_advice(model_a_output, sensor_data)
         except Exception as e:
             printLog(f"语言翻译出错: {e}", "ERROR")
             return "目前无法提供农业建议，请稍后重试。"
     
-    def generate_contextual_response(self, user_message, crop_status, sensor_data):
-        message_lower = user_message.lower()
+    def predict_stream(self, model_a_output, sensor_data=None, user_message=None, language='zh-CN', **kwargs):
+        try:
+            if user_message:
+                yield from self.iter_contextual_response(user_message, model_a_output, sensor_data, language)
+            else:
+                yield from self.iter_detailed_advice(model_a_output, sensor_data)
+        except Exception as e:
+            printLog(f"语言翻译出错: {e}", "ERROR")
+            yield "目前无法提供农业建议，请稍后重试。"
+    
+    def detect_intents(self, user_message):
+        intents = tuple(self.intent_classifier.intents(user_message))
+        # “如何/情况”等泛化词只在没有具体意图时才触发整体状态报告
+        specific = tuple(intent for intent in intents if intent not in self.GENERIC_INTENTS)
+        return specific or intents or ('unknown',)
+    
+    def state_signature(self, sensor_data):
+        sensor_data = sensor_data or {}
+        return tuple((key, sensor_data.get(key)) for key in self.SIGNATURE_METRICS)
+    
+    def response_signature(self, intents, sensor_data):
+        sensor_data = sensor_data or {}
+        metrics = set()
+        for intent in intents:
+            metrics.update(self.INTENT_METRICS.get(intent, ()))
+        signature = []
+        for key in self.SIGNATURE_METRICS:
+            if key not in metrics:
+                continue
+            value = sensor_data.get(key)
+            if key == 'soil_moisture_6h_slope' and (value is None or value > self.TREND_ALERT_SLOPE):
+                # 未达到提示阈值的趋势不出现在文本中
+                value = None
+            signature.append((key, value))
+        return tuple(signature)
+    
+    def observe_sensor_state(self, location, sensor_data):
+        signature = self.state_signature(sensor_data)
+        previous = self.location_signatures.get(location)
+        if previous == signature:
+            return False
+        self.location_signatures[location] = signature
+        if previous is not None and previous not in self.location_signatures.values():
+            self.response_cache.invalidate_tag(previous)
+        return True
+    
+    def generate_contextual_response(self, user_message, crop_status, sensor_data, language='zh-CN'):
+        return "".join(self.iter_contextual_response(user_message, crop_status, sensor_data, language))
+    
+    def iter_contextual_response(self, user_message, crop_status, sensor_data, language='zh-CN'):
+        intents = self.detect_intents(user_message)
+        sensor_data = sensor_data or {}
+        if intents == ('unknown',):
+            yield f"🤔 您问的是 '{user_message}' 吗？我可以帮您分析：\n\n"
         
-        if any(word in message_lower for word in ['你好', '您好', 'hello', 'hi', '嗨']):
-            return "🌱 您好！我是果农助手，专门为柑橘种植提供智能建议。请问您想了解什么？"
+        cache_key = (intents, crop_status, self.response_signature(intents, sensor_data), language)
+        response = self.response_cache.get(cache_key)
+        if response is not None:
+            yield response
+        else:
+            sections = []
+            for index, intent in enumerate(intents):
+                if index:
+                    sections.append("\n\n")
+                    yield "\n\n"
+                for section in self.iter_intent_response(intent, crop_status, sensor_data):
+                    sections.append(section)
+                    yield section
+            self.response_cache.set(cache_key, "".join(sections), tag=self.state_signature(sensor_data))
         
-        if any(word in message_lower for word in ['谢谢', '感谢', '多谢']):
+        snippets = self.format_knowledge_snippets(user_message)
+        if snippets:
+            yield snippets
+    
+    def format_knowledge_snippets(self, user_message, top_k=1):
+        snippets = self.knowledge_base.search(user_message, top_k=top_k)
+        if not snippets:
+            return ""
+        return "\n\n📚 **相关知识**:\n" + "\n".join(
+            f"• {snippet['title']}: {snippet['content']}" for snippet in snippets
+        )
+    
+    def iter_intent_response(self, intent, crop_status, sensor_data):
+        if intent == 'fertilizer':
+            yield from self.iter_fertilizer_advice(crop_status, sensor_data)
+        elif intent in ('status', 'unknown'):
+            yield from self.iter_detailed_advice(crop_status, sensor_data)
+        else:
+            yield self.build_intent_response(intent, crop_status, sensor_data)
+    
+    def build_intent_response(self, intent, crop_status, sensor_data):
+        if intent == 'greeting':
+            return "🌱 您好！我是果农助手，专门为柑橘种植提供智能建议。请问您想了解什么？"
+        if intent == 'thanks':
             return "🙏 不客气！随时为您提供农业咨询服务。"
-        
-        if any(word in message_lower for word in ['浇水', '灌溉', '水分', '湿度']):
+        if intent == 'water':
             return self.generate_water_advice(crop_status, sensor_data)
-        
-        if any(word in message_lower for word in ['施肥', '肥料', '营养', 'npk']):
+        if intent == 'fertilizer':
             return self.generate_fertilizer_advice(crop_status, sensor_data)
-        
-        if any(word in message_lower for word in ['病虫害', '虫害', '病害', '防治']):
+        if intent == 'pest':
             return self.generate_pest_control_advice()
-        
-        if any(word in message_lower for word in ['温度', '气温', '天气']):
+        if intent == 'temperature':
             return self.generate_temperature_advice(sensor_data)
-        
-        if any(word in message_lower for word in ['土壤', 'ph', '酸碱']):
+        if intent == 'soil':
             return self.generate_soil_advice(sensor_data)
-        
-        if any(word in message_lower for word in ['怎么样', '情况', '状态', '如何']):
-            return self.generate_detailed_advice(crop_status, sensor_data)
-        
-        return f"🤔 您问的是 '{user_message}' 吗？我可以帮您分析：\n\n" + \
-               self.generate_detailed_advice(crop_status, sensor_data)
+        return self.generate_detailed_advice(crop_status, sensor_data)
     
     def generate_water_advice(self, crop_status, sensor_data):
         moisture = sensor_data.get('soil_moisture', 50)
@@ -246,10 +570,17 @@ class LanguageTranslationModel(AgricultureAIModel):
         else:
             advice = f"✅ **水分适宜**\n当前土壤湿度{moisture}%处于理想范围。\n保持当前灌溉频率即可。"
         
+        slope = sensor_data.get('soil_moisture_6h_slope')
+        if slope is not None and slope <= self.TREND_ALERT_SLOPE:
+            advice += f"\n📉 近6小时土壤湿度每小时下降约{-slope}%，请提前安排灌溉。"
+        
         advice += "\n\n🌱 **柑橘浇水知识**: 开花期保持30-40%湿度，果实膨大期保持40-50%湿度。"
         return advice
     
     def generate_fertilizer_advice(self, crop_status, sensor_data):
+        return "".join(self.iter_fertilizer_advice(crop_status, sensor_data))
+    
+    def iter_fertilizer_advice(self, crop_status, sensor_data):
         nitrogen = sensor_data.get('npk_nitrogen', 50)
         phosphorus = sensor_data.get('npk_phosphorus', 40)
         potassium = sensor_data.get('npk_potassium', 45)
@@ -258,9 +589,10 @@ class LanguageTranslationModel(AgricultureAIModel):
         advice += f"• 氮(N): {nitrogen}% {'✅充足' if nitrogen > 40 else '⚠️不足'}\n"
         advice += f"• 磷(P): {phosphorus}% {'✅充足' if phosphorus > 30 else '⚠️不足'}\n"
         advice += f"• 钾(K): {potassium}% {'✅充足' if potassium > 35 else '⚠️不足'}\n\n"
+        yield advice
         
         if nitrogen < 40 or phosphorus < 30 or potassium < 35:
-            advice += "💡 **施肥建议**:\n"
+            advice = "💡 **施肥建议**:\n"
             if nitrogen < 40:
                 advice += "• 补充氮肥促进新梢生长\n"
             if phosphorus < 30:
@@ -269,9 +601,8 @@ class LanguageTranslationModel(AgricultureAIModel):
                 advice += "• 补充钾肥提高果实品质\n"
             advice += "\n推荐NPK复合肥，比例2:1:1"
         else:
-            advice += "✅ **营养状况良好**，保持当前施肥方案即可。"
-        
-        return advice
+            advice = "✅ **营养状况良好**，保持当前施肥方案即可。"
+        yield advice
     
     def generate_pest_control_advice(self):
         advice = "🐛 **柑橘常见病虫害防治**:\n\n"
@@ -315,7 +646,10 @@ class LanguageTranslationModel(AgricultureAIModel):
         return advice
     
     def generate_detailed_advice(self, crop_status, sensor_data):
-        base_advice = self.translate_to_natural_language(crop_status)
+        return "".join(self.iter_detailed_advice(crop_status, sensor_data))
+    
+    def iter_detailed_advice(self, crop_status, sensor_data):
+        yield self.translate_to_natural_language(crop_status)
         details = []
         
         moisture = sensor_data.get('soil_moisture')
@@ -328,6 +662,9 @@ class LanguageTranslationModel(AgricultureAIModel):
                 details.append(f"土壤湿度{moisture}%过高，注意排水")
             else:
                 details.append(f"土壤湿度{moisture}%适宜")
+            slope = sensor_data.get('soil_moisture_6h_slope')
+            if slope is not None and slope <= self.TREND_ALERT_SLOPE:
+                details.append(f"近6小时湿度每小时下降约{-slope}%，持续变干")
         
         temperature = sensor_data.get('temperature')
         if temperature is not None:
@@ -339,11 +676,9 @@ class LanguageTranslationModel(AgricultureAIModel):
                 details.append(f"温度{temperature}℃适宜")
         
         if details:
-            advice = base_advice + "\n\n📊 **详细分析**:\n• " + "\n• ".join(details)
+            yield "\n\n📊 **详细分析**:\n• " + "\n• ".join(details)
         else:
-            advice = base_advice + "\n\n💡 建议定期检查土壤湿度和营养状况。"
-        
-        return advice
+            yield "\n\n💡 建议定期检查土壤湿度和营养状况。"
     
     def translate_to_natural_language(self, ai_output):
         templates = {
@@ -358,6 +693,11 @@ class LanguageTranslationModel(AgricultureAIModel):
         return templates.get(ai_output, "状态未知，建议人工检查")
     
     def build_agriculture_knowledge_base(self):
+        from S004 import KnowledgeBase
+        self.knowledge_base = KnowledgeBase()
+        self.agriculture_knowledge_base = self.knowledge_base.by_category()
+        if self.agriculture_knowledge_base:
+            return
         self.agriculture_knowledge_base = {
             'citrus': {
                 'irrigation': '柑橘在开花期需要保持土壤湿度30-40%，果实膨大期需要40-50%',
@@ -1,16 +1,26 @@
 from S001 import *
+from S007 import RollingFeatureEngine
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 
+MODEL_PATH = "sensor_model.joblib"
+TRAINING_DATA_PATH = "sensor_history.csv"
+SENSOR_CONFIG_PATH = "sensor_config.json"
+DEFAULT_CROP = "citrus"
+
 class AgricultureAISystem:
     def __init__(self):
         self.data_collector = IoTDataCollector()
         self.model_a = SensorDataModel()
         self.model_b = LanguageTranslationModel()
-        self.evaluator = ResultEvaluator()
+        self.evaluator = None
         self.is_trained = False
         self.system_status = "initialized"
         self.last_prediction = None
+        self.location_predictions = {}
+        self.location_crops = {}
+        self.feature_engine = RollingFeatureEngine()
         printLog("农业AI系统初始化完成")
     
     def setup_iot_sensors(self, sensor_configs):
@@ -22,18 +32,37 @@ class AgricultureAISystem:
             {'type': 'ph_sensor', 'id': 'ph_001', 'location': 'field_3'},
             {'type': 'npk_sensor', 'id': 'npk_001', 'location': 'field_3'}
         ]
+        if not sensor_configs and os.path.exists(SENSOR_CONFIG_PATH):
+            sensor_configs = json_file_to_dict(SENSOR_CONFIG_PATH)
         configs = sensor_configs if sensor_configs else default_sensors
         for config in configs:
             self.data_collector.add_sensor(config['type'], config['id'], config)
-        printLog(f"传感器配置完成: {len(configs)}个传感器")
+            location = config.get('location', 'default')
+            self.location_crops.setdefault(location, config.get('crop', DEFAULT_CROP))
+        printLog(f"传感器配置完成: {len(configs)}个传感器, {len(self.location_crops)}个地块")
+    
+    def location_priority(self, location, sensor_data, recent_faults=False):
+        sensor_data = self.with_trend_features(location, sensor_data)
+        priority = 0
+        moisture = sensor_data.get('soil_moisture')
+        if moisture is not None and moisture < 30:
+            priority += 2
+        slope = sensor_data.get('soil_moisture_6h_slope')
+        if slope is not None and slope <= DRYING_SLOPE:
+            priority += 1
+        if recent_faults:
+            priority += 1
+        return priority
     
-    def training_pipeline(self):
+    def training_pipeline(self, training_data=None):
         print("开始训练农业AI模型...")
         self.system_status = "training"
         try:
-            sensor_data = self.collect_training_data()
+            sensor_data = training_data if training_data is not None else self.collect_training_data()
             print("训练传感器数据分析模型...")
             self.model_a.train(sensor_data)
+            if not isinstance(self.model_a.model, str):
+                self.model_a.saveModel(MODEL_PATH)
             print("训练语言翻译模型...")
             language_data = self.load_language_training_data()
             self.model_b.train(language_data)
@@ -44,37 +73,128 @@ class AgricultureAISystem:
             self.system_status = "training_failed"
             printLog(f"训练流水线失败: {e}", "ERROR")
     
-    def inference_pipeline(self, real_time_data=None):
+    def inference_pipeline(self, real_time_data=None, location=None):
         try:
+            if real_time_data is not None:
+                # 外部传入的原始读数在入口处规范化一次
+                real_time_data = normalize_readings(real_time_data.get('readings', real_time_data))
             if not self.is_trained:
                 printLog("模型未训练，使用模拟推理", "WARNING")
                 return self.simulate_inference(real_time_data)
             
             if real_time_data is None:
-                raw_data = self.data_collector.collect_data()
-                real_time_data = self.data_collector.preprocess_data(raw_data)
-            
-            printLog("运行传感器数据分析...")
-            model_a_output = self.model_a.predict(real_time_data)
-            printLog("生成自然语言建议...")
-            human_readable_output = self.model_b.predict(model_a_output, real_time_data)
+                results = self.analyze_locations()
+            else:
+                results = self.analyze_locations({location or 'default': real_time_data})
+            if not results:
+                return "暂无传感器数据，请检查传感器配置。"
             
-            self.last_prediction = {
-                'timestamp': datetime.now().isoformat(),
-                'sensor_data': real_time_data,
-                'model_a_output': model_a_output,
-                'final_advice': human_readable_output
-            }
-            self.system_status = "running"
-            return human_readable_output
+            selected = results.get(location) or next(iter(results.values()))
+            return selected['final_advice']
             
         except Exception as e:
             self.system_status = "error"
             printLog(f"推理流水线失败: {e}", "ERROR")
             return "系统暂时无法提供建议，请稍后重试。"
     
+    def with_trend_features(self, location, sensor_data):
+        if location is None:
+            return sensor_data
+        trend = self.feature_engine.get_location_features(location, self.model_a.trend_columns)
+        return dict(sensor_data, **trend) if trend else sensor_data
+    
+    def answer_question(self, user_message, sensor_data, language='zh-CN', location=None):
+        started = time.perf_counter()
+        sensor_data = self.with_trend_features(location, sensor_data)
+        observe_stage('preprocess', started)
+        started = time.perf_counter()
+        model_a_output = self.model_a.predict(sensor_data)
+        observe_stage('model_a', started)
+        started = time.perf_counter()
+        response = self.model_b.predict(
+            model_a_output,
+            sensor_data,
+            user_message=user_message,
+            language=language
+        )
+        observe_stage('model_b', started)
+        return response
+    
+    def answer_question_stream(self, user_message, sensor_data, language='zh-CN', location=None):
+        started = time.perf_counter()
+        sensor_data = self.with_trend_features(location, sensor_data)
+        observe_stage('preprocess', started)
+        started = time.perf_counter()
+        model_a_output = self.model_a.predict(sensor_data)
+        observe_stage('model_a', started)
+        yield from self.model_b.predict_stream(
+            model_a_output,
+            sensor_data,
+            user_message=user_message,
+            language=language
+        )
+    
+    def analyze_locations(self, location_data=None):
+        # location_data 为每个地块一行的 SensorReadingBatch，或 {地块: 读数} 字典
+        if location_data is None:
+            location_data = self.data_collector.collect_by_location()
+        if isinstance(location_data, SensorReadingBatch):
+            batch = location_data
+        else:
+            batch = SensorReadingBatch.from_readings(location_data)
+        if not len(batch):
+            return {}
+        started = time.perf_counter()
+        locations = batch.location_names()
+        location_data = {
+            loc: self.with_trend_features(loc, values)
+            for loc, (sensor_id, location, timestamp, values) in zip(locations, batch.rows())
+        }
+        for name in self.model_a.trend_columns:
+            batch.derived[name] = [location_data[loc].get(name, NAN) for loc in locations]
+        observe_stage('preprocess', started)
+        
+        printLog(f"运行传感器数据分析: {len(locations)}个地块...")
+        started = time.perf_counter()
+        model_a_outputs = self.model_a.predict_batch(batch)
+        observe_stage('model_a_batch', started)
+        printLog("生成自然语言建议...")
+        timestamp = datetime.now().isoformat()
+        results = {}
+        for loc, model_a_output in zip(locations, model_a_outputs):
+            started = time.perf_counter()
+            advice = self.model_b.predict(model_a_output, location_data[loc])
+            observe_stage('model_b', started)
+            results[loc] = {
+                'timestamp': timestamp,
+                'location': loc,
+                'crop': self.location_crops.get(loc, DEFAULT_CROP),
+                'sensor_data': location_data[loc],
+                'model_a_output': model_a_output,
+                'final_advice': advice
+            }
+        
+        self.location_predictions.update(results)
+        self.last_prediction = results[locations[-1]]
+        self.system_status = "running"
+        return results
+    
+    def load_pretrained_models(self, model_path=MODEL_PATH):
+        if not os.path.exists(model_path):
+            return False
+        self.model_a.loadModel(model_path)
+        if self.model_a.model is None or isinstance(self.model_a.model, str):
+            return False
+        self.model_b.train(self.load_language_training_data())
+        self.is_trained = True
+        self.system_status = "ready"
+        printLog(f"已加载预训练模型: {model_path}")
+        return True
+    
     def collect_training_data(self):
         printLog("收集训练数据...")
+        if os.path.exists(TRAINING_DATA_PATH):
+            return TRAINING_DATA_PATH
         return {"simulated": "training_data"}
     
     def load_language_training_data(self):
@@ -100,14 +220,7 @@ class AgricultureAISystem:
                 'npk_potassium': 28
             }
         
-        moisture = sensor_data.get('soil_moisture', 50)
-        if moisture < 30:
-            model_a_output = "needs_water"
-        elif moisture > 60:
-            model_a_output = "too_much_water"
-        else:
-            model_a_output = "healthy"
-        
+        model_a_output = self.model_a.predict_batch([sensor_data])[0]
         advice = self.model_b.predict(model_a_output, sensor_data)
         self.last_prediction = {
             'timestamp': datetime.now().isoformat(),
@@ -122,54 +235,194 @@ class AgricultureAISystem:
             'status': self.system_status,
             'is_trained': self.is_trained,
             'last_prediction_time': self.last_prediction['timestamp'] if self.last_prediction else None,
-            'sensors_configured': len(self.data_collector.sensors)
+            'sensors_configured': len(self.data_collector.sensors),
+            'response_cache': self.model_b.response_cache.get_stats(),
+            'feature_engine': self.feature_engine.get_stats()
         }
         return status_info
     
     def evaluate_results(self, predictions, ground_truth=None):
+        # 评估器只在离线评估时用到，首次调用再创建
+        if self.evaluator is None:
+            self.evaluator = ResultEvaluator()
         return self.evaluator.evaluate(predictions, ground_truth)
+    
+    def evaluate_results_batch(self, predictions_list, ground_truths=None):
+        if self.evaluator is None:
+            self.evaluator = ResultEvaluator()
+        return self.evaluator.evaluate_batch(predictions_list, ground_truths)
+
+JUDGE_MODELS = {'gpt4': 'gpt-4', 'deepseek': 'deepseek-chat', 'qwen': 'qwen-max', 'gemini': 'gemini-pro'}
+DEFAULT_JUDGE_WEIGHTS = {'gpt4': 1.0, 'deepseek': 1.0, 'qwen': 1.0, 'gemini': 1.0}
 
 class ResultEvaluator:
-    def __init__(self):
-        self.llm_apis = {
-            'gpt4': GPT4Evaluator(),
-            'deepseek': DeepSeekEvaluator(),
-            'qwen': QWenEvaluator(),
-            'gemini': GeminiEvaluator()
-        }
-        printLog("结果评估器初始化完成")
+    # 各评估器并发打分：有界线程池限制并发，每个评估器独立超时，超时或出错的评估器不参与加权聚合
+    def __init__(self, judge_url=None, weights=None, timeout=30.0, timeouts=None, max_concurrency=8, chunk_size=32):
+        self.timeout = timeout
+        self.timeouts = timeouts or {}
+        self.max_concurrency = max_concurrency
+        self.chunk_size = chunk_size
+        judge_url = judge_url or os.environ.get("KISSAN_JUDGE_URL")
+        if judge_url:
+            self.llm_apis = {
+                name: RemoteJudgeEvaluator(judge_url, model, self.timeouts.get(name, timeout))
+                for name, model in JUDGE_MODELS.items()
+            }
+        else:
+            self.llm_apis = {
+                'gpt4': GPT4Evaluator(),
+                'deepseek': DeepSeekEvaluator(),
+                'qwen': QWenEvaluator(),
+                'gemini': GeminiEvaluator()
+            }
+        self.weights = dict(DEFAULT_JUDGE_WEIGHTS, **(weights or {}))
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="evaluator")
+        self.timeout_count = 0
+        self.error_count = 0
+        printLog(f"结果评估器初始化完成: {'远程评审 ' + judge_url if judge_url else '本地评估器'}, 并发上限{max_concurrency}")
     
     def evaluate(self, predictions, ground_truth=None):
-        evaluations = {}
+        return self.evaluate_batch([predictions], [ground_truth])[0]
+    
+    def evaluate_batch(self, predictions_list, ground_truths=None):
+        # 按 (评估器, 分块) 提交任务，所有评估器的所有分块共享同一个有界线程池
+        ground_truths = ground_truths if ground_truths is not None else [None] * len(predictions_list)
+        chunks = [
+            (start, predictions_list[start:start + self.chunk_size], ground_truths[start:start + self.chunk_size])
+            for start in range(0, len(predictions_list), self.chunk_size)
+        ]
+        submitted = time.monotonic()
+        failed = set()
+        started = {}
+        pending = {}
         for name, evaluator in self.llm_apis.items():
-            try:
-                score = evaluator.evaluate_agriculture_output(predictions, ground_truth)
-                evaluations[name] = score
-            except Exception as e:
-                printLog(f"{name} 评估器出错: {e}", "WARNING")
-                evaluations[name] = 0.0
-        return self.aggregate_evaluations(evaluations)
-    
-    def aggregate_evaluations(self, evaluations):
-        if not evaluations:
+            for start, chunk, truths in chunks:
+                key = len(pending)
+                future = self.executor.submit(self.run_chunk, name, evaluator, chunk, truths, failed, started, key)
+                pending[future] = (key, name, start, len(chunk))
+        scores = {name: [None] * len(predictions_list) for name in self.llm_apis}
+        timed_out = set()
+        # 超时从每次调用真正开始执行时计时，排队等待线程池的时间不计入；
+        # 尚未开始的分块最早在此刻开始，按此估计截止时间，醒来后再按实际开始时间重算
+        while pending:
+            now = time.monotonic()
+            remaining = min(
+                started.get(key, now) + self.timeouts.get(name, self.timeout)
+                for key, name, start, size in pending.values()
+            ) - now
+            done, _ = wait(pending, timeout=max(remaining, 0.0), return_when=FIRST_COMPLETED)
+            for future in done:
+                key, name, start, size = pending.pop(future)
+                try:
+                    chunk_scores = future.result()
+                    if chunk_scores is not None:
+                        scores[name][start:start + size] = [float(score) for score in chunk_scores]
+                except Exception as e:
+                    self.error_count += 1
+                    printLog(f"{name} 评估器出错: {e}", "WARNING")
+            now = time.monotonic()
+            for future, (key, name, start, size) in list(pending.items()):
+                if key in started and now >= started[key] + self.timeouts.get(name, self.timeout):
+                    failed.add(name)
+                    timed_out.add(name)
+            # 超时的评估器在本批次中不再等待：执行中的调用无法中断，排队中的分块直接取消
+            for future, (key, name, start, size) in list(pending.items()):
+                if name in timed_out:
+                    future.cancel()
+                    del pending[future]
+        for name in timed_out:
+            printLog(f"{name} 评估器超时", "WARNING")
+        self.timeout_count += len(timed_out)
+        results = [
+            self.aggregate_evaluations({name: scores[name][i] for name in self.llm_apis}, log=False)
+            for i in range(len(predictions_list))
+        ]
+        printLog(f"批量评估完成: {len(predictions_list)}条, 耗时{time.monotonic() - submitted:.2f}s")
+        return results
+    
+    def run_chunk(self, name, evaluator, chunk, truths, failed, started, key):
+        # 同一批次中某评估器已失败时，跳过它剩余的分块，不再占用线程池
+        if name in failed:
+            return None
+        started[key] = time.monotonic()
+        try:
+            return evaluator.evaluate_batch(chunk, truths)
+        except Exception:
+            failed.add(name)
+            raise
+    
+    def aggregate_evaluations(self, evaluations, weights=None, log=True):
+        weights = weights or self.weights
+        valid = {name: score for name, score in evaluations.items() if score is not None and weights.get(name, 0.0) > 0}
+        if not valid:
             return 0.0
-        total_score = sum(evaluations.values())
-        average_score = total_score / len(evaluations)
-        printLog(f"评估结果聚合完成: {average_score:.3f}")
+        total_weight = sum(weights[name] for name in valid)
+        average_score = sum(score * weights[name] for name, score in valid.items()) / total_weight
+        if log:
+            printLog(f"评估结果聚合完成: {average_score:.3f} ({len(valid)}/{len(evaluations)}个评估器)")
         return average_score
+    
+    def get_stats(self):
+        return {
+            'evaluators': list(self.llm_apis),
+            'weights': dict(self.weights),
+            'timeouts': self.timeout_count,
+            'errors': self.error_count
+        }
+    
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+class JudgeEvaluator(ABC):
+    @abstractmethod
+    def evaluate_agriculture_output(self, predictions, ground_truth):
+        pass
+    
+    def evaluate_batch(self, predictions_list, ground_truths):
+        return [self.evaluate_agriculture_output(p, g) for p, g in zip(predictions_list, ground_truths)]
 
-class GPT4Evaluator:
+class RemoteJudgeEvaluator(JudgeEvaluator):
+    # 远程评审模型：一次请求为一整块预测打分，复用 BackendClient 的连接池与重试
+    def __init__(self, judge_url, model, timeout=30.0):
+        from S008 import BackendClient
+        self.url = f"{judge_url.rstrip('/')}/v1/judge"
+        self.model = model
+        self.timeout = timeout
+        self.client = BackendClient(pool_size=4, timeout=timeout, max_retries=1)
+    
+    def evaluate_batch(self, predictions_list, ground_truths):
+        items = json.loads(json.dumps(
+            [{'prediction': p, 'ground_truth': g} for p, g in zip(predictions_list, ground_truths)],
+            ensure_ascii=False, default=str
+        ))
+        response = self.client.post_json(self.url, {'model': self.model, 'items': items})
+        if response is None or response.status_code != 200:
+            raise RuntimeError(f"评审服务不可用: {self.model}")
+        scores = response.json().get('scores', [])
+        if len(scores) != len(items):
+            raise RuntimeError(f"评审结果数量不匹配: {len(scores)}/{len(items)}")
+        return scores
+    
+    def evaluate_agriculture_output(self, predictions, ground_truth):
+        return self.evaluate_batch([predictions], [ground_truth])[0]
+
+class GPT4Evaluator(JudgeEvaluator):
     def evaluate_agriculture_output(self, predictions, ground_truth):
         return 0.85
 
-class DeepSeekEvaluator:
+class DeepSeekEvaluator(JudgeEvaluator):
     def evaluate_agriculture_output(self, predictions, ground_truth):
         return 0.82
 
-class QWenEvaluator:
+class QWenEvaluator(JudgeEvaluator):
     def evaluate_agriculture_output(self, predictions, ground_truth):
         return 0.80
 
-class GeminiEvaluator:
+class GeminiEvaluator(JudgeEvaluator):
     def evaluate_agriculture_output(self, predictions, ground_truth):
-        return 0.78
\ No newline at end of file
+        return 0.78
+
+if __name__ == "__main__":
+    import sys
+    system = AgricultureAISystem()
+    system.training_pipeline(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,258 @@
+from S000 import *
+import threading
+import time
+from collections import OrderedDict
+
+def parse_batch_body(body, content_type=""):
+    text = body.decode('utf-8') if isinstance(body, bytes) else body
+    if 'ndjson' not in content_type:
+        try:
+            data = json.loads(text)
+            return (data if isinstance(data, list) else [data]), []
+        except ValueError:
+            if text.lstrip().startswith('[') or '\n' not in text.strip():
+                raise
+    items, errors = [], []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            items.append(json.loads(line))
+        except ValueError as e:
+            errors.append({'index': len(items), 'error': f"JSON解析失败: {e}"})
+            items.append(None)
+    return items, errors
+
+def validate_reading(item):
+    if not isinstance(item, dict):
+        return "读数必须是JSON对象"
+    for field in ('sensor_id', 'location'):
+        value = item.get(field)
+        if isinstance(value, bool) or not isinstance(value, (str, int)) or not str(value).strip():
+            return f"缺少{field}字段"
+    readings = item.get('readings')
+    if not isinstance(readings, dict):
+        return "缺少readings字段"
+    if not normalize_readings(readings):
+        return "readings中没有数值型读数"
+    return None
+
+def validate_batch(items, parse_errors=None):
+    # 返回 ([(原始下标, 读数)], 错误列表)，下标用于逐条结果
+    failed = {e['index'] for e in parse_errors or []}
+    errors = list(parse_errors or [])
+    valid = []
+    for index, item in enumerate(items):
+        if index in failed:
+            continue
+        error = validate_reading(item)
+        if error:
+            errors.append({'index': index, 'error': error})
+        else:
+            valid.append((index, item))
+    errors.sort(key=lambda e: e['index'])
+    return valid, errors
+
+class SensorSeries:
+    # 每个传感器一组预分配环形缓冲区：时间戳一列，每个指标一列
+    def __init__(self, sensor_id, location, capacity):
+        import numpy as np
+        self.sensor_id = sensor_id
+        self.location = location
+        self.capacity = capacity
+        self.timestamps = np.full(capacity, np.nan, dtype=np.float64)
+        self.metrics = {}
+        self.head = 0
+        self.size = 0
+        self.latest = {}
+        self.latest_timestamp = None
+
+    def append(self, timestamp, values):
+        # 只为规范指标建列，其他键直接丢弃，每个序列最多 len(READING_METRICS) 列
+        values = {name: value for name, value in values.items() if name in READING_METRICS}
+        i = self.head
+        self.timestamps[i] = timestamp
+        for name, column in self.metrics.items():
+            column[i] = values.get(name, NAN)
+        for name, value in values.items():
+            if name not in self.metrics:
+                import numpy as np
+                column = np.full(self.capacity, np.nan, dtype=np.float32)
+                column[i] = value
+                self.metrics[name] = column
+        self.head = (i + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+        self.latest.update(values)
+        self.latest_timestamp = timestamp
+
+    def ordered_indices(self):
+        import numpy as np
+        if self.size < self.capacity:
+            return np.arange(self.size)
+        return (np.arange(self.capacity) + self.head) % self.capacity
+
+    def window(self, start=None, end=None, metrics=None):
+        import numpy as np
+        idx = self.ordered_indices()
+        ts = self.timestamps[idx]
+        mask = np.ones(len(ts), dtype=bool)
+        if start is not None:
+            mask &= ts >= start
+        if end is not None:
+            mask &= ts <= end
+        idx = idx[mask]
+        names = metrics if metrics else list(self.metrics.keys())
+        return self.timestamps[idx], {
+            name: self.metrics[name][idx] for name in names if name in self.metrics
+        }
+
+    def downsample(self, start, end, bucket_seconds, metrics=None):
+        import numpy as np
+        ts, columns = self.window(start, end, metrics)
+        if len(ts) == 0:
+            return np.empty(0), {name: np.empty(0) for name in columns}
+        origin = start if start is not None else ts.min()
+        buckets = np.floor((ts - origin) / bucket_seconds).astype(np.int64)
+        uniq, inverse = np.unique(buckets, return_inverse=True)
+        result = {}
+        for name, values in columns.items():
+            valid = ~np.isnan(values)
+            sums = np.bincount(inverse, weights=np.where(valid, values, 0.0), minlength=len(uniq))
+            counts = np.bincount(inverse, weights=valid.astype(np.float64), minlength=len(uniq))
+            with np.errstate(invalid='ignore', divide='ignore'):
+                result[name] = sums / counts
+        return origin + uniq * bucket_seconds, result
+
+    def to_dict(self):
+        return {
+            'sensor_id': self.sensor_id,
+            'location': self.location,
+            'timestamp': datetime.fromtimestamp(self.latest_timestamp).isoformat() if self.latest_timestamp else None,
+            'readings': dict(self.latest),
+            'count': self.size
+        }
+
+def query_series(series, start=None, end=None, bucket_seconds=None, metrics=None):
+    if bucket_seconds:
+        ts, columns = series.downsample(start, end, bucket_seconds, metrics)
+    else:
+        ts, columns = series.window(start, end, metrics)
+    return {
+        'sensor_id': series.sensor_id,
+        'location': series.location,
+        'timestamps': [datetime.fromtimestamp(t).isoformat() for t in ts.tolist()],
+        'metrics': {
+            name: [None if v != v else round(v, 4) for v in values.tolist()]
+            for name, values in columns.items()
+        }
+    }
+
+class SensorTimeSeriesStore:
+    def __init__(self, capacity=2880, max_series=1024, max_locations=1024):
+        self.capacity = capacity
+        self.max_series = max_series
+        self.max_locations = max_locations
+        self.series = OrderedDict()
+        self.location_latest = OrderedDict()
+        self.latest_payload = {}
+        self.latest_values = {}
+        self.lock = threading.Lock()
+        self.total_readings = 0
+        self.observers = []
+
+    def add_observer(self, observer):
+        self.observers.append(observer)
+
+    def ingest(self, payload):
+        return self.ingest_many([payload])[0]
+
+    def ingest_many(self, payloads):
+        return self.ingest_batch(SensorReadingBatch.from_payloads(payloads))
+
+    def ingest_batch(self, batch):
+        with self.lock:
+            written = [self.append_values(*row) for row in batch.rows()]
+            if written:
+                sensor_id, location, timestamp = written[-1]
+                self.latest_payload = {
+                    'sensor_id': sensor_id,
+                    'location': location,
+                    'timestamp': datetime.fromtimestamp(timestamp).isoformat(),
+                    'readings': dict(self.latest_values)
+                }
+            return written
+
+    def append_values(self, sensor_id, location, timestamp, values):
+        key = (location, sensor_id)
+        series = self.series.get(key)
+        if series is None:
+            series = SensorSeries(sensor_id, location, self.capacity)
+            self.series[key] = series
+            if len(self.series) > self.max_series:
+                self.series.popitem(last=False)
+        else:
+            self.series.move_to_end(key)
+        series.append(timestamp, values)
+        latest = self.location_latest.get(location)
+        if latest is None:
+            latest = self.location_latest[location] = {}
+            if len(self.location_latest) > self.max_locations:
+                self.location_latest.popitem(last=False)
+        else:
+            self.location_latest.move_to_end(location)
+        latest.update(values)
+        self.latest_values = values
+        self.total_readings += 1
+        for observer in self.observers:
+            observer(sensor_id, location, timestamp, values)
+        return sensor_id, location, timestamp
+
+    def latest_readings(self, location=None):
+        with self.lock:
+            if location is None:
+                return dict(self.latest_values)
+            return dict(self.location_latest.get(location, {}))
+
+    def location_snapshot(self):
+        with self.lock:
+            return {location: dict(values) for location, values in self.location_latest.items()}
+
+    def location_batch(self, locations=None):
+        # 各地块合并后的最新读数直接填入批量容器，供 predict_batch 使用
+        with self.lock:
+            names = self.location_latest if locations is None else locations
+            return SensorReadingBatch.from_readings({
+                location: self.location_latest[location]
+                for location in names if self.location_latest.get(location)
+            })
+
+    def find_series(self, location=None, sensor_id=None):
+        with self.lock:
+            return [
+                s for (loc, sid), s in self.series.items()
+                if (location is None or loc == location) and (sensor_id is None or sid == sensor_id)
+            ]
+
+    def latest(self, location=None, sensor_id=None):
+        return [s.to_dict() for s in self.find_series(location, sensor_id)]
+
+    def window(self, location=None, sensor_id=None, seconds=3600, metrics=None):
+        end = time.time()
+        return self.range(location, sensor_id, end - seconds, end, None, metrics)
+
+    def range(self, location=None, sensor_id=None, start=None, end=None, bucket_seconds=None, metrics=None):
+        result = []
+        for series in self.find_series(location, sensor_id):
+            with self.lock:
+                result.append(query_series(series, start, end, bucket_seconds, metrics))
+        return result
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'series': len(self.series),
+                'locations': len(self.location_latest),
+                'capacity_per_series': self.capacity,
+                'total_readings': self.total_readings
+            }
@@ -0,0 +1,197 @@
+from S000 import *
+import hashlib
+import heapq
+import math
+
+KB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "citrus_kb.json")
+
+WORD_PATTERN = re.compile(r'[a-z0-9]+|[^\sa-z0-9，。、；：！？,.;:!?()（）\[\]【】"“”\'%-]+')
+
+def tokenize(text):
+    tokens = []
+    for run in WORD_PATTERN.findall(text.lower()):
+        if run.isascii():
+            tokens.append(run)
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+class KnowledgeIndex:
+    # 索引快照：构建完成后不再修改，检索只读取当前快照，无需加锁
+    def __init__(self):
+        self.documents = {}
+        self.doc_terms = {}
+        self.doc_hashes = {}
+        self.doc_lengths = {}
+        self.postings = {}
+        self.total_length = 0
+        self.keyword_pattern = None
+
+    def add_document(self, doc_id, entry, entry_hash, terms):
+        length = sum(terms.values())
+        for term, tf in terms.items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+        self.documents[doc_id] = entry
+        self.doc_terms[doc_id] = terms
+        self.doc_hashes[doc_id] = entry_hash
+        self.doc_lengths[doc_id] = length
+        self.total_length += length
+
+    def build_keyword_pattern(self):
+        keywords = sorted(
+            {term[3:] for term in self.postings if term.startswith('kw:')},
+            key=len, reverse=True
+        )
+        self.keyword_pattern = re.compile('|'.join(re.escape(k) for k in keywords)) if keywords else None
+
+class KnowledgeBase:
+    # BM25 倒排索引：关键词 + 标题/正文字符二元组
+    # 文件变更由后台线程按 check_interval 检查，新索引构建完成后整体替换，检索请求不承担重建开销
+    KEYWORD_BOOST = 3
+    TITLE_BOOST = 2
+
+    def __init__(self, kb_path=KB_PATH, k1=1.5, b=0.75, check_interval=2.0):
+        self.kb_path = kb_path
+        self.k1 = k1
+        self.b = b
+        self.check_interval = check_interval
+        self.index = KnowledgeIndex()
+        self.file_signature = None
+        self.reload_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.watcher = None
+        self.reloads = 0
+        self.reload_if_changed(force=True)
+        if check_interval:
+            self.start_watcher()
+
+    def start_watcher(self):
+        if self.watcher is not None:
+            return
+        self.watcher = threading.Thread(target=self.watch_loop, name="kb-watcher", daemon=True)
+        self.watcher.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.watcher is not None:
+            self.watcher.join(timeout=5)
+            self.watcher = None
+
+    def watch_loop(self):
+        while not self.stopped.wait(self.check_interval):
+            try:
+                self.reload_if_changed()
+            except Exception as e:
+                printLog(f"知识库重新加载失败: {e}", "ERROR")
+
+    def load_entries(self):
+        data = json_file_to_dict(self.kb_path)
+        entries = {}
+        if isinstance(data, dict):
+            for crop, items in data.items():
+                for item in items if isinstance(items, list) else []:
+                    if isinstance(item, dict) and item.get('id'):
+                        entries[item['id']] = dict(item, crop=crop)
+        return entries
+
+    def reload_if_changed(self, force=False):
+        with self.reload_lock:
+            try:
+                stat = os.stat(self.kb_path)
+                signature = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                signature = None
+            if not force and signature == self.file_signature:
+                return False
+            self.file_signature = signature
+            previous = self.index
+            index = self.build_index(self.load_entries() if signature else {}, previous)
+            # 属性赋值是原子的：正在检索的请求继续使用旧快照
+            self.index = index
+            self.reloads += 1
+        added = sum(1 for doc_id, h in index.doc_hashes.items() if previous.doc_hashes.get(doc_id) != h)
+        removed = sum(1 for doc_id in previous.documents if doc_id not in index.documents)
+        if added or removed:
+            printLog(f"知识库已更新: 新增/修改{added}条, 删除{removed}条, 共{len(index.documents)}条")
+        return True
+
+    def build_index(self, entries, previous):
+        index = KnowledgeIndex()
+        for doc_id, entry in entries.items():
+            entry_hash = self.entry_hash(entry)
+            # 未变更的条目复用上一份快照的词频，不再重新分词
+            if previous.doc_hashes.get(doc_id) == entry_hash:
+                terms = previous.doc_terms[doc_id]
+            else:
+                terms = self.document_terms(entry)
+            index.add_document(doc_id, entry, entry_hash, terms)
+        index.build_keyword_pattern()
+        return index
+
+    def entry_hash(self, entry):
+        raw = json.dumps(entry, ensure_ascii=False, sort_keys=True)
+        return hashlib.md5(raw.encode('utf-8')).hexdigest()
+
+    def document_terms(self, entry):
+        terms = {}
+        for keyword in entry.get('keywords', []):
+            key = 'kw:' + keyword.lower()
+            terms[key] = terms.get(key, 0) + self.KEYWORD_BOOST
+        for token in tokenize(entry.get('title', '')):
+            terms[token] = terms.get(token, 0) + self.TITLE_BOOST
+        for token in tokenize(entry.get('content', '')):
+            terms[token] = terms.get(token, 0) + 1
+        return terms
+
+    def query_terms(self, index, query):
+        terms = set(tokenize(query))
+        if index.keyword_pattern is not None:
+            terms.update('kw:' + match for match in index.keyword_pattern.findall(query.lower()))
+        return terms
+
+    def search(self, query, top_k=3, category=None):
+        index = self.index
+        doc_count = len(index.documents)
+        if not doc_count or not query:
+            return []
+        avg_length = index.total_length / doc_count
+        scores = {}
+        for term in self.query_terms(index, query):
+            docs = index.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (doc_count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id, tf in docs.items():
+                norm = self.k1 * (1 - self.b + self.b * index.doc_lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        if category:
+            scores = {d: s for d, s in scores.items() if index.documents[d].get('category') == category}
+        ranked = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return [
+            {
+                'id': doc_id,
+                'title': index.documents[doc_id].get('title', ''),
+                'content': index.documents[doc_id].get('content', ''),
+                'category': index.documents[doc_id].get('category', ''),
+                'score': round(score, 4)
+            }
+            for doc_id, score in ranked
+        ]
+
+    def by_category(self):
+        grouped = {}
+        for entry in self.index.documents.values():
+            grouped.setdefault(entry['crop'], {})[entry.get('category', entry['id'])] = entry.get('content', '')
+        return grouped
+
+    def get_stats(self):
+        index = self.index
+        return {
+            'documents': len(index.documents),
+            'terms': len(index.postings),
+            'path': self.kb_path,
+            'reloads': self.reloads,
+            'watching': self.watcher is not None
+        }
@@ -0,0 +1,624 @@
+from S000 import *
+import asyncio
+import contextvars
+import random
+import sys
+import zlib
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
+
+class ExecutorBusyError(Exception):
+    pass
+
+def close_quietly(iterator):
+    try:
+        iterator.close()
+    except (AttributeError, ValueError):
+        pass
+
+class InferenceExecutor:
+    # 同步模型推理放到有界线程池中执行，避免阻塞事件循环
+    def __init__(self, max_workers=4, max_queue=64, timeout=10.0):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.max_queue_depth = 0
+
+    def wrap(self, func, args, kwargs):
+        profiling = profile_scope()
+        def task():
+            with self.lock:
+                self.queued -= 1
+                self.running += 1
+            try:
+                with profiling():
+                    return func(*args, **kwargs)
+            finally:
+                with self.lock:
+                    self.running -= 1
+        return task
+
+    async def run(self, func, *args, timeout=None, **kwargs):
+        with self.lock:
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                raise ExecutorBusyError(f"推理队列已满: {self.queued}")
+            self.queued += 1
+            self.submitted += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queued)
+        future = self.executor.submit(self.wrap(func, args, kwargs))
+        try:
+            result = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            with self.lock:
+                self.timeouts += 1
+                if future.cancel():
+                    self.queued -= 1
+            raise
+        except Exception:
+            with self.lock:
+                self.failed += 1
+            raise
+        with self.lock:
+            self.completed += 1
+        return result
+
+    async def stream(self, func, *args, timeout=None, **kwargs):
+        # 流式生成：生成器的每一步都作为一个任务提交到线程池，受同样的排队上限约束，
+        # 整个生成过程共用一个超时；步与步之间不占用线程
+        deadline = time.monotonic() + (timeout or self.timeout)
+        iterator = iter(func(*args, **kwargs))
+        finished = object()
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    with self.lock:
+                        self.timeouts += 1
+                    raise asyncio.TimeoutError()
+                item = await self.run(next, iterator, finished, timeout=remaining)
+                if item is finished:
+                    return
+                yield item
+        finally:
+            # 超时的那一步可能仍在线程中执行，关闭同样交给线程池
+            self.executor.submit(close_quietly, iterator)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'max_workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'timeout': self.timeout,
+                'queue_depth': self.queued,
+                'max_queue_depth': self.max_queue_depth,
+                'running': self.running,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'timeouts': self.timeouts,
+                'rejected': self.rejected
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+class AnalysisScheduler:
+    # 后台线程按节奏为每个地块预计算分析结果；紧急地块优先排队且刷新更频繁，接口只读缓存
+    def __init__(self, plan_func, analyze_func, interval=300.0, urgent_interval=60.0, urgent_priority=2,
+                 max_workers=2, batch_size=16, tick=5.0, dirty_interval=10.0):
+        self.plan_func = plan_func
+        self.analyze_func = analyze_func
+        self.interval = interval
+        self.urgent_interval = urgent_interval
+        # 收到新读数的地块最多等待 dirty_interval 后重算，连续写入合并为一次分析
+        self.dirty_interval = dirty_interval
+        self.urgent_priority = urgent_priority
+        self.batch_size = batch_size
+        self.tick = tick
+        self.executor = None
+        self.max_workers = max_workers
+        self.results = {}
+        self.last_run = {}
+        self.priorities = {}
+        self.in_flight = set()
+        self.forced = set()
+        self.dirty = set()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.running = False
+        self.cycles = 0
+        self.batches = 0
+        self.analyzed = 0
+        self.failures = 0
+
+    def start(self):
+        if self.thread is not None:
+            return
+        # 线程池随启停重建，多 worker 模式下流处理租约易主后可以再次启动
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="scheduler")
+        self.running = True
+        self.thread = threading.Thread(target=self.loop, name="analysis-scheduler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+            self.thread = None
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        with self.lock:
+            self.in_flight.clear()
+
+    def trigger(self, location):
+        with self.lock:
+            self.forced.add(location)
+        self.wakeup.set()
+
+    def mark_dirty(self, locations):
+        with self.lock:
+            self.dirty.update(locations)
+
+    def loop(self):
+        while self.running:
+            try:
+                self.run_cycle()
+            except Exception as e:
+                printLog(f"调度周期执行失败: {e}", "ERROR")
+            self.wakeup.wait(self.tick)
+            self.wakeup.clear()
+
+    def due_locations(self, plan, now):
+        due = []
+        with self.lock:
+            forced, self.forced = self.forced, set()
+            self.priorities = plan
+            for location in set(plan) | forced | self.dirty:
+                if location in self.in_flight:
+                    continue
+                priority = plan.get(location, 0)
+                cadence = self.urgent_interval if priority >= self.urgent_priority else self.interval
+                if location in self.dirty:
+                    cadence = min(cadence, self.dirty_interval)
+                last_run = self.last_run.get(location)
+                if location in forced or last_run is None or now - last_run >= cadence:
+                    due.append((-priority, last_run or 0.0, location))
+            due.sort()
+            locations = [location for _, _, location in due]
+            self.in_flight.update(locations)
+            self.dirty.difference_update(locations)
+        return locations
+
+    def run_cycle(self):
+        locations = self.due_locations(self.plan_func(), time.monotonic())
+        self.cycles += 1
+        # 线程池按提交顺序执行，紧急地块所在的批次先提交
+        for i in range(0, len(locations), self.batch_size):
+            self.executor.submit(self.run_batch, locations[i:i + self.batch_size])
+
+    def run_batch(self, locations):
+        results = {}
+        completed = locations
+        try:
+            results = self.analyze_func(locations) or {}
+            # 暂无读数的地块不记录运行时间，下个周期继续尝试
+            completed = list(results)
+        except Exception as e:
+            printLog(f"地块分析失败: {locations[:3]}... {e}", "ERROR")
+            with self.lock:
+                self.failures += 1
+        finally:
+            now = time.monotonic()
+            with self.lock:
+                self.in_flight.difference_update(locations)
+                for location in completed:
+                    self.last_run[location] = now
+                self.results.update(results)
+                self.batches += 1
+                self.analyzed += len(results)
+
+    def get(self, location):
+        return self.results.get(location)
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.results)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'running': self.running,
+                'interval': self.interval,
+                'urgent_interval': self.urgent_interval,
+                'max_workers': self.max_workers,
+                'locations': len(self.priorities),
+                'urgent_locations': sum(1 for p in self.priorities.values() if p >= self.urgent_priority),
+                'cached_results': len(self.results),
+                'in_flight': len(self.in_flight),
+                'dirty': len(self.dirty),
+                'cycles': self.cycles,
+                'batches': self.batches,
+                'analyzed': self.analyzed,
+                'failures': self.failures
+            }
+
+HTTP_REQUESTS = metrics.counter("kissan_http_requests_total", "HTTP请求数")
+HTTP_SECONDS = metrics.histogram("kissan_http_request_duration_seconds", "HTTP请求耗时")
+
+class RequestMetricsMiddleware:
+    # 按路由统计请求数与耗时；未注册的路径归为 other，避免标签基数膨胀
+    def __init__(self, app, routes):
+        self.app = app
+        self.routes = routes
+        self.paths = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        if self.paths is None:
+            self.paths = {getattr(route, "path", None) for route in self.routes}
+        path = scope["path"] if scope["path"] in self.paths else "other"
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            labels = (("method", scope["method"]), ("path", path))
+            HTTP_SECONDS.observe(time.perf_counter() - started, labels)
+            HTTP_REQUESTS.inc(labels=labels + (("status", str(status)),))
+
+# 当前请求的剖析上下文 (profiler, tag)，未被选中采样的请求为 None
+PROFILING = contextvars.ContextVar("kissan_profiling", default=None)
+PROFILE_HEADER = b"x-kissan-profile"
+# 事件循环/线程池空闲等待时的栈顶，不计入样本
+IDLE_FRAMES = {"selectors.py:select", "threading.py:wait", "queue.py:get", "thread.py:_worker"}
+
+def profile_scope():
+    # 在事件循环线程中调用，返回可在任意线程中使用的剖析上下文
+    profiling = PROFILING.get()
+    if profiling is None:
+        return nullcontext
+    profiler, tag = profiling
+    return lambda: profiler.track(tag)
+
+def profiled(func):
+    # 在事件循环线程中包装要交给线程池的函数，执行时登记在实际运行的线程上
+    scope = profile_scope()
+    if scope is nullcontext:
+        return func
+    def call(*args, **kwargs):
+        with scope():
+            return func(*args, **kwargs)
+    return call
+
+class StackProfiler:
+    # 采样式剖析：只对选中的请求登记其所在线程，后台线程定时抓取这些线程的调用栈，
+    # 聚合为火焰图可直接使用的 collapsed stacks（"tag;帧1;帧2 次数"）
+    def __init__(self, enabled=False, sample_rate=0.0, interval=0.005, max_depth=64, max_stacks=10000):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.max_depth = max_depth
+        self.max_stacks = max_stacks
+        self.active = {}
+        self.stacks = {}
+        self.labels = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.samples = 0
+        self.profiled_requests = 0
+        self.dropped = 0
+
+    def configure(self, enabled=None, sample_rate=None, interval=None):
+        if enabled is not None:
+            self.enabled = bool(enabled)
+        if sample_rate is not None:
+            self.sample_rate = min(max(float(sample_rate), 0.0), 1.0)
+        if interval is not None:
+            self.interval = min(max(float(interval), 0.001), 1.0)
+        printLog(f"剖析配置: enabled={self.enabled}, sample_rate={self.sample_rate}, interval={self.interval}")
+
+    def should_profile(self, headers):
+        # 开启后：请求头显式要求的请求必定采样，其余按采样率抽取
+        if not self.enabled:
+            return False
+        flag = headers.get(PROFILE_HEADER)
+        if flag is not None:
+            return flag not in (b"0", b"false")
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    @contextmanager
+    def track(self, tag):
+        ident = threading.get_ident()
+        with self.lock:
+            self.active.setdefault(ident, []).append(tag)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.loop, name="stack-profiler", daemon=True)
+                self.thread.start()
+        self.wakeup.set()
+        try:
+            yield
+        finally:
+            with self.lock:
+                tags = self.active[ident]
+                tags.remove(tag)
+                if not tags:
+                    del self.active[ident]
+
+    def loop(self):
+        while True:
+            self.wakeup.wait()
+            with self.lock:
+                targets = {ident: tags[-1] for ident, tags in self.active.items()}
+                if not targets:
+                    self.wakeup.clear()
+                    continue
+            frames = sys._current_frames()
+            for ident, tag in targets.items():
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.record(tag, frame)
+            del frames
+            time.sleep(self.interval)
+
+    def label(self, code):
+        label = self.labels.get(code)
+        if label is None:
+            label = f"{os.path.basename(code.co_filename)}:{code.co_name}".replace(";", ":").replace(" ", "_")
+            self.labels[code] = label
+        return label
+
+    def record(self, tag, frame):
+        parts = []
+        while frame is not None and len(parts) < self.max_depth:
+            parts.append(self.label(frame.f_code))
+            frame = frame.f_back
+        if not parts or parts[0] in IDLE_FRAMES:
+            return
+        parts.append(tag)
+        stack = ";".join(reversed(parts))
+        with self.lock:
+            self.samples += 1
+            if stack in self.stacks:
+                self.stacks[stack] += 1
+            elif len(self.stacks) < self.max_stacks:
+                self.stacks[stack] = 1
+            else:
+                self.dropped += 1
+
+    def collapsed(self, tag=None):
+        with self.lock:
+            stacks = sorted(self.stacks.items(), key=lambda item: -item[1])
+        prefix = f"{tag};" if tag else ""
+        return "".join(f"{stack} {count}\n" for stack, count in stacks if stack.startswith(prefix))
+
+    def reset(self):
+        with self.lock:
+            self.stacks.clear()
+            self.samples = 0
+            self.profiled_requests = 0
+            self.dropped = 0
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'enabled': self.enabled,
+                'sample_rate': self.sample_rate,
+                'interval': self.interval,
+                'profiled_requests': self.profiled_requests,
+                'active_threads': len(self.active),
+                'samples': self.samples,
+                'stacks': len(self.stacks),
+                'dropped': self.dropped
+            }
+
+class ProfilingMiddleware:
+    # 被选中的请求只通过 contextvar 传递剖析上下文，由推理线程池、存储线程池和流式生成器
+    # 在实际执行的线程上登记。事件循环线程同时在跑其他请求，整段登记会把它们的样本算到本请求上，
+    # 因此不采样事件循环线程，请求在循环上的解析/序列化耗时不计入火焰图
+    def __init__(self, app, profiler, routes):
+        self.app = app
+        self.profiler = profiler
+        self.routes = routes
+        self.paths = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.enabled or not self.profiler.should_profile(dict(scope["headers"])):
+            return await self.app(scope, receive, send)
+        if self.paths is None:
+            self.paths = {getattr(route, "path", None) for route in self.routes}
+        path = scope["path"] if scope["path"] in self.paths else "other"
+        tag = f"{scope['method']}_{path}"
+        with self.profiler.lock:
+            self.profiler.profiled_requests += 1
+        token = PROFILING.set((self.profiler, tag))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            PROFILING.reset(token)
+
+MAX_REQUEST_BODY = 16 * 1024 * 1024
+
+async def read_limited_body(request, max_size=MAX_REQUEST_BODY):
+    # 未压缩的请求体与 gzip 解压后一样受大小上限约束，超限返回 None
+    length = request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > max_size:
+        return None
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > max_size:
+            return None
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+class GzipRequestMiddleware:
+    # 解压 Content-Encoding: gzip 的请求体；压缩前后大小都有上限，防止压缩炸弹
+    def __init__(self, app, max_size=MAX_REQUEST_BODY):
+        self.app = app
+        self.max_size = max_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or dict(scope["headers"]).get(b"content-encoding") != b"gzip":
+            return await self.app(scope, receive, send)
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            size += len(chunks[-1])
+            if size > self.max_size:
+                return await self.reject(send, 413, "请求体过大")
+            if not message.get("more_body"):
+                break
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            body = decompressor.decompress(b"".join(chunks), self.max_size)
+            if decompressor.unconsumed_tail:
+                return await self.reject(send, 413, "解压后的请求体过大")
+        except zlib.error:
+            return await self.reject(send, 400, "gzip请求体解压失败")
+        headers = [(k, v) for k, v in scope["headers"] if k not in (b"content-encoding", b"content-length")]
+        headers.append((b"content-length", str(len(body)).encode()))
+        sent = False
+
+        async def receive_body():
+            nonlocal sent
+            if sent:
+                return await receive()
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await self.app(dict(scope, headers=headers), receive_body, send)
+
+    async def reject(self, send, status, message):
+        body = json.dumps({"status": "error", "message": message}, ensure_ascii=False).encode("utf-8")
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+
+def encode_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+class EventSubscriber:
+    def __init__(self, topic, max_queue, max_dropped):
+        self.topic = topic
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.max_dropped = max_dropped
+        self.dropped = 0
+        self.closed = False
+
+    def offer(self, message):
+        if self.queue.full():
+            # 慢消费者：丢弃最旧的一条；持续跟不上则断开
+            self.queue.get_nowait()
+            self.dropped += 1
+            if self.dropped > self.max_dropped:
+                self.closed = True
+                self.queue.put_nowait(None)
+                return False
+        self.queue.put_nowait(message)
+        return True
+
+class EventHub:
+    # 进程内发布/订阅：每个事件只序列化一次，按地块分发给 SSE 订阅者
+    ALL_TOPICS = '*'
+
+    def __init__(self, max_queue=100, max_dropped=1000, heartbeat_interval=15.0):
+        self.max_queue = max_queue
+        self.max_dropped = max_dropped
+        self.heartbeat_interval = heartbeat_interval
+        self.subscribers = {}
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.disconnected = 0
+        self.heartbeat_task = None
+
+    def subscribe(self, topic=None):
+        subscriber = EventSubscriber(topic or self.ALL_TOPICS, self.max_queue, self.max_dropped)
+        self.subscribers.setdefault(subscriber.topic, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        topic_subscribers = self.subscribers.get(subscriber.topic)
+        if topic_subscribers is not None:
+            topic_subscribers.discard(subscriber)
+            if not topic_subscribers:
+                del self.subscribers[subscriber.topic]
+        self.dropped += subscriber.dropped
+
+    def has_subscribers(self, topic=None):
+        return bool(self.subscribers.get(self.ALL_TOPICS)) or bool(topic and self.subscribers.get(topic))
+
+    def publish(self, event, data, topic=None):
+        if not self.subscribers:
+            return 0
+        if topic is None:
+            targets = [s for group in self.subscribers.values() for s in group]
+        else:
+            targets = list(self.subscribers.get(topic, ())) + list(self.subscribers.get(self.ALL_TOPICS, ()))
+        if not targets:
+            return 0
+        message = encode_sse(event, data)
+        self.published += 1
+        for subscriber in targets:
+            if subscriber.closed:
+                continue
+            if subscriber.offer(message):
+                self.delivered += 1
+            else:
+                self.disconnected += 1
+        return len(targets)
+
+    async def stream(self, subscriber):
+        try:
+            yield encode_sse('subscribed', {'topic': subscriber.topic})
+            while True:
+                message = await subscriber.queue.get()
+                if message is None:
+                    break
+                yield message
+        finally:
+            self.unsubscribe(subscriber)
+
+    def start_heartbeat(self, status_func):
+        async def heartbeat():
+            while True:
+                await asyncio.sleep(self.heartbeat_interval)
+                try:
+                    self.publish('heartbeat', status_func())
+                except Exception as e:
+                    printLog(f"心跳事件发布失败: {e}", "WARNING")
+        if self.heartbeat_task is None:
+            self.heartbeat_task = asyncio.get_running_loop().create_task(heartbeat())
+
+    def get_stats(self):
+        return {
+            'subscribers': sum(len(group) for group in self.subscribers.values()),
+            'topics': len(self.subscribers),
+            'published': self.published,
+            'delivered': self.delivered,
+            'dropped': self.dropped + sum(s.dropped for group in self.subscribers.values() for s in group),
+            'disconnected': self.disconnected
+        }
@@ -0,0 +1,758 @@
+from S000 import *
+from S003 import SensorSeries, query_series
+from S007 import DEFAULT_WINDOWS, RollingFeatureEngine, SensorAnomalyDetector
+from sqlalchemy import (
+    Column, Float, Index, Integer, MetaData, String, Table, Text,
+    create_engine, delete, event, func, insert, select, text
+)
+from sqlalchemy.exc import OperationalError
+
+SHARED_STATE_PATH = "kissan_state.db"
+CHAT_HISTORY_PATH = "kissan_chat.db"
+
+def configure_connection(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+def create_sqlite_engine(db_path):
+    engine = create_engine(
+        f"sqlite:///{db_path}",
+        connect_args={"check_same_thread": False, "timeout": 30}
+    )
+    event.listen(engine, "connect", configure_connection)
+    return engine
+
+def create_tables(metadata, engine):
+    try:
+        metadata.create_all(engine)
+    except OperationalError as e:
+        # 其他 worker 可能同时建表
+        printLog(f"建表冲突，已忽略: {e}", "WARNING")
+
+class SharedState:
+    # 多进程部署时各 worker 通过同一个 SQLite(WAL) 文件共享传感器数据和聊天记录
+    def __init__(self, db_path=SHARED_STATE_PATH):
+        self.db_path = db_path
+        self.engine = create_sqlite_engine(db_path)
+        self.metadata = MetaData()
+        self.sensor_readings = Table(
+            'sensor_readings', self.metadata,
+            Column('id', Integer, primary_key=True, autoincrement=True),
+            Column('location', String, nullable=False),
+            Column('sensor_id', String, nullable=False),
+            Column('ts', Float, nullable=False),
+            Column('readings', Text, nullable=False),
+            Column('payload', Text, nullable=False),
+            Index('ix_sensor_readings_series', 'location', 'sensor_id', 'ts'),
+            Index('ix_sensor_readings_ts', 'ts')
+        )
+        self.location_latest = Table(
+            'location_latest', self.metadata,
+            Column('location', String, primary_key=True),
+            Column('readings', Text, nullable=False),
+            Column('ts', Float, nullable=False)
+        )
+        # 每个传感器的最新读数与计数在写入时维护，查询最新值和统计不再扫描读数表
+        self.sensor_latest = Table(
+            'sensor_latest', self.metadata,
+            Column('location', String, primary_key=True),
+            Column('sensor_id', String, primary_key=True),
+            Column('readings', Text, nullable=False),
+            Column('ts', Float, nullable=False),
+            Column('count', Integer, nullable=False)
+        )
+        self.store_counters = Table(
+            'store_counters', self.metadata,
+            Column('name', String, primary_key=True),
+            Column('value', Integer, nullable=False)
+        )
+        self.quarantine_table = Table(
+            'quarantine', self.metadata,
+            Column('id', Integer, primary_key=True, autoincrement=True),
+            Column('location', String, nullable=False),
+            Column('sensor_id', String, nullable=False),
+            Column('metric', String, nullable=False),
+            Column('value', Float),
+            Column('fault', String, nullable=False),
+            Column('timestamp', String, nullable=False),
+            Column('created', Float, nullable=False),
+            Index('ix_quarantine_location', 'location', 'id'),
+            Index('ix_quarantine_created', 'created')
+        )
+        self.location_features = Table(
+            'location_features', self.metadata,
+            Column('location', String, primary_key=True),
+            Column('features', Text, nullable=False),
+            Column('updated', Float, nullable=False)
+        )
+        self.analysis_results_table = Table(
+            'analysis_results', self.metadata,
+            Column('location', String, primary_key=True),
+            Column('result', Text, nullable=False),
+            Column('computed_at', String)
+        )
+        self.leases = Table(
+            'leases', self.metadata,
+            Column('name', String, primary_key=True),
+            Column('owner', String, nullable=False),
+            Column('expires', Float, nullable=False)
+        )
+        create_tables(self.metadata, self.engine)
+        self.sensor_store = SharedSensorStore(self)
+        self.chat_history_store = ChatHistoryStore(engine=self.engine)
+        self.quarantine = SharedQuarantine(self)
+        self.features = SharedFeatureView(self)
+        self.analysis_results = SharedAnalysisResults(self)
+        printLog(f"共享状态后端已就绪: {db_path}")
+
+class SharedSensorStore:
+    UPSERT_LATEST = text(
+        "INSERT INTO location_latest (location, readings, ts) VALUES (:location, :readings, :ts) "
+        "ON CONFLICT(location) DO UPDATE SET "
+        "readings = json_patch(location_latest.readings, excluded.readings), "
+        "ts = MAX(location_latest.ts, excluded.ts)"
+    )
+    UPSERT_SENSOR_LATEST = text(
+        "INSERT INTO sensor_latest (location, sensor_id, readings, ts, count) "
+        "VALUES (:location, :sensor_id, :readings, :ts, :count) "
+        "ON CONFLICT(location, sensor_id) DO UPDATE SET "
+        "readings = json_patch(sensor_latest.readings, excluded.readings), "
+        "ts = MAX(sensor_latest.ts, excluded.ts), "
+        "count = sensor_latest.count + excluded.count"
+    )
+    ADD_COUNTER = text(
+        "INSERT INTO store_counters (name, value) VALUES (:name, :value) "
+        "ON CONFLICT(name) DO UPDATE SET value = store_counters.value + excluded.value"
+    )
+    # 旧数据库升级：维护表为空时从读数表回填一次
+    BACKFILL_SENSOR_LATEST = text(
+        "INSERT OR IGNORE INTO sensor_latest (location, sensor_id, readings, ts, count) "
+        "SELECT location, sensor_id, readings, MAX(ts), COUNT(*) FROM sensor_readings GROUP BY location, sensor_id"
+    )
+    BACKFILL_COUNTER = text(
+        "INSERT OR IGNORE INTO store_counters (name, value) "
+        "SELECT 'total_readings', COUNT(*) FROM sensor_readings"
+    )
+
+    def __init__(self, state, retention_seconds=7 * 24 * 3600, prune_every=1000):
+        self.state = state
+        self.engine = state.engine
+        self.table = state.sensor_readings
+        self.retention_seconds = retention_seconds
+        self.prune_every = prune_every
+        self.writes_since_prune = 0
+        self.lock = threading.Lock()
+        self.observers = []
+        self.backfill()
+
+    def backfill(self):
+        counters = self.state.store_counters
+        with self.engine.begin() as conn:
+            if conn.execute(select(counters.c.name).where(counters.c.name == 'total_readings')).first():
+                return
+            conn.execute(self.BACKFILL_SENSOR_LATEST)
+            conn.execute(self.BACKFILL_COUNTER)
+
+    def add_observer(self, observer):
+        # 仅通知本进程写入的读数
+        self.observers.append(observer)
+
+    def ingest(self, payload):
+        return self.ingest_many([payload])[0]
+
+    def ingest_many(self, payloads):
+        return self.ingest_batch(SensorReadingBatch.from_payloads(payloads))
+
+    def ingest_batch(self, batch):
+        rows = []
+        latest = {}
+        sensors = {}
+        written = []
+        observed = []
+        for sensor_id, location, timestamp, values in batch.rows():
+            payload = {
+                'sensor_id': sensor_id,
+                'location': location,
+                'timestamp': datetime.fromtimestamp(timestamp).isoformat(),
+                'readings': values
+            }
+            rows.append({
+                'location': location,
+                'sensor_id': sensor_id,
+                'ts': timestamp,
+                'readings': json.dumps(values),
+                'payload': json.dumps(payload, ensure_ascii=False)
+            })
+            merged = latest.setdefault(location, {'location': location, 'values': {}, 'ts': timestamp})
+            merged['values'].update(values)
+            merged['ts'] = max(merged['ts'], timestamp)
+            sensor = sensors.setdefault((location, sensor_id), {'values': {}, 'ts': timestamp, 'count': 0})
+            sensor['values'].update(values)
+            sensor['ts'] = max(sensor['ts'], timestamp)
+            sensor['count'] += 1
+            written.append((sensor_id, location, timestamp))
+            observed.append(values)
+        if not rows:
+            return written
+        with self.engine.begin() as conn:
+            conn.execute(insert(self.table), rows)
+            conn.execute(self.UPSERT_LATEST, [
+                {'location': m['location'], 'readings': json.dumps(m['values']), 'ts': m['ts']}
+                for m in latest.values()
+            ])
+            conn.execute(self.UPSERT_SENSOR_LATEST, [
+                {'location': location, 'sensor_id': sensor_id, 'readings': json.dumps(s['values']),
+                 'ts': s['ts'], 'count': s['count']}
+                for (location, sensor_id), s in sensors.items()
+            ])
+            conn.execute(self.ADD_COUNTER, {'name': 'total_readings', 'value': len(rows)})
+        self.maybe_prune(len(rows))
+        for observer in self.observers:
+            for (sensor_id, location, timestamp), values in zip(written, observed):
+                observer(sensor_id, location, timestamp, values)
+        return written
+
+    def maybe_prune(self, count):
+        with self.lock:
+            self.writes_since_prune += count
+            if self.writes_since_prune < self.prune_every:
+                return
+            self.writes_since_prune = 0
+        with self.engine.begin() as conn:
+            conn.execute(delete(self.table).where(self.table.c.ts < time.time() - self.retention_seconds))
+
+    @property
+    def latest_payload(self):
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                select(self.table.c.payload).order_by(self.table.c.id.desc()).limit(1)
+            ).first()
+        return json.loads(row[0]) if row else {}
+
+    def latest_readings(self, location=None):
+        with self.engine.connect() as conn:
+            if location is None:
+                row = conn.execute(
+                    select(self.table.c.readings).order_by(self.table.c.id.desc()).limit(1)
+                ).first()
+            else:
+                latest = self.state.location_latest
+                row = conn.execute(
+                    select(latest.c.readings).where(latest.c.location == location)
+                ).first()
+        return json.loads(row[0]) if row else {}
+
+    def location_snapshot(self):
+        latest = self.state.location_latest
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(latest.c.location, latest.c.readings)).all()
+        return {location: json.loads(readings) for location, readings in rows}
+
+    def location_batch(self, locations=None):
+        latest = self.state.location_latest
+        query = select(latest.c.location, latest.c.readings, latest.c.ts)
+        if locations is not None:
+            query = query.where(latest.c.location.in_(list(locations)))
+        with self.engine.connect() as conn:
+            rows = conn.execute(query).all()
+        readings = {location: json.loads(values) for location, values, ts in rows}
+        return SensorReadingBatch.from_readings(
+            {location: values for location, values in readings.items() if values},
+            {location: ts for location, values, ts in rows}
+        )
+
+    def filtered(self, query, location=None, sensor_id=None):
+        if location is not None:
+            query = query.where(self.table.c.location == location)
+        if sensor_id is not None:
+            query = query.where(self.table.c.sensor_id == sensor_id)
+        return query
+
+    def latest(self, location=None, sensor_id=None):
+        c = self.state.sensor_latest.c
+        query = select(c.location, c.sensor_id, c.ts, c.readings, c.count)
+        if location is not None:
+            query = query.where(c.location == location)
+        if sensor_id is not None:
+            query = query.where(c.sensor_id == sensor_id)
+        with self.engine.connect() as conn:
+            rows = conn.execute(query).all()
+        return [
+            {
+                'sensor_id': sid,
+                'location': loc,
+                'timestamp': datetime.fromtimestamp(ts).isoformat(),
+                'readings': json.loads(readings),
+                'count': count
+            }
+            for loc, sid, ts, readings, count in rows
+        ]
+
+    def window(self, location=None, sensor_id=None, seconds=3600, metrics=None):
+        end = time.time()
+        return self.range(location, sensor_id, end - seconds, end, None, metrics)
+
+    def range(self, location=None, sensor_id=None, start=None, end=None, bucket_seconds=None, metrics=None):
+        c = self.table.c
+        query = self.filtered(select(c.location, c.sensor_id, c.ts, c.readings), location, sensor_id)
+        if start is not None:
+            query = query.where(c.ts >= start)
+        if end is not None:
+            query = query.where(c.ts <= end)
+        with self.engine.connect() as conn:
+            rows = conn.execute(query.order_by(c.location, c.sensor_id, c.ts)).all()
+        grouped = {}
+        for loc, sid, ts, readings in rows:
+            grouped.setdefault((loc, sid), []).append((ts, json.loads(readings)))
+        result = []
+        for (loc, sid), points in grouped.items():
+            series = SensorSeries(sid, loc, len(points))
+            for ts, values in points:
+                series.append(ts, values)
+            result.append(query_series(series, start, end, bucket_seconds, metrics))
+        return result
+
+    def get_stats(self):
+        counters = self.state.store_counters
+        with self.engine.connect() as conn:
+            total = conn.execute(
+                select(counters.c.value).where(counters.c.name == 'total_readings')
+            ).scalar() or 0
+            series = conn.execute(select(func.count()).select_from(self.state.sensor_latest)).scalar()
+            locations = conn.execute(select(func.count()).select_from(self.state.location_latest)).scalar()
+        return {
+            'backend': 'sqlite',
+            'path': self.state.db_path,
+            'series': series,
+            'locations': locations,
+            'retention_seconds': self.retention_seconds,
+            'total_readings': total
+        }
+
+class SharedQuarantine:
+    # 各 worker 的量程越界记录与流处理进程的尖峰/卡死/漂移记录写入同一张表
+    def __init__(self, state, max_entries=1000, prune_every=100):
+        self.state = state
+        self.engine = state.engine
+        self.table = state.quarantine_table
+        self.max_entries = max_entries
+        self.prune_every = prune_every
+        self.writes_since_prune = 0
+        self.lock = threading.Lock()
+
+    def record(self, faults):
+        if not faults:
+            return
+        now = time.time()
+        with self.engine.begin() as conn:
+            conn.execute(insert(self.table), [
+                {
+                    'location': f['location'],
+                    'sensor_id': f['sensor_id'],
+                    'metric': f['metric'],
+                    'value': f['value'],
+                    'fault': f['fault'],
+                    'timestamp': f['timestamp'],
+                    'created': now
+                }
+                for f in faults
+            ])
+        with self.lock:
+            self.writes_since_prune += len(faults)
+            if self.writes_since_prune < self.prune_every:
+                return
+            self.writes_since_prune = 0
+        c = self.table.c
+        keep_from = select(func.max(c.id)).scalar_subquery() - self.max_entries
+        with self.engine.begin() as conn:
+            conn.execute(delete(self.table).where(c.id <= keep_from))
+
+    def quarantined(self, location=None, sensor_id=None, limit=50):
+        c = self.table.c
+        query = select(c.sensor_id, c.location, c.metric, c.value, c.fault, c.timestamp)
+        if location is not None:
+            query = query.where(c.location == location)
+        if sensor_id is not None:
+            query = query.where(c.sensor_id == sensor_id)
+        with self.engine.connect() as conn:
+            rows = conn.execute(query.order_by(c.id.desc()).limit(limit)).all()
+        return [
+            {'sensor_id': sid, 'location': loc, 'metric': metric, 'value': value, 'fault': fault, 'timestamp': ts}
+            for sid, loc, metric, value, fault, ts in rows
+        ]
+
+    def recent_locations(self, seconds=600):
+        c = self.table.c
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                select(c.location).where(c.created >= time.time() - seconds).distinct()
+            ).all()
+        return {location for location, in rows}
+
+    def get_stats(self):
+        c = self.table.c
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(c.fault, func.count()).group_by(c.fault)).all()
+        faults = dict.fromkeys(SensorAnomalyDetector.FAULTS, 0)
+        faults.update(rows)
+        return {'backend': 'sqlite', 'quarantined': sum(faults.values()), 'faults': faults}
+
+class SharedFeatureView:
+    # 只读视图：滚动特征由持有租约的流处理进程计算后按地块写入，各 worker 按主键读取
+    def __init__(self, state):
+        self.engine = state.engine
+        self.table = state.location_features
+        self.windows = dict(DEFAULT_WINDOWS)
+
+    def publish(self, features_by_location):
+        if not features_by_location:
+            return
+        now = time.time()
+        statement = text(
+            "INSERT INTO location_features (location, features, updated) VALUES (:location, :features, :updated) "
+            "ON CONFLICT(location) DO UPDATE SET features = excluded.features, updated = excluded.updated"
+        )
+        with self.engine.begin() as conn:
+            conn.execute(statement, [
+                {'location': location, 'features': json.dumps(features), 'updated': now}
+                for location, features in features_by_location.items()
+            ])
+
+    def get_location_features(self, location, names=None):
+        with self.engine.connect() as conn:
+            row = conn.execute(select(self.table.c.features).where(self.table.c.location == location)).first()
+        features = json.loads(row[0]) if row else {}
+        if names is not None:
+            return {name: features[name] for name in names if name in features}
+        return features
+
+    def get_stats(self):
+        c = self.table.c
+        with self.engine.connect() as conn:
+            locations, updated = conn.execute(select(func.count(), func.max(c.updated))).one()
+        return {
+            'backend': 'sqlite',
+            'windows': dict(self.windows),
+            'locations': locations,
+            'updated': datetime.fromtimestamp(updated).isoformat() if updated else None
+        }
+
+class SharedAnalysisResults:
+    # 调度器只在流处理进程中运行，分析结果写入共享表供所有 worker 读取
+    def __init__(self, state):
+        self.engine = state.engine
+        self.table = state.analysis_results_table
+
+    def publish(self, results):
+        if not results:
+            return
+        statement = text(
+            "INSERT INTO analysis_results (location, result, computed_at) VALUES (:location, :result, :computed_at) "
+            "ON CONFLICT(location) DO UPDATE SET result = excluded.result, computed_at = excluded.computed_at"
+        )
+        with self.engine.begin() as conn:
+            conn.execute(statement, [
+                {
+                    'location': location,
+                    'result': json.dumps(result, ensure_ascii=False, default=str),
+                    'computed_at': result.get('computed_at')
+                }
+                for location, result in results.items()
+            ])
+
+    def get(self, location):
+        with self.engine.connect() as conn:
+            row = conn.execute(select(self.table.c.result).where(self.table.c.location == location)).first()
+        return json.loads(row[0]) if row else None
+
+    def snapshot(self):
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(self.table.c.location, self.table.c.result)).all()
+        return {location: json.loads(result) for location, result in rows}
+
+class SharedStreamProcessor:
+    # 多 worker 模式下，异常检测、滚动特征和地块分析调度都依赖按时间顺序累积的状态，
+    # 各进程各算一份会互相矛盾。这里通过 SQLite 租约选出唯一的流处理进程：它按自增 id
+    # 追读所有 worker 写入的读数，在本进程内完成有状态检测与特征计算，结果写回共享表。
+    # 局限：worker 写入时只做无状态的量程检查，尖峰/卡死/漂移在流处理进程中异步判定，
+    # 判定后再从历史读数中剔除，并把传感器/地块最新读数中的故障值回退为该指标最近一次的正常值，
+    # 期间（通常不超过 poll_interval）接口可能读到尚未隔离的值；
+    # 流处理进程退出后，其他 worker 需等租约过期（lease_seconds）才能接管，并回放最近窗口重建状态。
+    LEASE_NAME = 'stream_processor'
+    ACQUIRE_LEASE = text(
+        "INSERT INTO leases (name, owner, expires) VALUES (:name, :owner, :expires) "
+        "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires = excluded.expires "
+        "WHERE leases.owner = excluded.owner OR leases.expires < :now"
+    )
+    REMOVE_READING = text(
+        "UPDATE sensor_readings SET readings = json_remove(readings, '$.' || :metric) WHERE id = :id"
+    )
+    # 故障值已从读数表剔除后，按 (location, sensor_id, ts) 索引倒序找该传感器最近的正常值
+    LAST_CLEAN_SENSOR_VALUE = text(
+        "SELECT json_extract(readings, '$.' || :metric) AS clean, ts FROM sensor_readings "
+        "WHERE location = :location AND sensor_id = :sensor_id "
+        "AND json_extract(readings, '$.' || :metric) IS NOT NULL "
+        "ORDER BY ts DESC LIMIT 1"
+    )
+    # 只在最新值仍是故障值时回退，期间其他写入的新值不被覆盖；没有任何正常值时才移除该指标
+    REPAIR_SENSOR_LATEST = text(
+        "UPDATE sensor_latest SET readings = CASE WHEN :clean IS NULL "
+        "THEN json_remove(readings, '$.' || :metric) "
+        "ELSE json_set(readings, '$.' || :metric, :clean) END "
+        "WHERE location = :location AND sensor_id = :sensor_id "
+        "AND json_extract(readings, '$.' || :metric) = :value"
+    )
+    # 地块最新值取该地块各传感器修正后最新值中时间最新的一个
+    LAST_CLEAN_LOCATION_VALUE = text(
+        "SELECT json_extract(readings, '$.' || :metric) FROM sensor_latest "
+        "WHERE location = :location AND json_extract(readings, '$.' || :metric) IS NOT NULL "
+        "ORDER BY ts DESC LIMIT 1"
+    )
+    REPAIR_LATEST = text(
+        "UPDATE location_latest SET readings = CASE WHEN :clean IS NULL "
+        "THEN json_remove(readings, '$.' || :metric) "
+        "ELSE json_set(readings, '$.' || :metric, :clean) END "
+        "WHERE location = :location AND json_extract(readings, '$.' || :metric) = :value"
+    )
+
+    def __init__(self, state, on_acquire=None, on_release=None, on_faults=None, on_readings=None,
+                 lease_seconds=15.0, poll_interval=0.5, batch_size=1000):
+        self.state = state
+        self.engine = state.engine
+        self.table = state.sensor_readings
+        self.on_acquire = on_acquire
+        self.on_release = on_release
+        self.on_faults = on_faults
+        self.on_readings = on_readings
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.replay_seconds = max(DEFAULT_WINDOWS.values())
+        self.owner = f"{os.getpid()}-{id(self)}"
+        self.is_leader = False
+        self.renewed = 0.0
+        self.detector = None
+        self.feature_engine = None
+        self.cursor = 0
+        self.replay_until = 0
+        self.processed = 0
+        self.running = False
+        self.thread = None
+        self.wakeup = threading.Event()
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.loop, name="stream-processor", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+            self.thread = None
+        if self.is_leader:
+            self.step_down()
+            with self.engine.begin() as conn:
+                conn.execute(
+                    self.state.leases.update()
+                    .where(self.state.leases.c.name == self.LEASE_NAME, self.state.leases.c.owner == self.owner)
+                    .values(expires=0.0)
+                )
+
+    def acquire(self):
+        now = time.time()
+        with self.engine.begin() as conn:
+            conn.execute(self.ACQUIRE_LEASE, {
+                'name': self.LEASE_NAME, 'owner': self.owner, 'expires': now + self.lease_seconds, 'now': now
+            })
+            owner = conn.execute(
+                select(self.state.leases.c.owner).where(self.state.leases.c.name == self.LEASE_NAME)
+            ).scalar()
+        self.renewed = now
+        return owner == self.owner
+
+    def loop(self):
+        while self.running:
+            busy = False
+            try:
+                if not self.is_leader or time.time() - self.renewed >= self.lease_seconds / 3:
+                    leader = self.acquire()
+                    if leader and not self.is_leader:
+                        self.become_leader()
+                    elif not leader and self.is_leader:
+                        printLog("流处理租约已被其他进程接管", "WARNING")
+                        self.step_down()
+                if self.is_leader:
+                    busy = self.process_batch() >= self.batch_size
+            except Exception as e:
+                printLog(f"流处理失败: {e}", "ERROR")
+            if not busy:
+                self.wakeup.wait(self.poll_interval if self.is_leader else self.lease_seconds / 3)
+
+    def become_leader(self):
+        c = self.table.c
+        with self.engine.connect() as conn:
+            first, last = conn.execute(
+                select(func.min(c.id), func.max(c.id)).where(c.ts >= time.time() - self.replay_seconds)
+            ).one()
+            if first is None:
+                first = last = conn.execute(select(func.max(c.id))).scalar() or 0
+                first += 1
+        self.detector = SensorAnomalyDetector()
+        self.feature_engine = RollingFeatureEngine()
+        # 回放最近窗口内的读数重建检测与特征状态，回放部分已被前任处理过，不重复隔离
+        self.cursor = first - 1
+        self.replay_until = last
+        self.is_leader = True
+        printLog(f"本进程成为流处理进程: {self.owner}, 回放 {max(last - first + 1, 0)} 条读数")
+        if self.on_acquire:
+            self.on_acquire()
+
+    def step_down(self):
+        self.is_leader = False
+        if self.on_release:
+            self.on_release()
+
+    def process_batch(self):
+        c = self.table.c
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                select(c.id, c.location, c.sensor_id, c.ts, c.readings)
+                .where(c.id > self.cursor).order_by(c.id).limit(self.batch_size)
+            ).all()
+        if not rows:
+            return 0
+        touched = set()
+        faults = []
+        repairs = []
+        for row_id, location, sensor_id, ts, readings in rows:
+            clean, found = self.detector.screen(sensor_id, location, ts, json.loads(readings))
+            if clean:
+                self.feature_engine.update(sensor_id, location, ts, clean)
+            touched.add(location)
+            if row_id > self.replay_until:
+                faults.extend(found)
+                repairs.extend(
+                    {'id': row_id, 'location': location, 'sensor_id': sensor_id,
+                     'metric': f['metric'], 'value': f['value']}
+                    for f in found
+                )
+        self.cursor = rows[-1][0]
+        self.processed += len(rows)
+        if faults:
+            self.state.quarantine.record(faults)
+            self.repair(repairs)
+            if self.on_faults:
+                self.on_faults(faults)
+        self.state.features.publish({
+            location: self.feature_engine.get_location_features(location) for location in touched
+        })
+        if self.on_readings and rows[-1][0] > self.replay_until:
+            self.on_readings(touched)
+        return len(rows)
+
+    def repair(self, repairs):
+        with self.engine.begin() as conn:
+            conn.execute(self.REMOVE_READING, repairs)
+            for repair in repairs:
+                row = conn.execute(self.LAST_CLEAN_SENSOR_VALUE, repair).first()
+                conn.execute(self.REPAIR_SENSOR_LATEST, dict(repair, clean=row[0] if row else None))
+            for repair in repairs:
+                clean = conn.execute(self.LAST_CLEAN_LOCATION_VALUE, repair).scalar()
+                conn.execute(self.REPAIR_LATEST, dict(repair, clean=clean))
+
+    def get_stats(self):
+        return {
+            'owner': self.owner,
+            'leader': self.is_leader,
+            'cursor': self.cursor,
+            'processed': self.processed,
+            'detector': self.detector.get_stats() if self.detector else None
+        }
+
+class ChatHistoryStore:
+    # 只追加写入；按 (user_id, id) 索引，游标即自增 id，翻页代价只与页大小有关
+    def __init__(self, engine=None, db_path=CHAT_HISTORY_PATH, retention_per_user=1000,
+                 retention_days=90, prune_every=50):
+        self.engine = engine if engine is not None else create_sqlite_engine(db_path)
+        self.retention_per_user = retention_per_user
+        self.retention_days = retention_days
+        self.prune_every = prune_every
+        self.appends_per_user = {}
+        self.lock = threading.Lock()
+        self.metadata = MetaData()
+        self.table = Table(
+            'chat_history', self.metadata,
+            Column('id', Integer, primary_key=True, autoincrement=True),
+            Column('ts', Float, nullable=False),
+            Column('timestamp', String, nullable=False),
+            Column('user_id', String, nullable=False),
+            Column('location', String),
+            Column('user_message', Text),
+            Column('ai_response', Text),
+            Index('ix_chat_history_user', 'user_id', 'id'),
+            Index('ix_chat_history_ts', 'ts')
+        )
+        create_tables(self.metadata, self.engine)
+
+    def append(self, entry):
+        user_id = str(entry.get('user_id', 'unknown'))
+        with self.engine.begin() as conn:
+            conn.execute(insert(self.table), [{
+                'ts': parse_timestamp(entry.get('timestamp')),
+                'timestamp': entry.get('timestamp') or datetime.now().isoformat(),
+                'user_id': user_id,
+                'location': entry.get('location'),
+                'user_message': entry.get('user_message'),
+                'ai_response': entry.get('ai_response')
+            }])
+        with self.lock:
+            count = self.appends_per_user.pop(user_id, 0) + 1
+            if count < self.prune_every:
+                self.appends_per_user[user_id] = count
+                return
+        self.prune_user(user_id)
+
+    def prune_user(self, user_id):
+        c = self.table.c
+        keep_from = select(c.id).where(c.user_id == user_id).order_by(c.id.desc()) \
+            .limit(1).offset(self.retention_per_user - 1).scalar_subquery()
+        with self.engine.begin() as conn:
+            conn.execute(delete(self.table).where(c.user_id == user_id, c.id < keep_from))
+            if self.retention_days:
+                conn.execute(delete(self.table).where(
+                    c.user_id == user_id, c.ts < time.time() - self.retention_days * 86400
+                ))
+
+    def page(self, user_id=None, limit=10, cursor=None):
+        if limit <= 0:
+            return [], None
+        c = self.table.c
+        query = select(c.id, c.timestamp, c.user_id, c.user_message, c.ai_response, c.location)
+        if user_id is not None:
+            query = query.where(c.user_id == user_id)
+        if cursor is not None:
+            query = query.where(c.id < cursor)
+        with self.engine.connect() as conn:
+            rows = conn.execute(query.order_by(c.id.desc()).limit(limit)).all()
+        entries = [
+            {
+                'id': row_id,
+                'timestamp': timestamp,
+                'user_id': row_user_id,
+                'user_message': user_message,
+                'ai_response': ai_response,
+                'location': location
+            }
+            for row_id, timestamp, row_user_id, user_message, ai_response, location in reversed(rows)
+        ]
+        next_cursor = rows[-1][0] if len(rows) == limit else None
+        return entries, next_cursor
+
+    def recent(self, limit=10, user_id=None):
+        return self.page(user_id, limit)[0]
@@ -0,0 +1,387 @@
+from S000 import *
+import math
+from collections import OrderedDict, deque
+from S003 import parse_timestamp
+
+DEFAULT_WINDOWS = {'1h': 3600, '6h': 6 * 3600, '24h': 24 * 3600}
+
+# 各指标的物理量程，超出即判定为传感器故障
+SENSOR_RANGES = {
+    'soil_moisture': (0.0, 100.0),
+    'humidity': (0.0, 100.0),
+    'temperature': (-30.0, 60.0),
+    'soil_ph': (3.0, 10.0),
+    'npk_nitrogen': (0.0, 1000.0),
+    'npk_phosphorus': (0.0, 1000.0),
+    'npk_potassium': (0.0, 1000.0)
+}
+# 噪声标准差下限，避免读数过于平稳时把正常波动判为尖峰
+NOISE_FLOORS = {'soil_ph': 0.05, 'temperature': 0.2}
+# 同地块同类传感器之间允许的偏差，用于漂移判定
+PEER_TOLERANCES = {'soil_moisture': 8.0, 'humidity': 10.0, 'temperature': 3.0, 'soil_ph': 0.5}
+
+def metric_in_range(metric, value):
+    low, high = SENSOR_RANGES.get(metric, (float('-inf'), float('inf')))
+    return low <= value <= high
+
+class RollingWindow:
+    # 滑动时间窗口：累加和增量维护均值/方差/斜率，单调队列维护最值，每次更新均摊 O(1)
+    # 斜率需要窗口内有足够的点且覆盖足够的时长，否则两条相隔几十秒的读数就会外推出离谱的每小时变化
+    def __init__(self, seconds, min_span_fraction=0.25, min_points=5):
+        self.seconds = seconds
+        self.min_span = seconds / 3600.0 * min_span_fraction
+        self.min_points = min_points
+        self.points = deque()
+        self.min_queue = deque()
+        self.max_queue = deque()
+        self.sequence = 0
+        self.origin = None
+        self.n = 0
+        self.sum_v = 0.0
+        self.sum_vv = 0.0
+        self.sum_t = 0.0
+        self.sum_tt = 0.0
+        self.sum_tv = 0.0
+        self.ewma = None
+        self.last_t = None
+
+    def update(self, timestamp, value):
+        if self.origin is None:
+            self.origin = timestamp
+        t = (timestamp - self.origin) / 3600.0
+        seq = self.sequence
+        self.sequence += 1
+        self.points.append((seq, t, value))
+        self.n += 1
+        self.sum_v += value
+        self.sum_vv += value * value
+        self.sum_t += t
+        self.sum_tt += t * t
+        self.sum_tv += t * value
+        while self.min_queue and self.min_queue[-1][1] >= value:
+            self.min_queue.pop()
+        self.min_queue.append((seq, value))
+        while self.max_queue and self.max_queue[-1][1] <= value:
+            self.max_queue.pop()
+        self.max_queue.append((seq, value))
+
+        horizon = t - self.seconds / 3600.0
+        while self.points and self.points[0][1] < horizon:
+            old_seq, old_t, old_value = self.points.popleft()
+            self.n -= 1
+            self.sum_v -= old_value
+            self.sum_vv -= old_value * old_value
+            self.sum_t -= old_t
+            self.sum_tt -= old_t * old_t
+            self.sum_tv -= old_t * old_value
+            if self.min_queue and self.min_queue[0][0] == old_seq:
+                self.min_queue.popleft()
+            if self.max_queue and self.max_queue[0][0] == old_seq:
+                self.max_queue.popleft()
+
+        if self.ewma is None:
+            self.ewma = value
+        else:
+            # 时间衰减的指数滑动平均，时间常数等于窗口长度
+            alpha = 1.0 - math.exp(-max(t - self.last_t, 0.0) * 3600.0 / self.seconds)
+            self.ewma += alpha * (value - self.ewma)
+        self.last_t = t
+
+    def features(self):
+        if not self.n:
+            return {}
+        mean = self.sum_v / self.n
+        variance = max(self.sum_vv / self.n - mean * mean, 0.0)
+        slope = None
+        span = self.points[-1][1] - self.points[0][1]
+        if self.n >= self.min_points and span >= self.min_span:
+            denominator = self.n * self.sum_tt - self.sum_t * self.sum_t
+            if denominator > 1e-12:
+                slope = round((self.n * self.sum_tv - self.sum_t * self.sum_v) / denominator, 4)
+        return {
+            'mean': round(mean, 4),
+            'min': self.min_queue[0][1],
+            'max': self.max_queue[0][1],
+            'var': round(variance, 4),
+            'slope': slope,
+            'ewma': round(self.ewma, 4),
+            'count': self.n
+        }
+
+def window_features(metric, windows):
+    features = {}
+    for name, window in windows.items():
+        for stat, value in window.features().items():
+            features[f"{metric}_{name}_{stat}"] = value
+    return features
+
+class RollingFeatureEngine:
+    # 写入时只更新窗口统计量；读取时按地块汇总最近更新的传感器窗口，无需回扫历史
+    # 按 (地块, 传感器) 做 LRU，超过 max_series 时淘汰最久未更新的传感器
+    def __init__(self, windows=None, metrics=None, max_series=1024):
+        self.windows = windows or DEFAULT_WINDOWS
+        self.metrics = set(metrics) if metrics else None
+        self.max_series = max_series
+        self.sensor_windows = OrderedDict()
+        self.location_series = {}
+        self.lock = threading.Lock()
+        self.updates = 0
+
+    def update(self, sensor_id, location, timestamp, values):
+        with self.lock:
+            key = (location, sensor_id)
+            sensor_windows = self.sensor_windows.get(key)
+            if sensor_windows is None:
+                sensor_windows = self.sensor_windows[key] = {}
+                if len(self.sensor_windows) > self.max_series:
+                    self.evict(*self.sensor_windows.popitem(last=False))
+            else:
+                self.sensor_windows.move_to_end(key)
+            location_series = self.location_series.setdefault(location, {})
+            for metric, value in values.items():
+                if self.metrics is not None and metric not in self.metrics:
+                    continue
+                windows = sensor_windows.get(metric)
+                if windows is None:
+                    windows = {name: RollingWindow(seconds) for name, seconds in self.windows.items()}
+                    sensor_windows[metric] = windows
+                for window in windows.values():
+                    window.update(timestamp, value)
+                location_series[metric] = windows
+            self.updates += 1
+
+    def evict(self, key, sensor_windows):
+        # 地块汇总只引用最近更新的传感器，被淘汰的传感器若仍是最近来源则一并移除
+        location = key[0]
+        location_series = self.location_series.get(location, {})
+        for metric, windows in sensor_windows.items():
+            if location_series.get(metric) is windows:
+                del location_series[metric]
+        if not location_series:
+            self.location_series.pop(location, None)
+
+    def get_location_features(self, location, names=None):
+        with self.lock:
+            features = {}
+            for metric, windows in self.location_series.get(location, {}).items():
+                features.update(window_features(metric, windows))
+        if names is not None:
+            return {name: features[name] for name in names if name in features}
+        return features
+
+    def get_sensor_features(self, location, sensor_id):
+        with self.lock:
+            features = {}
+            for metric, windows in self.sensor_windows.get((location, sensor_id), {}).items():
+                features.update(window_features(metric, windows))
+            return features
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'windows': dict(self.windows),
+                'max_series': self.max_series,
+                'tracked_series': len(self.sensor_windows),
+                'locations': len(self.location_series),
+                'updates': self.updates
+            }
+
+class MetricState:
+    __slots__ = ('count', 'last', 'mean', 'noise_var', 'stuck_run', 'rejected_run', 'cusum_high', 'cusum_low')
+
+    def __init__(self):
+        self.count = 0
+        self.last = None
+        self.mean = 0.0
+        self.noise_var = 0.0
+        self.stuck_run = 0
+        self.rejected_run = 0
+        self.cusum_high = 0.0
+        self.cusum_low = 0.0
+
+class PeerGroup:
+    __slots__ = ('values', 'total')
+
+    def __init__(self):
+        self.values = {}
+        self.total = 0.0
+
+    def update(self, sensor_id, value):
+        self.total += value - self.values.get(sensor_id, 0.0)
+        self.values[sensor_id] = value
+
+    def remove(self, sensor_id):
+        self.total -= self.values.pop(sensor_id, 0.0)
+
+    def others_mean(self, sensor_id):
+        own = self.values.get(sensor_id)
+        count = len(self.values) - (own is not None)
+        if count < 2:
+            return None
+        return (self.total - (own or 0.0)) / count
+
+class SensorAnomalyDetector:
+    # 每个 (地块, 传感器, 指标) 维护指数加权的均值与噪声方差，每条读数常数时间判定：
+    # 量程越界、尖峰（相对噪声的突跳）、卡死（长时间读数不变）、漂移（与同地块同类传感器持续偏离）
+    # 状态按 (地块, 传感器) 做 LRU，超过 max_sensors 时淘汰最久未上报的传感器及其同类组成员
+    FAULTS = ('out_of_range', 'spike', 'stuck', 'drift')
+
+    def __init__(self, alpha=0.05, warmup=10, spike_sigma=6.0, stuck_count=30,
+                 level_shift_count=5, drift_slack=1.0, drift_threshold=10.0, max_quarantine=1000,
+                 max_sensors=1024):
+        self.alpha = alpha
+        self.warmup = warmup
+        self.spike_sigma = spike_sigma
+        self.stuck_count = stuck_count
+        self.level_shift_count = level_shift_count
+        self.drift_slack = drift_slack
+        self.drift_threshold = drift_threshold
+        self.max_sensors = max_sensors
+        self.states = OrderedDict()
+        self.peers = {}
+        self.quarantine = deque(maxlen=max_quarantine)
+        self.fault_counts = dict.fromkeys(self.FAULTS, 0)
+        self.last_fault = OrderedDict()
+        self.checked = 0
+        self.lock = threading.Lock()
+
+    def sensor_states(self, location, sensor_id):
+        key = (location, sensor_id)
+        states = self.states.get(key)
+        if states is None:
+            states = self.states[key] = {}
+            if len(self.states) > self.max_sensors:
+                (old_location, old_sensor), old_states = self.states.popitem(last=False)
+                for metric in old_states:
+                    group = self.peers.get((old_location, metric))
+                    if group is not None:
+                        group.remove(old_sensor)
+                        if not group.values:
+                            del self.peers[(old_location, metric)]
+        else:
+            self.states.move_to_end(key)
+        return states
+
+    def check_metric(self, location, sensor_id, metric, value, states):
+        if not metric_in_range(metric, value):
+            return 'out_of_range'
+        state = states.get(metric)
+        if state is None:
+            state = states[metric] = MetricState()
+        fault = None
+        if state.count >= self.warmup:
+            noise = max(math.sqrt(state.noise_var), NOISE_FLOORS.get(metric, 0.1))
+            if abs(value - state.last) > self.spike_sigma * noise and abs(value - state.mean) > self.spike_sigma * noise:
+                fault = 'spike'
+            elif value == state.last:
+                state.stuck_run += 1
+                if state.stuck_run >= self.stuck_count:
+                    fault = 'stuck'
+            else:
+                state.stuck_run = 0
+        if fault is None:
+            fault = self.check_drift(location, sensor_id, metric, value, state)
+        if fault == 'spike':
+            state.rejected_run += 1
+            if state.rejected_run < self.level_shift_count:
+                return fault
+            # 连续多条“尖峰”说明真实水平已变化（如灌溉后），以新水平重新学习
+            state.count = 0
+            fault = None
+        state.rejected_run = 0
+        self.learn(state, value)
+        if fault is None:
+            self.peers.setdefault((location, metric), PeerGroup()).update(sensor_id, value)
+        return fault
+
+    def check_drift(self, location, sensor_id, metric, value, state):
+        tolerance = PEER_TOLERANCES.get(metric)
+        group = self.peers.get((location, metric))
+        if tolerance is None or group is None:
+            return None
+        reference = group.others_mean(sensor_id)
+        if reference is None:
+            return None
+        deviation = (value - reference) / tolerance
+        state.cusum_high = max(0.0, state.cusum_high + deviation - self.drift_slack)
+        state.cusum_low = max(0.0, state.cusum_low - deviation - self.drift_slack)
+        if max(state.cusum_high, state.cusum_low) > self.drift_threshold:
+            return 'drift'
+        return None
+
+    def learn(self, state, value):
+        if state.count == 0:
+            state.mean = value
+            state.noise_var = 0.0
+        else:
+            diff = value - state.last
+            # 相邻差分估计噪声，对缓慢的真实趋势不敏感
+            state.noise_var += self.alpha * (diff * diff / 2.0 - state.noise_var)
+            state.mean += self.alpha * (value - state.mean)
+        state.last = value
+        state.count += 1
+
+    def screen(self, sensor_id, location, timestamp, values, stateful=True):
+        # stateful=False 只做量程检查，不累积任何按传感器的状态
+        clean = {}
+        faults = []
+        with self.lock:
+            self.checked += 1
+            states = self.sensor_states(location, sensor_id) if stateful else None
+            for metric, value in values.items():
+                if stateful:
+                    fault = self.check_metric(location, sensor_id, metric, value, states)
+                else:
+                    fault = None if metric_in_range(metric, value) else 'out_of_range'
+                if fault is None:
+                    clean[metric] = value
+                    continue
+                self.fault_counts[fault] += 1
+                entry = {
+                    'sensor_id': sensor_id,
+                    'location': location,
+                    'metric': metric,
+                    'value': value,
+                    'fault': fault,
+                    'timestamp': datetime.fromtimestamp(timestamp).isoformat()
+                }
+                self.quarantine.append(entry)
+                faults.append(entry)
+            if faults:
+                self.last_fault[location] = time.time()
+                self.last_fault.move_to_end(location)
+                if len(self.last_fault) > self.max_sensors:
+                    self.last_fault.popitem(last=False)
+        return clean, faults
+
+    def screen_payload(self, payload, stateful=True):
+        sensor_id = str(payload.get('sensor_id', 'unknown'))
+        location = str(payload.get('location', 'unknown'))
+        timestamp = parse_timestamp(payload.get('timestamp'))
+        clean, faults = self.screen(
+            sensor_id, location, timestamp, normalize_readings(payload.get('readings')), stateful
+        )
+        if not clean:
+            return None, faults
+        return dict(payload, readings=clean), faults
+
+    def has_recent_faults(self, location, seconds=600):
+        return time.time() - self.last_fault.get(location, 0.0) <= seconds
+
+    def quarantined(self, location=None, sensor_id=None, limit=50):
+        with self.lock:
+            entries = [
+                e for e in reversed(self.quarantine)
+                if (location is None or e['location'] == location) and (sensor_id is None or e['sensor_id'] == sensor_id)
+            ]
+        return entries[:limit]
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'checked': self.checked,
+                'tracked_sensors': len(self.states),
+                'tracked_metrics': sum(len(states) for states in self.states.values()),
+                'quarantined': len(self.quarantine),
+                'faults': dict(self.fault_counts)
+            }
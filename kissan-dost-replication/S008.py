@@ -0,0 +1,202 @@
+from S000 import *
+import gzip
+import random
+import requests
+from requests.adapters import HTTPAdapter
+
+SPILL_PATH = "kissan_spill.ndjson"
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+class BackendClient:
+    # 复用连接池的 HTTP 客户端：大请求体 gzip 压缩，失败按指数退避+抖动重试，仍失败则落盘待网络恢复后补发
+    def __init__(self, pool_size=4, timeout=10.0, max_retries=3, backoff_base=0.5, backoff_max=30.0,
+                 gzip_min_bytes=1024, spill_path=SPILL_PATH, spill_max_bytes=50 * 1024 * 1024,
+                 drain_batch_size=500):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.gzip_min_bytes = gzip_min_bytes
+        self.spill_path = spill_path
+        self.spill_max_bytes = spill_max_bytes
+        self.drain_batch_size = drain_batch_size
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # 同一把锁保护计数器和暂存文件的所有读写（追加、裁剪、补发前后的改写）
+        self.lock = threading.Lock()
+        self.draining = False
+        self.requests_sent = 0
+        self.retries = 0
+        self.failures = 0
+        self.bytes_raw = 0
+        self.bytes_sent = 0
+        self.spilled = 0
+        self.spill_dropped = 0
+        self.drained = 0
+
+    def encode(self, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        headers = {"Content-Type": "application/json"}
+        raw_size = len(body)
+        if len(body) >= self.gzip_min_bytes:
+            body = gzip.compress(body, compresslevel=6)
+            headers["Content-Encoding"] = "gzip"
+        with self.lock:
+            self.bytes_raw += raw_size
+            self.bytes_sent += len(body)
+        return body, headers
+
+    def backoff(self, attempt):
+        # full jitter：在 [0, min(上限, 基数*2^n)] 内随机等待，避免大量网关同时重连
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def request(self, method, url, payload=None, max_retries=None, timeout=None):
+        body, headers = self.encode(payload) if payload is not None else (None, {})
+        retries = self.max_retries if max_retries is None else max_retries
+        for attempt in range(retries + 1):
+            try:
+                with self.lock:
+                    self.requests_sent += 1
+                response = self.session.request(method, url, data=body, headers=headers, timeout=timeout or self.timeout)
+                if response.status_code not in RETRY_STATUS:
+                    return response
+                printLog(f"后端返回 {response.status_code}，准备重试: {url}", "WARNING")
+            except requests.RequestException as e:
+                printLog(f"请求失败({attempt + 1}/{retries + 1}): {url} {e}", "WARNING")
+            if attempt < retries:
+                with self.lock:
+                    self.retries += 1
+                time.sleep(self.backoff(attempt))
+        with self.lock:
+            self.failures += 1
+        return None
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post_json(self, url, payload, **kwargs):
+        return self.request("POST", url, payload, **kwargs)
+
+    def send(self, url, payload):
+        response = self.post_json(url, payload)
+        if response is None:
+            self.spill(url, payload)
+            return None
+        if response.status_code == 200 and self.spill_pending():
+            self.drain_spill(url.rsplit("/api/", 1)[0])
+        return response
+
+    def spill_pending(self):
+        for path in (self.spill_path, self.spill_path + ".draining"):
+            try:
+                if os.path.getsize(path) > 0:
+                    return True
+            except OSError:
+                pass
+        return False
+
+    def spill(self, url, payload):
+        line = json.dumps({"url": url, "payload": payload}, ensure_ascii=False) + "\n"
+        with self.lock:
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                f.write(line)
+            self.spilled += 1
+            if os.path.getsize(self.spill_path) > self.spill_max_bytes:
+                self.trim_spill()
+        printLog(f"后端不可用，数据已暂存到本地: {self.spill_path}", "WARNING")
+
+    def trim_spill(self):
+        # 调用方持有 self.lock；超过上限时丢弃最旧的数据，保留约 80% 容量
+        with open(self.spill_path, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+        kept, size = [], 0
+        for line in reversed(lines):
+            size += len(line.encode("utf-8"))
+            if size > self.spill_max_bytes * 0.8:
+                break
+            kept.append(line)
+        self.spill_dropped += len(lines) - len(kept)
+        self.rewrite_spill(reversed(kept))
+        printLog(f"本地暂存已满，丢弃最旧的 {len(lines) - len(kept)} 条数据", "WARNING")
+
+    def rewrite_spill(self, lines):
+        tmp_path = self.spill_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+        os.replace(tmp_path, self.spill_path)
+
+    def drain_spill(self, backend_url):
+        # 补发期间暂存文件先改名为 .draining，新的失败数据和裁剪只作用于新文件，
+        # 补发结束后再把未发出的数据放回文件开头；所有文件操作都在 self.lock 内完成
+        draining_path = self.spill_path + ".draining"
+        with self.lock:
+            if self.draining:
+                return 0
+            self.draining = True
+            # 上次补发中途退出留下的文件优先处理
+            if not os.path.exists(draining_path) and os.path.exists(self.spill_path):
+                os.replace(self.spill_path, draining_path)
+        try:
+            try:
+                with open(draining_path, "r", encoding="utf-8") as f:
+                    lines = f.readlines()
+            except OSError:
+                return 0
+            # 单条与批量暂存统一合并为批量请求补发
+            readings = []
+            for line in lines:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                payload = entry.get("payload")
+                readings.extend(payload if isinstance(payload, list) else [payload])
+            sent = 0
+            batch_url = f"{backend_url}/api/v1/ingest/batch"
+            while sent < len(readings):
+                chunk = readings[sent:sent + self.drain_batch_size]
+                response = self.post_json(batch_url, chunk, max_retries=0)
+                if response is None or response.status_code != 200:
+                    break
+                sent += len(chunk)
+            remaining = [
+                json.dumps({"url": batch_url, "payload": reading}, ensure_ascii=False) + "\n"
+                for reading in readings[sent:]
+            ]
+            with self.lock:
+                try:
+                    with open(self.spill_path, "r", encoding="utf-8") as f:
+                        appended = f.readlines()
+                except OSError:
+                    appended = []
+                self.rewrite_spill(remaining + appended)
+                os.remove(draining_path)
+                if remaining and os.path.getsize(self.spill_path) > self.spill_max_bytes:
+                    self.trim_spill()
+                self.drained += sent
+            if sent:
+                printLog(f"已补发本地暂存数据: {sent}条, 剩余{len(readings) - sent}条")
+            return sent
+        finally:
+            with self.lock:
+                self.draining = False
+
+    def get_stats(self):
+        with self.lock:
+            stats = {
+                'requests': self.requests_sent,
+                'retries': self.retries,
+                'failures': self.failures,
+                'bytes_raw': self.bytes_raw,
+                'bytes_sent': self.bytes_sent,
+                'spilled': self.spilled,
+                'spill_dropped': self.spill_dropped,
+                'drained': self.drained
+            }
+        stats['spill_pending'] = self.spill_pending()
+        return stats
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,223 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+
+SENSOR_TYPES = ['soil_moisture', 'temperature', 'humidity', 'ph_sensor', 'npk_sensor']
+WARMUP = 5
+
+def summarize(samples):
+    samples_us = samples * 1e6
+    run_p50s = np.percentile(samples_us, 50, axis=1)
+    return {
+        'iterations': samples.shape[1],
+        'repeats': samples.shape[0],
+        'mean_us': round(float(samples_us.mean()), 3),
+        'p50_us': round(float(np.median(run_p50s)), 3),
+        'p50_runs_us': [round(float(p50), 3) for p50 in run_p50s],
+        'p95_us': round(float(np.percentile(samples_us, 95)), 3),
+        'min_us': round(float(samples_us.min()), 3),
+        'ops_per_second': round(float(samples.size / samples.sum()), 2)
+    }
+
+def run_cases(cases, repeats, warmup=WARMUP):
+    # 各项轮流测量多轮：一段时间内的机器抖动只落在某一轮上，对比时据此排除
+    for func, iterations in cases.values():
+        for _ in range(warmup):
+            func()
+    samples = {name: np.empty((repeats, iterations)) for name, (func, iterations) in cases.items()}
+    for run in range(repeats):
+        for name, (func, iterations) in cases.items():
+            for i in range(iterations):
+                started = time.perf_counter()
+                func()
+                samples[name][run, i] = time.perf_counter() - started
+    return {name: summarize(case_samples) for name, case_samples in samples.items()}
+
+def synthetic_fleet(sensors, locations):
+    fleet = []
+    for i in range(sensors):
+        sensor_type = SENSOR_TYPES[i % len(SENSOR_TYPES)]
+        fleet.append({'type': sensor_type, 'id': f"{sensor_type}_{i:05d}", 'location': f"field_{i % locations + 1}"})
+    return fleet
+
+def synthetic_payload(sensor_id, location):
+    return {
+        'sensor_id': sensor_id,
+        'location': location,
+        'timestamp': datetime.now().isoformat(),
+        'readings': {
+            'soil_moisture': round(random.uniform(20, 60), 1),
+            'temperature': round(random.uniform(15, 35), 1),
+            'humidity': round(random.uniform(40, 90), 1),
+            'ph': round(random.uniform(5.5, 7.0), 1),
+            'npk': {
+                'nitrogen': random.randint(30, 70),
+                'phosphorus': random.randint(20, 60),
+                'potassium': random.randint(25, 65)
+            }
+        }
+    }
+
+def component_benchmarks(args):
+    from S001 import IoTDataCollector, SensorDataModel, LanguageTranslationModel
+    cases = {}
+    collector = IoTDataCollector()
+    for config in synthetic_fleet(args.sensors, args.locations):
+        collector.add_sensor(config['type'], config['id'], config)
+    raw = collector.collect_data()
+    cases['collector.collect_data'] = (collector.collect_data, args.iterations)
+    cases['collector.preprocess_data'] = (lambda: collector.preprocess_data(raw), args.iterations)
+    cases['collector.collect_by_location'] = (collector.collect_by_location, args.iterations)
+
+    model = SensorDataModel()
+    model.train(None)
+    location_data = collector.collect_by_location()
+    sample = next(iter(location_data.values()))
+    rows = list(location_data.values())
+    cases['sensor_model.predict'] = (lambda: model.predict(sample), args.iterations)
+    cases[f'sensor_model.predict_batch[{len(rows)}]'] = (lambda: model.predict_batch(rows), args.iterations)
+
+    language_model = LanguageTranslationModel()
+    status = model.predict(sample)
+    advice_cases = {
+        'water': lambda: language_model.generate_water_advice(status, sample),
+        'fertilizer': lambda: language_model.generate_fertilizer_advice(status, sample),
+        'pest_control': lambda: language_model.generate_pest_control_advice(),
+        'temperature': lambda: language_model.generate_temperature_advice(sample),
+        'soil': lambda: language_model.generate_soil_advice(sample),
+        'detailed': lambda: language_model.generate_detailed_advice(status, sample)
+    }
+    for name, func in advice_cases.items():
+        cases[f'language_model.generate_{name}_advice'] = (func, args.iterations)
+    return run_cases(cases, args.repeats)
+
+def api_benchmarks(args):
+    from fastapi.testclient import TestClient
+    import main
+    from S006 import ChatHistoryStore
+    # 聊天记录写入临时库，避免污染本地数据
+    tmp_dir = tempfile.mkdtemp(prefix="kissan_bench_")
+    main.chat_history = ChatHistoryStore(db_path=os.path.join(tmp_dir, "chat.db"))
+    # TestClient 不触发 startup 事件，这里同步完成 AI 系统加载
+    main.load_ai_system(start_scheduler=False)
+    client = TestClient(main.app)
+    fleet = [(f"bench_{i:05d}", f"field_{i % args.locations + 1}") for i in range(args.sensors)]
+
+    def ingest():
+        sensor_id, location = random.choice(fleet)
+        client.post('/api/v1/ingest', json=synthetic_payload(sensor_id, location))
+
+    # 每次请求都用新生成的读数：重复发送同一批会被卡死检测整批隔离，测到的就不是写入路径了
+    # 批次提前生成，生成耗时不计入测量
+    batch_iterations = max(args.iterations // 4, 20)
+    batches = iter([
+        [synthetic_payload(*random.choice(fleet)) for _ in range(args.batch_size)]
+        for _ in range(WARMUP + batch_iterations * args.repeats)
+    ])
+
+    def ingest_batch():
+        client.post('/api/v1/ingest/batch', json=next(batches))
+
+    messages = ['需要浇水吗', '该施什么肥', '土壤ph怎么样', '最近温度如何', '作物情况怎么样']
+
+    def chat():
+        location = random.choice(fleet)[1]
+        client.post('/api/v1/chat', json={'user_id': 'bench', 'message': random.choice(messages), 'location': location})
+
+    return run_cases({
+        'api.ingest': (ingest, args.iterations),
+        f'api.ingest_batch[{args.batch_size}]': (ingest_batch, batch_iterations),
+        'api.chat': (chat, args.iterations)
+    }, args.repeats)
+
+def compare(results, baseline, threshold, min_iterations):
+    regressions = []
+    print(f"{'benchmark':<48}{'baseline p50(us)':>18}{'current p50(us)':>18}{'ratio':>8}")
+    for name, current in results['benchmarks'].items():
+        previous = baseline.get('benchmarks', {}).get(name)
+        if previous is None:
+            print(f"{name:<48}{'-':>18}{current['p50_us']:>18}{'new':>8}")
+            continue
+        # 取本次各轮 p50 中最快的一轮与基线比较：只有每一轮都变慢才算回退
+        best = min(current.get('p50_runs_us') or [current['p50_us']])
+        ratio = best / previous['p50_us'] if previous['p50_us'] else 1.0
+        if min(current['iterations'], previous['iterations']) < min_iterations:
+            flag = " (样本不足，不判定)"
+        else:
+            flag = " ⚠️" if ratio > 1 + threshold else ""
+        print(f"{name:<48}{previous['p50_us']:>18}{best:>18}{ratio:>8.2f}{flag}")
+        if flag == " ⚠️":
+            regressions.append({'benchmark': name, 'ratio': round(ratio, 3)})
+    return regressions
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Kissan-Dost 性能基准测试")
+    parser.add_argument("--sensors", type=int, default=100, help="合成传感器数量")
+    parser.add_argument("--locations", type=int, default=10, help="合成地块数量")
+    parser.add_argument("--iterations", type=int, default=200, help="每项每轮测量次数")
+    parser.add_argument("--repeats", type=int, default=5, help="每项测量的轮数，各项轮流进行")
+    parser.add_argument("--batch-size", type=int, default=100, help="批量接口每次的读数条数")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--only", choices=["components", "api"], help="只运行一组基准")
+    parser.add_argument("--output", default="benchmark_results.json", help="结果JSON输出路径")
+    parser.add_argument("--baseline", help="与之对比的基线JSON")
+    parser.add_argument("--threshold", type=float, default=0.2, help="每轮 p50 都变慢超过该比例才视为回退")
+    parser.add_argument("--min-iterations", type=int, default=50, help="单轮测量次数少于该值的项只报告不判定")
+    parser.add_argument("--save-baseline", help="把本次结果另存为基线")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    benchmarks = {}
+    # 被测代码的 print 输出不计入结果，也不刷屏
+    with contextlib.redirect_stdout(io.StringIO()):
+        if args.only != "api":
+            benchmarks.update(component_benchmarks(args))
+        if args.only != "components":
+            benchmarks.update(api_benchmarks(args))
+    results = {
+        'timestamp': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'parameters': {
+            'sensors': args.sensors,
+            'locations': args.locations,
+            'iterations': args.iterations,
+            'repeats': args.repeats,
+            'batch_size': args.batch_size,
+            'seed': args.seed
+        },
+        'benchmarks': benchmarks
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"📄 基准结果已写入: {args.output}")
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"📌 基线已保存: {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.min_iterations)
+        if regressions:
+            print(f"❌ 发现 {len(regressions)} 项性能回退 (阈值 {args.threshold:.0%})")
+            return 1
+        print("✅ 未发现性能回退")
+    else:
+        for name, stats in benchmarks.items():
+            print(f"{name:<48} p50={stats['p50_us']}us p95={stats['p95_us']}us {stats['ops_per_second']} ops/s")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
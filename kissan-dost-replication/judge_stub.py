@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+本地评审模型桩服务，用于无网络环境下测试 ResultEvaluator
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 各评审模型的基准分，与本地评估器保持一致
+BASE_SCORES = {'gpt-4': 0.85, 'deepseek-chat': 0.82, 'qwen-max': 0.80, 'gemini-pro': 0.78}
+
+def stub_score(model, item):
+    # 同一条预测在同一模型下得分固定，便于复现
+    digest = hashlib.md5(json.dumps(item, sort_keys=True, ensure_ascii=False).encode('utf-8')).digest()
+    jitter = (digest[0] / 255.0 - 0.5) * 0.1
+    return round(min(max(BASE_SCORES.get(model, 0.75) + jitter, 0.0), 1.0), 4)
+
+class JudgeHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    fail_rate = 0.0
+    slow_models = set()
+
+    def do_POST(self):
+        if self.path != '/v1/judge':
+            return self.reply(404, {'error': 'not found'})
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        try:
+            request = json.loads(body)
+        except ValueError:
+            return self.reply(400, {'error': 'invalid json'})
+        model = request.get('model', '')
+        items = request.get('items', [])
+        # 模拟远程模型的推理耗时：固定延迟 + 每条少量耗时
+        time.sleep(self.latency * (10 if model in self.slow_models else 1) + 0.001 * len(items))
+        if random.random() < self.fail_rate:
+            return self.reply(503, {'error': 'overloaded'})
+        self.reply(200, {'model': model, 'scores': [stub_score(model, item) for item in items]})
+
+    def reply(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地评审模型桩服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", type=float, default=0.2, help="每次请求的模拟延迟(秒)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="随机返回503的比例")
+    parser.add_argument("--slow", nargs="*", default=[], help="延迟放大10倍的模型，用于测试超时")
+    args = parser.parse_args()
+    JudgeHandler.latency = args.latency
+    JudgeHandler.fail_rate = args.fail_rate
+    JudgeHandler.slow_models = set(args.slow)
+    server = ThreadingHTTPServer((args.host, args.port), JudgeHandler)
+    print(f"🧪 评审桩服务已启动: http://{args.host}:{args.port}/v1/judge")
+    print(f"   模拟延迟 {args.latency}s, 失败率 {args.fail_rate:.0%}, 慢模型 {sorted(JudgeHandler.slow_models)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n🛑 评审桩服务已停止")
@@ -1,20 +1,40 @@
-from fastapi import FastAPI
+import time
+PROCESS_STARTED = time.perf_counter()
+
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 import uvicorn
+import asyncio
+import hmac
 import os
 import sys
+import threading
 from datetime import datetime
 
 # 添加当前目录到 Python 路径
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-try:
-    from S002 import AgricultureAISystem
-    agri_ai_system = AgricultureAISystem()
-    AI_SYSTEM_LOADED = True
-except Exception as e:
-    print(f"❌ AI系统加载失败: {e}")
-    AI_SYSTEM_LOADED = False
+from S000 import IntentClassifier, SensorReadingBatch, metrics, observe_stage
+from S003 import SensorTimeSeriesStore, parse_timestamp, parse_batch_body, validate_batch
+from S005 import (
+    InferenceExecutor, ExecutorBusyError, EventHub, AnalysisScheduler, StackProfiler,
+    GzipRequestMiddleware, RequestMetricsMiddleware, ProfilingMiddleware, encode_sse, profiled,
+    read_limited_body
+)
+from S007 import SensorAnomalyDetector
+
+# AI系统在端口绑定后由后台线程预热加载；加载完成前接口走降级模式，/health 报告就绪状态
+agri_ai_system = None
+AI_SYSTEM_LOADED = False
+ai_system_state = "pending"
+ai_system_lock = threading.Lock()
+startup_timings = {}
+
+def mark_startup(stage, started):
+    startup_timings[stage] = round(time.perf_counter() - started, 4)
+    observe_stage(f"startup_{stage}", started)
 
 app = FastAPI(
     title="Kissan-Dost API",
@@ -29,48 +49,314 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# 剖析默认关闭，可通过环境变量或 /admin/profile 在运行时开启
+profiler = StackProfiler(
+    enabled=os.environ.get("KISSAN_PROFILE", "0") == "1",
+    sample_rate=float(os.environ.get("KISSAN_PROFILE_RATE", 0)),
+    interval=float(os.environ.get("KISSAN_PROFILE_INTERVAL", 0.005))
+)
+app.add_middleware(ProfilingMiddleware, profiler=profiler, routes=app.routes)
+ADMIN_TOKEN = os.environ.get("KISSAN_ADMIN_TOKEN")
 
-latest_sensor_data = {}
-chat_history = []
+def require_admin(request: Request):
+    # 管理接口可开关剖析并暴露代码路径；CORS 对所有来源开放，因此必须携带管理令牌，
+    # 未配置 KISSAN_ADMIN_TOKEN 时只允许本机访问
+    if ADMIN_TOKEN:
+        token = request.headers.get("x-admin-token", "")
+        if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+            raise HTTPException(status_code=401, detail="管理令牌无效")
+    elif request.client is None or request.client.host not in ("127.0.0.1", "::1"):
+        raise HTTPException(status_code=403, detail="未配置管理令牌，仅允许本机访问")
+app.add_middleware(GzipRequestMiddleware)
+app.add_middleware(RequestMetricsMiddleware, routes=app.routes)
 
-@app.on_event("startup")
-async def startup_event():
-    print("🚀 初始化农业AI系统...")
+# 多 worker 模式下由启动进程设置，所有 worker 共享同一个 SQLite 状态文件
+SHARED_STATE_PATH = os.environ.get("KISSAN_SHARED_STATE")
+if SHARED_STATE_PATH:
+    from S006 import SharedState
+    shared_state = SharedState(SHARED_STATE_PATH)
+    sensor_store = shared_state.sensor_store
+    chat_history = shared_state.chat_history_store
+else:
+    shared_state = None
+    sensor_store = SensorTimeSeriesStore()
+    chat_history = None
+chat_history_lock = threading.Lock()
+
+def chat_history_store():
+    # 聊天记录库依赖 sqlalchemy，预热或首次使用时才创建，不拖慢进程启动
+    global chat_history
+    if chat_history is None:
+        with chat_history_lock:
+            if chat_history is None:
+                started = time.perf_counter()
+                from S006 import ChatHistoryStore
+                chat_history = ChatHistoryStore()
+                mark_startup("chat_history", started)
+    return chat_history
+
+inference_executor = InferenceExecutor(
+    max_workers=int(os.environ.get("KISSAN_INFERENCE_WORKERS", 4)),
+    max_queue=int(os.environ.get("KISSAN_INFERENCE_QUEUE", 64)),
+    timeout=float(os.environ.get("KISSAN_INFERENCE_TIMEOUT", 10))
+)
+event_hub = EventHub()
+event_loop = None
+anomaly_detector = SensorAnomalyDetector()
+
+def update_features(sensor_id, location, timestamp, values):
     if AI_SYSTEM_LOADED:
+        agri_ai_system.feature_engine.update(sensor_id, location, timestamp, values)
+
+if shared_state is None:
+    # 多 worker 模式下特征由流处理进程统一计算
+    sensor_store.add_observer(update_features)
+
+def plan_analysis():
+    # 只调度已收到真实读数的地块
+    snapshot = sensor_store.location_snapshot()
+    if shared_state is not None:
+        has_recent_faults = shared_state.quarantine.recent_locations().__contains__
+    else:
+        has_recent_faults = anomaly_detector.has_recent_faults
+    return {
+        location: agri_ai_system.location_priority(location, readings, has_recent_faults(location))
+        for location, readings in snapshot.items()
+    }
+
+def run_scheduled_analysis(locations):
+    # 没有真实读数的地块不分析（不用模拟读数代替），调度器下个周期再试
+    results = agri_ai_system.analyze_locations(sensor_store.location_batch(locations))
+    computed_at = datetime.now().isoformat()
+    for result in results.values():
+        result['computed_at'] = computed_at
+    if shared_state is not None:
+        shared_state.analysis_results.publish(results)
+    return results
+
+analysis_scheduler = AnalysisScheduler(
+    plan_analysis,
+    run_scheduled_analysis,
+    interval=float(os.environ.get("KISSAN_ANALYSIS_INTERVAL", 300)),
+    urgent_interval=float(os.environ.get("KISSAN_ANALYSIS_URGENT_INTERVAL", 60)),
+    max_workers=int(os.environ.get("KISSAN_ANALYSIS_WORKERS", 2)),
+    dirty_interval=float(os.environ.get("KISSAN_ANALYSIS_DIRTY_INTERVAL", 10))
+)
+# 多 worker 模式下只有持有租约的进程运行有状态检测、特征计算和分析调度，局限见 SharedStreamProcessor
+if shared_state is not None:
+    from S006 import SharedStreamProcessor
+    stream_processor = SharedStreamProcessor(
+        shared_state,
+        on_acquire=analysis_scheduler.start,
+        on_release=analysis_scheduler.stop,
+        on_faults=lambda faults: publish_faults_threadsafe(faults),
+        on_readings=analysis_scheduler.mark_dirty
+    )
+else:
+    stream_processor = None
+
+INGESTED_READINGS = metrics.counter("kissan_ingested_readings_total", "写入存储的传感器读数")
+QUARANTINED_READINGS = metrics.counter("kissan_quarantined_readings_total", "被隔离的异常读数")
+CHAT_RESPONSES = metrics.counter("kissan_chat_responses_total", "聊天回复数")
+metrics.gauge("kissan_inference_queue_depth", "推理线程池排队数", lambda: inference_executor.queued)
+metrics.gauge("kissan_inference_running", "推理线程池执行中任务数", lambda: inference_executor.running)
+metrics.gauge("kissan_sse_subscribers", "SSE订阅者数",
+              lambda: sum(len(group) for group in event_hub.subscribers.values()))
+metrics.gauge("kissan_quarantine_entries", "隔离区记录数", lambda: len(anomaly_detector.quarantine))
+metrics.gauge("kissan_analysis_in_flight", "调度中的地块分析数", lambda: len(analysis_scheduler.in_flight))
+metrics.gauge("kissan_analysis_cached_locations", "已缓存分析结果的地块数", lambda: len(analysis_scheduler.results))
+metrics.gauge("kissan_ai_system_ready", "AI系统是否已加载完成", lambda: float(AI_SYSTEM_LOADED))
+metrics.gauge("kissan_response_cache_entries", "建议缓存条目数",
+              lambda: len(agri_ai_system.model_b.response_cache.entries) if AI_SYSTEM_LOADED else 0)
+mark_startup("app", PROCESS_STARTED)
+
+def load_ai_system(start_scheduler=True):
+    global agri_ai_system, AI_SYSTEM_LOADED, ai_system_state
+    with ai_system_lock:
+        if ai_system_state in ("ready", "failed"):
+            return AI_SYSTEM_LOADED
+        ai_system_state = "loading"
         try:
-            agri_ai_system.setup_iot_sensors(None)
-            print("✅ 农业AI系统初始化完成")
+            chat_history_store()
+            started = time.perf_counter()
+            from S002 import AgricultureAISystem
+            mark_startup("import_ai_system", started)
+            started = time.perf_counter()
+            system = AgricultureAISystem()
+            system.setup_iot_sensors(None)
+            mark_startup("init_ai_system", started)
+            started = time.perf_counter()
+            if system.load_pretrained_models():
+                print("✅ 已加载预训练传感器模型")
+            mark_startup("load_models", started)
+            # 空读数跑一次推理，提前加载 numpy 等推理依赖，避免首个请求承担导入开销
+            started = time.perf_counter()
+            system.model_a.predict_batch([{}])
+            mark_startup("warm_inference", started)
+            if shared_state is not None:
+                system.feature_engine = shared_state.features
+            agri_ai_system = system
+            AI_SYSTEM_LOADED = True
+            if start_scheduler:
+                if stream_processor is not None:
+                    # 调度器随流处理租约在唯一进程中启停
+                    stream_processor.start()
+                else:
+                    analysis_scheduler.start()
+            ai_system_state = "ready"
+            mark_startup("ready", PROCESS_STARTED)
+            print(f"✅ 农业AI系统初始化完成，启动耗时 {startup_timings['ready']:.2f}s")
         except Exception as e:
-            print(f"❌ AI系统初始化失败: {e}")
-    else:
-        print("⚠️ AI系统未加载，使用降级模式")
+            ai_system_state = "failed"
+            print(f"❌ AI系统初始化失败，使用降级模式: {e}")
+        return AI_SYSTEM_LOADED
+
+@app.on_event("startup")
+async def startup_event():
+    global event_loop
+    event_loop = asyncio.get_running_loop()
+    print("🚀 后台预热农业AI系统...")
+    threading.Thread(target=load_ai_system, name="ai-warmup", daemon=True).start()
+    event_hub.start_heartbeat(heartbeat_status)
+    mark_startup("startup_event", PROCESS_STARTED)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if stream_processor is not None:
+        stream_processor.stop()
+    analysis_scheduler.stop()
 
 @app.get("/")
 async def root():
     return {"message": "Kissan-Dost API 服务运行中", "status": "healthy"}
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/admin/profile", dependencies=[Depends(require_admin)])
+async def get_profile(tag: str = None):
+    # collapsed stacks，可直接交给 flamegraph.pl / speedscope 渲染
+    return PlainTextResponse(profiler.collapsed(tag))
+
+@app.get("/admin/profile/stats", dependencies=[Depends(require_admin)])
+async def get_profile_stats():
+    return {"status": "success", "profiler": profiler.get_stats()}
+
+@app.post("/admin/profile", dependencies=[Depends(require_admin)])
+async def configure_profile(request: dict):
+    profiler.configure(request.get("enabled"), request.get("sample_rate"), request.get("interval"))
+    if request.get("reset"):
+        profiler.reset()
+    return {"status": "success", "profiler": profiler.get_stats()}
+
+@app.delete("/admin/profile", dependencies=[Depends(require_admin)])
+async def reset_profile():
+    profiler.reset()
+    return {"status": "success", "profiler": profiler.get_stats()}
+
 @app.get("/health")
 async def health_check():
     if AI_SYSTEM_LOADED:
         try:
-            system_status = agri_ai_system.get_system_status()
+            system_status = await run_store(agri_ai_system.get_system_status)
         except:
             system_status = {"status": "ai_system_error"}
     else:
-        system_status = {"status": "ai_system_not_loaded"}
+        system_status = {"status": f"ai_system_{ai_system_state}"}
     
     return {
         "status": "healthy", 
+        "ready": AI_SYSTEM_LOADED,
         "service": "kissan-dost-backend",
         "ai_system_status": system_status,
+        "startup": dict(startup_timings),
+        "timestamp": datetime.now().isoformat()
+    }
+
+def heartbeat_status():
+    return {
+        "status": "healthy",
+        "ai_system": AI_SYSTEM_LOADED,
         "timestamp": datetime.now().isoformat()
     }
 
+def publish_reading(data, sensor_id, location, timestamp):
+    if event_hub.has_subscribers(location):
+        event_hub.publish("reading", {
+            "sensor_id": sensor_id,
+            "location": location,
+            "timestamp": datetime.fromtimestamp(timestamp).isoformat(),
+            "readings": data.get("readings", {})
+        }, location)
+
+def record_crop(payload, location):
+    crop = (payload.get("metadata") or {}).get("crop_type")
+    if crop:
+        agri_ai_system.location_crops[location] = crop
+
+def mark_analysis_dirty(locations):
+    # 新读数让缓存的分析结果过期；多 worker 模式下由流处理进程统一标记
+    if shared_state is None:
+        analysis_scheduler.mark_dirty(locations)
+
+def publish_faults(faults):
+    for fault in faults:
+        QUARANTINED_READINGS.inc(labels=(("fault", fault["fault"]),))
+        if event_hub.has_subscribers(fault["location"]):
+            event_hub.publish("quarantine", fault, fault["location"])
+
+def publish_faults_threadsafe(faults):
+    # 流处理线程判定的故障交回事件循环发布，EventHub 的订阅队列只能在事件循环线程中使用
+    if event_loop is not None:
+        event_loop.call_soon_threadsafe(publish_faults, faults)
+
+async def run_store(func, *args):
+    # 共享模式下的读写落在 SQLite 上，放到线程池执行以免阻塞事件循环；内存存储直接调用
+    if shared_state is None:
+        return func(*args)
+    return await run_in_threadpool(profiled(func), *args)
+
+def observe_location_states(locations):
+    for location in locations:
+        agri_ai_system.model_b.observe_sensor_state(
+            location, agri_ai_system.with_trend_features(location, sensor_store.latest_readings(location))
+        )
+
+def append_chat_history(entry):
+    chat_history_store().append(entry)
+
+def page_chat_history(user_id, limit, cursor):
+    return chat_history_store().page(user_id, limit, cursor)
+
+def screen_payloads(payloads):
+    # 多 worker 模式下写入前只做无状态的量程检查，有状态判定交给流处理进程
+    screened = [anomaly_detector.screen_payload(payload, stateful=shared_state is None) for payload in payloads]
+    if shared_state is not None:
+        shared_state.quarantine.record([fault for clean, faults in screened for fault in faults])
+    return screened
+
+@app.get("/api/v1/stream")
+async def stream_events(location: str = None):
+    subscriber = event_hub.subscribe(location)
+    return StreamingResponse(
+        event_hub.stream(subscriber),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/api/v1/system-status")
 async def get_system_status():
     if AI_SYSTEM_LOADED:
         try:
-            return agri_ai_system.get_system_status()
+            status_info = await run_store(agri_ai_system.get_system_status)
+            status_info['inference_executor'] = inference_executor.get_stats()
+            status_info['event_hub'] = event_hub.get_stats()
+            status_info['anomaly_detector'] = anomaly_detector.get_stats()
+            status_info['analysis_scheduler'] = analysis_scheduler.get_stats()
+            if stream_processor is not None:
+                status_info['stream_processor'] = stream_processor.get_stats()
+            return status_info
         except Exception as e:
             return {"status": "error", "message": str(e)}
     else:
@@ -78,13 +364,26 @@ async def get_system_status():
 
 @app.post("/api/v1/ingest")
 async def ingest_sensor_data(data: dict):
-    global latest_sensor_data
     try:
-        latest_sensor_data = data
+        clean, faults = (await run_store(screen_payloads, [data]))[0]
+        publish_faults(faults)
+        if clean is None:
+            print(f"🚫 传感器数据已隔离: {data.get('sensor_id', 'unknown')} - {[f['fault'] for f in faults]}")
+            return {"status": "quarantined", "message": "读数疑似传感器故障，已隔离", "faults": faults}
+        sensor_id, location, timestamp = (await run_store(
+            sensor_store.ingest_batch, SensorReadingBatch.from_payloads([clean], canonical=True)
+        ))[0]
+        INGESTED_READINGS.inc(labels=(("endpoint", "single"),))
+        mark_analysis_dirty([location])
+        publish_reading(clean, sensor_id, location, timestamp)
+        if AI_SYSTEM_LOADED:
+            record_crop(clean, location)
+            await run_store(observe_location_states, [location])
         print(f"📊 收到传感器数据: {data.get('sensor_id', 'unknown')} - {data.get('timestamp', 'unknown')}")
         return {
             "status": "success", 
             "message": "数据接收成功",
+            "faults": faults,
             "data_received": {
                 "sensor_id": data.get("sensor_id"),
                 "location": data.get("location"),
@@ -94,9 +393,60 @@ async def ingest_sensor_data(data: dict):
     except Exception as e:
         return {"status": "error", "message": f"数据处理失败: {str(e)}"}
 
+@app.post("/api/v1/ingest/batch")
+async def ingest_sensor_batch(request: Request):
+    try:
+        body = await read_limited_body(request)
+        if body is None:
+            return JSONResponse({"status": "error", "message": "请求体过大"}, status_code=413)
+        try:
+            items, parse_errors = parse_batch_body(body, request.headers.get("content-type", ""))
+        except ValueError as e:
+            return {"status": "error", "message": f"请求体解析失败: {str(e)}"}
+        valid, errors = validate_batch(items, parse_errors)
+        accepted = []
+        quarantined = []
+        screened = await run_store(screen_payloads, [item for index, item in valid])
+        for (index, item), (clean, faults) in zip(valid, screened):
+            publish_faults(faults)
+            if faults:
+                # 每条读数只计一次；部分指标被隔离时其余指标仍写入
+                quarantined.append({"index": index, "accepted": clean is not None, "faults": faults})
+            if clean is not None:
+                accepted.append(clean)
+        valid = accepted
+        # 摄入时规范化一次写入列式批量容器，存储直接按行读取
+        written = await run_store(sensor_store.ingest_batch, SensorReadingBatch.from_payloads(valid, canonical=True))
+        INGESTED_READINGS.inc(len(written), (("endpoint", "batch"),))
+        mark_analysis_dirty({location for sensor_id, location, timestamp in written})
+        for item, (sensor_id, location, timestamp) in zip(valid, written):
+            publish_reading(item, sensor_id, location, timestamp)
+            if AI_SYSTEM_LOADED:
+                record_crop(item, location)
+        if AI_SYSTEM_LOADED:
+            await run_store(observe_location_states, {location for sensor_id, location, timestamp in written})
+        print(f"📦 收到批量传感器数据: {len(valid)}条成功, {len(errors)}条失败, {len(quarantined)}条隔离")
+        if items and not valid:
+            status = "rejected"
+        elif errors or quarantined:
+            status = "partial"
+        else:
+            status = "success"
+        return {
+            "status": status,
+            "message": "批量数据接收完成",
+            "received": len(items),
+            "accepted": len(valid),
+            "rejected": len(errors),
+            "quarantined": len(quarantined),
+            "errors": errors,
+            "quarantined_items": quarantined
+        }
+    except Exception as e:
+        return {"status": "error", "message": f"数据处理失败: {str(e)}"}
+
 @app.post("/api/v1/chat")
 async def chat_endpoint(request: dict):
-    global chat_history, latest_sensor_data
     try:
         user_id = request.get("user_id", "unknown")
         user_message = request.get("message", "")
@@ -105,38 +455,34 @@ async def chat_endpoint(request: dict):
         
         print(f"💬 收到用户消息: {user_message}")
         
-        sensor_data_for_ai = {}
-        if latest_sensor_data and 'readings' in latest_sensor_data:
-            sensor_data_for_ai = latest_sensor_data['readings']
-            if 'npk' in sensor_data_for_ai and isinstance(sensor_data_for_ai['npk'], dict):
-                npk_data = sensor_data_for_ai.pop('npk')
-                sensor_data_for_ai.update({
-                    'npk_nitrogen': npk_data.get('nitrogen', 0),
-                    'npk_phosphorus': npk_data.get('phosphorus', 0),
-                    'npk_potassium': npk_data.get('potassium', 0)
-                })
+        sensor_data_for_ai = await run_store(sensor_store.latest_readings, location)
         
+        degraded = False
         if AI_SYSTEM_LOADED:
-            model_a_output = agri_ai_system.model_a.predict(sensor_data_for_ai)
-            ai_advice = agri_ai_system.model_b.predict(
-                model_a_output, 
-                sensor_data_for_ai, 
-                user_message=user_message
-            )
+            try:
+                ai_advice = await inference_executor.run(
+                    agri_ai_system.answer_question, user_message, sensor_data_for_ai, language, location
+                )
+            except (asyncio.TimeoutError, ExecutorBusyError) as e:
+                print(f"⚠️ 推理超时或队列已满，使用降级回复: {e!r}")
+                ai_advice = generate_fallback_response(user_message, sensor_data_for_ai)
+                degraded = True
         else:
             ai_advice = generate_fallback_response(user_message, sensor_data_for_ai)
+        CHAT_RESPONSES.inc(labels=(("mode", "degraded" if degraded else "normal"),))
         
         response_data = {
             "response": ai_advice,
             "advice": "请参考上述建议",
             "confidence": 0.85,
             "data_sources": {
-                "sensor_data": latest_sensor_data.get('readings', {}),
+                "sensor_data": sensor_data_for_ai,
                 "weather": "未来24小时无雨",
                 "market": "柑橘价格稳定",
                 "ai_system": "农业AI分析系统"
             },
             "actions": [{"type": "general", "description": "遵循AI建议", "urgency": "medium"}],
+            "degraded": degraded,
             "status": "success"
         }
         
@@ -147,10 +493,8 @@ async def chat_endpoint(request: dict):
             "ai_response": ai_advice,
             "location": location
         }
-        chat_history.append(chat_entry)
-        
-        if len(chat_history) > 100:
-            chat_history = chat_history[-100:]
+        # 聊天记录始终落在 SQLite，提交在线程池中完成
+        await run_in_threadpool(profiled(append_chat_history), chat_entry)
         
         return response_data
         
@@ -164,53 +508,230 @@ async def chat_endpoint(request: dict):
             "error": str(e)
         }
 
-def generate_fallback_response(user_message, sensor_data):
-    message_lower = user_message.lower()
-    
-    if any(word in message_lower for word in ['你好', '您好', 'hello']):
-        return "🌱 您好！我是果农助手，可以为您提供柑橘种植建议。"
+@app.post("/api/v1/chat/stream")
+async def chat_stream_endpoint(request: dict):
+    user_id = request.get("user_id", "unknown")
+    user_message = request.get("message", "")
+    location = request.get("location", "field_3")
+    language = request.get("language", "zh-CN")
+    print(f"💬 收到流式用户消息: {user_message}")
     
-    if any(word in message_lower for word in ['浇水', '灌溉']):
-        moisture = sensor_data.get('soil_moisture', 50)
-        return f"💧 当前土壤湿度{moisture}%，建议{'立即浇水' if moisture < 30 else '保持当前灌溉'}"
+    # 生成器的每一步都经推理线程池执行，与非流式聊天共用并发上限和超时
+    async def event_source():
+        yield encode_sse("start", {"location": location, "timestamp": datetime.now().isoformat()})
+        sections = []
+        mode = "stream"
+        try:
+            sensor_data_for_ai = await run_store(sensor_store.latest_readings, location)
+            if AI_SYSTEM_LOADED:
+                try:
+                    async for chunk in inference_executor.stream(
+                        agri_ai_system.answer_question_stream, user_message, sensor_data_for_ai, language, location
+                    ):
+                        sections.append(chunk)
+                        yield encode_sse("delta", {"text": chunk})
+                except (asyncio.TimeoutError, ExecutorBusyError) as e:
+                    if sections:
+                        raise
+                    print(f"⚠️ 推理超时或队列已满，使用降级回复: {e!r}")
+                    mode = "degraded"
+            if not sections:
+                chunk = generate_fallback_response(user_message, sensor_data_for_ai)
+                sections.append(chunk)
+                yield encode_sse("delta", {"text": chunk})
+            CHAT_RESPONSES.inc(labels=(("mode", mode),))
+            ai_advice = "".join(sections)
+            await run_in_threadpool(profiled(append_chat_history), {
+                "timestamp": datetime.now().isoformat(),
+                "user_id": user_id,
+                "user_message": user_message,
+                "ai_response": ai_advice,
+                "location": location
+            })
+            yield encode_sse("done", {"status": "success", "response": ai_advice, "degraded": mode == "degraded"})
+        except Exception as e:
+            print(f"❌ 流式聊天处理错误: {e!r}")
+            yield encode_sse("error", {"status": "error", "error": str(e) or type(e).__name__})
     
-    if any(word in message_lower for word in ['施肥', '肥料']):
-        return "🌿 建议使用NPK复合肥，春季追氮肥，夏季增施磷钾肥"
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+fallback_intents = IntentClassifier([
+    ('greeting', ['你好', '您好', 'hello']),
+    ('water', ['浇水', '灌溉']),
+    ('fertilizer', ['施肥', '肥料'])
+])
+
+def generate_fallback_response(user_message, sensor_data):
+    responses = []
+    for intent in fallback_intents.intents(user_message):
+        if intent == 'greeting':
+            responses.append("🌱 您好！我是果农助手，可以为您提供柑橘种植建议。")
+        elif intent == 'water':
+            moisture = sensor_data.get('soil_moisture', 50)
+            responses.append(f"💧 当前土壤湿度{moisture}%，建议{'立即浇水' if moisture < 30 else '保持当前灌溉'}")
+        elif intent == 'fertilizer':
+            responses.append("🌿 建议使用NPK复合肥，春季追氮肥，夏季增施磷钾肥")
     
+    if responses:
+        return "\n\n".join(responses)
     return "🤔 我可以帮您分析土壤湿度、施肥、病虫害等问题，请具体说明您想了解的内容。"
 
 @app.get("/api/v1/chat-history")
-async def get_chat_history(limit: int = 10):
+async def get_chat_history(limit: int = 10, user_id: str = None, cursor: int = None):
+    entries, next_cursor = await run_in_threadpool(profiled(page_chat_history), user_id, min(limit, 200), cursor)
     return {
         "status": "success",
-        "history": chat_history[-limit:] if chat_history else []
+        "history": entries,
+        "next_cursor": next_cursor
     }
 
+def read_sensor_data(location):
+    if location:
+        sensor_data = {"location": location, "readings": sensor_store.latest_readings(location)}
+    else:
+        sensor_data = sensor_store.latest_payload
+    return sensor_data, sensor_store.get_stats()
+
 @app.get("/api/v1/sensor-data")
-async def get_sensor_data():
+async def get_sensor_data(location: str = None):
+    sensor_data, stats = await run_store(read_sensor_data, location)
     return {
         "status": "success",
-        "sensor_data": latest_sensor_data,
+        "sensor_data": sensor_data,
+        "store": stats,
         "timestamp": datetime.now().isoformat()
     }
 
+@app.get("/api/v1/sensor-data/latest")
+async def get_sensor_latest(location: str = None, sensor_id: str = None):
+    return {
+        "status": "success",
+        "sensors": await run_store(sensor_store.latest, location, sensor_id),
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/api/v1/sensor-data/window")
+async def get_sensor_window(location: str = None, sensor_id: str = None, seconds: int = 3600, metrics: str = None):
+    return {
+        "status": "success",
+        "series": await run_store(
+            sensor_store.window, location, sensor_id, seconds, metrics.split(',') if metrics else None
+        ),
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/api/v1/sensor-data/range")
+async def get_sensor_range(start: str, end: str = None, location: str = None, sensor_id: str = None,
+                           bucket_seconds: int = 300, metrics: str = None):
+    if bucket_seconds <= 0:
+        return {"status": "error", "message": "bucket_seconds 必须大于0"}
+    return {
+        "status": "success",
+        "series": await run_store(
+            sensor_store.range, location, sensor_id,
+            parse_timestamp(start), parse_timestamp(end),
+            bucket_seconds, metrics.split(',') if metrics else None
+        ),
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/api/v1/features")
+async def get_location_features(location: str = "field_3"):
+    if not AI_SYSTEM_LOADED:
+        return {"status": "error", "message": "AI系统未加载"}
+    feature_engine = agri_ai_system.feature_engine
+    return {
+        "status": "success",
+        "location": location,
+        "features": await run_store(feature_engine.get_location_features, location),
+        "engine": await run_store(feature_engine.get_stats)
+    }
+
+@app.get("/api/v1/quarantine")
+async def get_quarantine(location: str = None, sensor_id: str = None, limit: int = 50):
+    source = shared_state.quarantine if shared_state is not None else anomaly_detector
+    return {
+        "status": "success",
+        "entries": await run_store(source.quarantined, location, sensor_id, min(max(limit, 1), 1000)),
+        "detector": await run_store(source.get_stats)
+    }
+
+@app.get("/api/v1/knowledge/search")
+async def search_knowledge(q: str, top_k: int = 3, category: str = None):
+    if not AI_SYSTEM_LOADED:
+        return {"status": "error", "message": "AI系统未加载"}
+    return {
+        "status": "success",
+        "results": agri_ai_system.model_b.knowledge_base.search(q, top_k=top_k, category=category),
+        "knowledge_base": agri_ai_system.model_b.knowledge_base.get_stats()
+    }
+
+def format_analysis(result):
+    return {
+        "status": result['model_a_output'],
+        "crop": result.get('crop'),
+        "advice": result['final_advice'],
+        "computed_at": result.get('computed_at')
+    }
+
 @app.get("/api/v1/analyze")
-async def analyze_farm():
+async def analyze_farm(location: str = None):
     if not AI_SYSTEM_LOADED:
         return {"status": "error", "message": "AI系统未加载"}
     
-    try:
-        advice = agri_ai_system.inference_pipeline()
+    # 只读取调度器预先计算的结果，不在请求中执行推理
+    source = shared_state.analysis_results if shared_state is not None else analysis_scheduler
+    if location:
+        result = await run_store(source.get, location)
+        results = {location: result} if result else {}
+    elif shared_state is not None:
+        results = await run_store(source.snapshot)
+        result = max(results.values(), key=lambda r: r.get('computed_at') or '') if results else None
+    else:
+        results = source.snapshot()
+        result = agri_ai_system.last_prediction if results else None
+    if not result:
+        if location and analysis_scheduler.running:
+            analysis_scheduler.trigger(location)
         return {
-            "status": "success",
-            "analysis": advice,
-            "system_status": agri_ai_system.get_system_status(),
+            "status": "pending",
+            "message": "分析结果尚未生成，已加入调度队列",
+            "analysis": None,
             "timestamp": datetime.now().isoformat()
         }
-    except Exception as e:
-        return {"status": "error", "message": f"分析失败: {str(e)}"}
+    return {
+        "status": "success",
+        "analysis": result['final_advice'],
+        "computed_at": result.get('computed_at'),
+        "locations": {loc: format_analysis(r) for loc, r in results.items()},
+        "system_status": await run_store(agri_ai_system.get_system_status),
+        "timestamp": datetime.now().isoformat()
+    }
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Kissan-Dost后端服务")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="worker进程数，大于1时启用共享状态后端")
+    parser.add_argument("--state-db", default="kissan_state.db", help="多worker模式下的共享SQLite文件")
+    args = parser.parse_args()
+    
     print("🚀 启动Kissan-Dost后端服务...")
     print(f"📂 工作目录: {os.getcwd()}")
-    uvicorn.run(app, host="0.0.0.0", port=8000, reload=False)
\ No newline at end of file
+    if args.workers > 1:
+        os.environ["KISSAN_SHARED_STATE"] = os.path.abspath(args.state_db)
+        from S006 import SharedState
+        SharedState(os.environ["KISSAN_SHARED_STATE"])
+        print(f"👥 多worker模式: {args.workers}个进程, 共享状态: {os.environ['KISSAN_SHARED_STATE']}")
+        print("   尖峰/卡死/漂移检测、滚动特征与地块分析只在持有租约的一个进程中运行，写入后异步生效")
+        uvicorn.run(
+            "main:app", host=args.host, port=args.port, workers=args.workers,
+            app_dir=os.path.dirname(os.path.abspath(__file__))
+        )
+    else:
+        uvicorn.run(app, host=args.host, port=args.port, reload=False)
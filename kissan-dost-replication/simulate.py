@@ -1,13 +1,19 @@
-import requests
 import time
 from datetime import datetime
+import asyncio
+import json
 import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
 from S001 import IoTDataCollector
 
 class AgricultureSensorSimulator:
     def __init__(self, backend_url="http://localhost:8000"):
         self.backend_url = backend_url
         self.collector = IoTDataCollector()
+        self.collector.backend_url = backend_url
         self.setup_sensors()
         
     def setup_sensors(self):
@@ -55,12 +61,9 @@ class AgricultureSensorSimulator:
     
     def send_to_backend(self, data):
         try:
-            response = requests.post(
-                f"{self.backend_url}/api/v1/ingest",
-                json=data,
-                headers={"Content-Type": "application/json"},
-                timeout=5
-            )
+            response = self.collector.client.send(f"{self.backend_url}/api/v1/ingest", data)
+            if response is None:
+                return False, "后端不可用，数据已暂存到本地"
             if response.status_code == 200:
                 return True, "数据发送成功"
             else:
@@ -68,9 +71,21 @@ class AgricultureSensorSimulator:
         except Exception as e:
             return False, f"发送数据时出错: {e}"
     
+    def send_batched(self, data):
+        if self.collector.buffer_reading(data):
+            return True, f"已缓冲 {len(self.collector.data_buffer)} 条数据"
+        return False, "批量发送失败，数据已暂存到本地或被丢弃，详见日志"
+    
+    def flush(self):
+        if self.collector.flush_buffer():
+            return True, "缓冲数据已全部发送"
+        return False, "缓冲数据发送失败，详见日志"
+    
     def test_backend_connection(self):
         try:
-            response = requests.get(f"{self.backend_url}/health", timeout=5)
+            response = self.collector.client.get(f"{self.backend_url}/health", max_retries=0, timeout=5)
+            if response is None:
+                return False, "无法连接到后端"
             if response.status_code == 200:
                 return True, "后端服务正常"
             else:
@@ -78,7 +93,7 @@ class AgricultureSensorSimulator:
         except Exception as e:
             return False, f"无法连接到后端: {e}"
     
-    def start_simulation(self, interval=30):
+    def start_simulation(self, interval=30, batch_size=1):
         print("🚀 启动Kissan-Dost传感器数据模拟器...")
         print("=" * 50)
         
@@ -91,6 +106,9 @@ class AgricultureSensorSimulator:
         
         print(f"📡 数据发送到: {self.backend_url}/api/v1/ingest")
         print(f"⏱️  发送间隔: {interval}秒")
+        if batch_size > 1:
+            self.collector.batch_size = batch_size
+            print(f"📦 批量发送: 每{batch_size}条或{self.collector.batch_max_age}秒发送一次")
         print("=" * 50)
         print("按 Ctrl+C 停止模拟")
         
@@ -99,7 +117,10 @@ class AgricultureSensorSimulator:
             while True:
                 data = self.generate_realistic_sensor_data()
                 message_count += 1
-                success, message = self.send_to_backend(data)
+                if batch_size > 1:
+                    success, message = self.send_batched(data)
+                else:
+                    success, message = self.send_to_backend(data)
                 
                 if success:
                     print(f"✅ [{message_count}] 数据发送成功: {data['timestamp']}")
@@ -109,9 +130,139 @@ class AgricultureSensorSimulator:
                 time.sleep(interval)
                 
         except KeyboardInterrupt:
+            if batch_size > 1:
+                self.flush()
             print("\n🛑 模拟器已停止")
             print(f"📊 总共发送了 {message_count} 条数据")
 
+class LoadGenerator:
+    # 开环压测：asyncio 按目标速率定时发出请求，线程池（每线程一个长连接会话）执行阻塞 HTTP 调用；
+    # 延迟从计划发送时刻算起，后端变慢导致的排队时间也计入
+    def __init__(self, backend_url="http://localhost:8000", sensors=100, locations=10, rate=100.0,
+                 duration=30.0, concurrency=32, batch_size=1):
+        self.backend_url = backend_url
+        self.rate = rate
+        self.duration = duration
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.simulator = AgricultureSensorSimulator(backend_url)
+        self.sensors = [(f"vsensor_{i:05d}", f"field_{i % locations + 1}") for i in range(sensors)]
+        self.local = threading.local()
+        self.latencies = []
+        self.status_counts = {}
+        self.errors = 0
+        self.readings_sent = 0
+
+    def session(self):
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = self.local.session = requests.Session()
+        return session
+
+    def make_body(self, count):
+        readings = []
+        for _ in range(count):
+            sensor_id, location = random.choice(self.sensors)
+            payload = self.simulator.generate_realistic_sensor_data()
+            payload["sensor_id"] = sensor_id
+            payload["location"] = location
+            readings.append(payload)
+        return json.dumps(readings if self.batch_size > 1 else readings[0]).encode("utf-8")
+
+    def send(self, url, body, scheduled_at, count):
+        try:
+            response = self.session().post(url, data=body, headers={"Content-Type": "application/json"}, timeout=30)
+            status = response.status_code
+        except requests.RequestException:
+            status = None
+        latency = time.perf_counter() - scheduled_at
+        return status, latency, count
+
+    def record(self, result):
+        status, latency, count = result
+        self.latencies.append(latency)
+        if status is None:
+            self.errors += 1
+        else:
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+            if status == 200:
+                self.readings_sent += count
+
+    async def run_async(self):
+        path = "/api/v1/ingest/batch" if self.batch_size > 1 else "/api/v1/ingest"
+        url = f"{self.backend_url}{path}"
+        request_rate = self.rate / self.batch_size
+        total = max(int(request_rate * self.duration), 1)
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="loadgen")
+        pending = set()
+        started = time.perf_counter()
+        for i in range(total):
+            scheduled_at = started + i / request_rate
+            delay = scheduled_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            body = self.make_body(self.batch_size)
+            future = loop.run_in_executor(executor, self.send, url, body, scheduled_at, self.batch_size)
+            future.add_done_callback(lambda f: self.record(f.result()))
+            pending.add(future)
+            future.add_done_callback(pending.discard)
+        if pending:
+            await asyncio.wait(pending)
+        elapsed = time.perf_counter() - started
+        executor.shutdown(wait=True)
+        return self.report(elapsed)
+
+    def run(self):
+        return asyncio.run(self.run_async())
+
+    def report(self, elapsed):
+        latencies_ms = np.array(self.latencies) * 1000
+        p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99]) if len(latencies_ms) else (0.0, 0.0, 0.0)
+        result = {
+            "requests": len(self.latencies),
+            "readings_sent": self.readings_sent,
+            "errors": self.errors,
+            "status_counts": self.status_counts,
+            "elapsed_seconds": round(elapsed, 3),
+            "target_readings_per_second": self.rate,
+            "achieved_requests_per_second": round(len(self.latencies) / elapsed, 2),
+            "achieved_readings_per_second": round(self.readings_sent / elapsed, 2),
+            "latency_ms": {
+                "p50": round(float(p50), 2),
+                "p95": round(float(p95), 2),
+                "p99": round(float(p99), 2),
+                "max": round(float(latencies_ms.max()), 2) if len(latencies_ms) else 0.0
+            }
+        }
+        print("=" * 50)
+        print(f"📈 压测结果: {result['requests']}个请求, {result['readings_sent']}条读数, 耗时{result['elapsed_seconds']}秒")
+        print(f"🚀 吞吐: {result['achieved_requests_per_second']} 请求/秒, "
+              f"{result['achieved_readings_per_second']} 读数/秒 (目标 {self.rate} 读数/秒)")
+        print(f"⏱️  延迟: p50={result['latency_ms']['p50']}ms p95={result['latency_ms']['p95']}ms "
+              f"p99={result['latency_ms']['p99']}ms max={result['latency_ms']['max']}ms")
+        print(f"📊 状态码: {self.status_counts}, 连接错误: {self.errors}")
+        print("=" * 50)
+        return result
+
 if __name__ == "__main__":
-    simulator = AgricultureSensorSimulator()
-    simulator.start_simulation(interval=30)
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description="Kissan-Dost传感器数据模拟器")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--interval", type=float, default=30, help="普通模拟模式的发送间隔(秒)")
+    parser.add_argument("--load", action="store_true", help="启用压测模式")
+    parser.add_argument("--sensors", type=int, default=100, help="虚拟传感器数量")
+    parser.add_argument("--locations", type=int, default=10, help="地块数量")
+    parser.add_argument("--rate", type=float, default=100.0, help="目标读数速率(条/秒)")
+    parser.add_argument("--duration", type=float, default=30.0, help="压测时长(秒)")
+    parser.add_argument("--concurrency", type=int, default=32, help="并发连接数")
+    parser.add_argument("--batch-size", type=int, default=1, help="大于1时使用批量接口，每个请求包含的读数条数")
+    args = parser.parse_args()
+    
+    if args.load:
+        generator = LoadGenerator(args.url, args.sensors, args.locations, args.rate,
+                                  args.duration, args.concurrency, args.batch_size)
+        generator.run()
+    else:
+        simulator = AgricultureSensorSimulator(args.url)
+        simulator.start_simulation(interval=args.interval)
\ No newline at end of file
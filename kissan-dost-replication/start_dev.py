@@ -5,9 +5,28 @@ Kissan-Dost 系统启动脚本
 import subprocess
 import sys
 import os
+import json
 import time
 import threading
 import webbrowser
+import urllib.request
+
+BACKEND_HEALTH_URL = "http://localhost:8000/health"
+
+def wait_for_backend(timeout=60.0, interval=0.2):
+    # 轮询 /health，端口可用且 AI 系统就绪后返回，替代固定等待
+    started = time.time()
+    while time.time() - started < timeout:
+        try:
+            with urllib.request.urlopen(BACKEND_HEALTH_URL, timeout=1) as response:
+                if json.loads(response.read()).get("ready"):
+                    print(f"✅ 后端已就绪 ({time.time() - started:.1f}s)")
+                    return True
+        except (OSError, ValueError):
+            pass
+        time.sleep(interval)
+    print(f"⚠️ 等待后端就绪超时 ({timeout:.0f}s)")
+    return False
 
 def start_backend():
     print("🔧 启动后端服务...")
@@ -30,7 +49,6 @@ def start_backend():
 
 def start_frontend():
     print("🌐 启动前端服务...")
-    time.sleep(3)
     
     try:
         process = subprocess.Popen(
@@ -47,7 +65,7 @@ def start_frontend():
 
 def start_simulator():
     print("📡 启动传感器模拟器...")
-    time.sleep(5)
+    wait_for_backend()
     
     try:
         if os.path.exists('simulate.py'):
@@ -105,7 +123,7 @@ def main():
         print("  API文档:  http://localhost:8000/docs")
         print("=" * 60)
         print("💡 使用说明:")
-        print("  1. 等待几秒钟让服务完全启动")
+        print("  1. 后端就绪后模拟器开始上报数据")
         print("  2. 浏览器会自动打开前端界面")
         print("=" * 60)
         print("🛑 按 Ctrl+C 停止所有服务")
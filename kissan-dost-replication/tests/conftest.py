@@ -0,0 +1,14 @@
+import os
+import sys
+
+import pytest
+
+# 模块为扁平结构，测试时把项目目录加入导入路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(autouse=True, scope="session")
+def isolated_log(tmp_path_factory):
+    # 测试日志写到临时目录，避免改动仓库里的 kissan_dost.log
+    import S000
+    S000.logName = str(tmp_path_factory.mktemp("logs") / "kissan_dost.log")
+    yield S000.logName
@@ -0,0 +1,56 @@
+import logging
+import os
+import queue
+
+from S000 import BatchRotatingFileHandler, DeferredQueueHandler, IntentClassifier, SizeTrackingRotatingFileHandler
+
+def make_record(message):
+    return logging.LogRecord('test', logging.INFO, __file__, 1, message, None, None)
+
+def test_rotation_uses_tracked_byte_count(tmp_path):
+    path = str(tmp_path / 'app.log')
+    handler = SizeTrackingRotatingFileHandler(path, maxBytes=100, backupCount=2, encoding='utf-8')
+    try:
+        for _ in range(3):
+            handler.emit(make_record('温度' * 10))
+        assert os.path.exists(path + '.1')
+        assert handler.bytes_written == os.path.getsize(path)
+        assert os.path.getsize(path) <= 100
+    finally:
+        handler.close()
+
+def test_tracked_count_starts_from_existing_file(tmp_path):
+    path = str(tmp_path / 'app.log')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('x' * 90)
+    handler = BatchRotatingFileHandler(path, maxBytes=100, backupCount=1, encoding='utf-8')
+    try:
+        assert handler.bytes_written == 90
+        handler.emit(make_record('y' * 20))
+        handler.flush_batch()
+        assert os.path.getsize(path + '.1') == 90
+    finally:
+        handler.close()
+
+def test_full_queue_drops_and_counts():
+    log_queue = queue.Queue(maxsize=2)
+    handler = DeferredQueueHandler(log_queue)
+    for i in range(5):
+        handler.emit(make_record(f'message {i}'))
+    assert log_queue.qsize() == 2
+    assert handler.dropped == 3
+
+def test_intent_classifier_finds_every_intent_with_position():
+    classifier = IntentClassifier([('water', ['浇水', '湿度']), ('fertilizer', ['施肥', 'npk'])])
+    assert classifier.classify('该浇水还是施肥？NPK够吗') == [
+        ('water', '浇水', 1), ('fertilizer', '施肥', 5), ('fertilizer', 'npk', 8)
+    ]
+    assert classifier.intents('施肥后湿度和施肥量') == ['fertilizer', 'water']
+    assert IntentClassifier().classify('浇水') == []
+
+def test_intent_classifier_prefers_longest_keyword(tmp_path):
+    classifier = IntentClassifier([('pest', ['虫害'])])
+    config = tmp_path / 'intents.json'
+    config.write_text('{"pest_control": ["病虫害防治"]}', encoding='utf-8')
+    assert classifier.load_config(str(config))
+    assert classifier.classify('病虫害防治和虫害') == [('pest_control', '病虫害防治', 0), ('pest', '虫害', 6)]
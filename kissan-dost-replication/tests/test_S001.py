@@ -0,0 +1,87 @@
+import numpy as np
+
+from S000 import READING_METRICS, SensorReadingBatch
+from S001 import LanguageTranslationModel, SensorDataModel
+from S003 import SensorTimeSeriesStore
+
+def test_feature_matrix_reads_canonical_columns():
+    model = SensorDataModel()
+    records = [{'soil_moisture': 30.0, 'npk_nitrogen': 40.0, 'soil_moisture_6h_slope': -2.0}, {}]
+    matrix = model.to_feature_matrix(records)
+    assert matrix.shape == (2, len(READING_METRICS))
+    assert matrix[0, model.feature_columns.index('soil_moisture')] == 30.0
+    assert matrix[0, model.feature_columns.index('npk_nitrogen')] == 40.0
+    assert np.isnan(matrix[1]).all()
+    assert model.to_feature_matrix(records, model.trend_columns)[0, 0] == -2.0
+
+def test_feature_matrix_from_batch_is_a_view():
+    model = SensorDataModel()
+    batch = SensorReadingBatch.from_payloads([
+        {'sensor_id': 's1', 'location': 'field_1', 'readings': {'soil_moisture': 25.0, 'npk': {'potassium': 12}}}
+    ])
+    matrix = model.to_feature_matrix(batch)
+    assert np.shares_memory(matrix, batch.data)
+    assert matrix[0, model.feature_columns.index('npk_potassium')] == 12.0
+    batch.derived['soil_moisture_6h_slope'] = [-1.5]
+    assert model.to_feature_matrix(batch, model.trend_columns).tolist() == [[-1.5]]
+
+def test_readings_normalized_at_ingest_and_not_mutated_by_predict():
+    store = SensorTimeSeriesStore(capacity=4)
+    payload = {'sensor_id': 's1', 'location': 'field_1',
+               'readings': {'moisture': 20.0, 'ph': 6.5, 'npk': {'nitrogen': 30}}}
+    store.ingest(payload)
+    assert payload['readings'] == {'moisture': 20.0, 'ph': 6.5, 'npk': {'nitrogen': 30}}
+    readings = store.latest_readings('field_1')
+    assert readings == {'soil_moisture': 20.0, 'soil_ph': 6.5, 'npk_nitrogen': 30.0}
+    model = SensorDataModel()
+    assert model.predict(readings) == 'needs_water'
+    assert readings == store.latest_readings('field_1')
+
+def test_missing_features_imputed_with_training_medians(tmp_path):
+    rng = np.random.default_rng(0)
+    records = [
+        {
+            'readings': {'temperature': float(t), 'soil_moisture': float(m), 'ph': 7.8,
+                         'npk': {'nitrogen': 80.0, 'phosphorus': 60.0, 'potassium': 55.0}},
+            'crop_health_index': 0.6
+        }
+        for t, m in zip(rng.uniform(15, 35, 50), rng.uniform(20, 60, 50))
+    ]
+    model = SensorDataModel()
+    model.train(records, n_estimators=5, n_jobs=1)
+    medians = dict(zip(model.feature_columns, model.feature_medians))
+    assert medians['soil_ph'] == 7.8
+    assert medians['npk_nitrogen'] == 80.0
+    # 训练中整列缺失的湿度回退到默认值
+    assert medians['humidity'] == 60.0
+    imputed = model.impute(model.to_feature_matrix([{'soil_moisture': 30.0}]))[0]
+    assert imputed[model.feature_columns.index('soil_ph')] == 7.8
+    assert imputed[model.feature_columns.index('soil_moisture')] == 30.0
+    path = str(tmp_path / 'sensor_model.joblib')
+    model.saveModel(path)
+    loaded = SensorDataModel()
+    loaded.loadModel(path)
+    assert loaded.feature_medians == model.feature_medians
+
+def test_response_cache_ignores_unrelated_readings():
+    model = LanguageTranslationModel()
+    state = {'soil_moisture': 30.0, 'temperature': 25.0, 'soil_ph': 6.5}
+    first = model.generate_contextual_response('需要浇水吗', 'healthy', state)
+    second = model.generate_contextual_response('需要浇水吗', 'healthy', dict(state, soil_ph=7.0))
+    stats = model.response_cache.get_stats()
+    assert first == second
+    assert (stats['hits'], stats['misses']) == (1, 1)
+    model.generate_contextual_response('需要浇水吗', 'healthy', dict(state, soil_moisture=12.0))
+    assert model.response_cache.get_stats()['misses'] == 2
+
+def test_sensor_state_change_invalidates_cached_responses():
+    model = LanguageTranslationModel()
+    state = {'soil_moisture': 30.0, 'temperature': 25.0}
+    assert model.observe_sensor_state('field_1', state)
+    model.generate_contextual_response('温度怎么样', 'healthy', state)
+    assert not model.observe_sensor_state('field_1', dict(state))
+    assert model.response_cache.get_stats()['size'] == 1
+    assert model.observe_sensor_state('field_1', dict(state, temperature=31.0))
+    stats = model.response_cache.get_stats()
+    assert stats['size'] == 0
+    assert stats['invalidations'] == 1
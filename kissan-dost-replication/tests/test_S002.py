@@ -0,0 +1,41 @@
+import time
+
+from S002 import JudgeEvaluator, ResultEvaluator
+
+class FixedJudge(JudgeEvaluator):
+    def __init__(self, score, delay=0.0):
+        self.score = score
+        self.delay = delay
+    
+    def evaluate_agriculture_output(self, predictions, ground_truth):
+        time.sleep(self.delay)
+        return self.score
+
+def make_evaluator(judges, **kwargs):
+    evaluator = ResultEvaluator(**kwargs)
+    evaluator.llm_apis = judges
+    evaluator.weights = {name: 1.0 for name in judges}
+    return evaluator
+
+def test_slow_judge_times_out_once_without_polling():
+    evaluator = make_evaluator(
+        {'fast': FixedJudge(0.8), 'slow': FixedJudge(0.2, delay=1.0)},
+        timeouts={'slow': 0.2}, chunk_size=2
+    )
+    start = time.monotonic()
+    results = evaluator.evaluate_batch([{'n': i} for i in range(6)])
+    elapsed = time.monotonic() - start
+    evaluator.shutdown()
+    assert results == [0.8] * 6
+    assert evaluator.get_stats()['timeouts'] == 1
+    assert elapsed < 0.6
+
+def test_queue_wait_not_counted_against_timeout():
+    evaluator = make_evaluator(
+        {'a': FixedJudge(0.5, delay=0.1), 'b': FixedJudge(0.7, delay=0.1)},
+        timeout=0.3, max_concurrency=1, chunk_size=1
+    )
+    results = evaluator.evaluate_batch([{'n': 0}, {'n': 1}])
+    evaluator.shutdown()
+    assert results == [0.6, 0.6]
+    assert evaluator.get_stats()['timeouts'] == 0
@@ -0,0 +1,67 @@
+import numpy as np
+
+from S003 import SensorSeries, SensorTimeSeriesStore, query_series
+
+def reading(sensor_id, location, timestamp, **readings):
+    return {'sensor_id': sensor_id, 'location': location, 'timestamp': timestamp, 'readings': readings}
+
+def test_ring_buffer_keeps_last_capacity_readings():
+    series = SensorSeries('s1', 'field_1', capacity=4)
+    for i in range(6):
+        series.append(float(i), {'soil_moisture': 40.0 + i})
+    ts, columns = series.window()
+    assert ts.tolist() == [2.0, 3.0, 4.0, 5.0]
+    assert columns['soil_moisture'].tolist() == [42.0, 43.0, 44.0, 45.0]
+    assert series.size == 4
+
+def test_series_only_creates_canonical_metric_columns():
+    series = SensorSeries('s1', 'field_1', capacity=8)
+    series.append(0.0, {'soil_moisture': 40.0, 'battery': 3.7, 'rssi': -70.0})
+    assert set(series.metrics) == {'soil_moisture'}
+    assert series.latest == {'soil_moisture': 40.0}
+
+def test_store_ignores_unknown_keys_and_normalizes_once():
+    store = SensorTimeSeriesStore(capacity=8)
+    store.ingest(reading('s1', 'field_1', 0.0, soil_moisture=40.0, battery=3.7, npk={'nitrogen': 30}))
+    assert store.latest_readings('field_1') == {'soil_moisture': 40.0, 'npk_nitrogen': 30.0}
+    series = store.find_series('field_1', 's1')[0]
+    assert set(series.metrics) == {'soil_moisture', 'npk_nitrogen'}
+
+def test_location_latest_is_bounded_lru():
+    store = SensorTimeSeriesStore(capacity=4, max_series=8, max_locations=2)
+    store.ingest(reading('s1', 'field_1', 0.0, soil_moisture=40.0))
+    store.ingest(reading('s2', 'field_2', 1.0, soil_moisture=41.0))
+    store.ingest(reading('s1', 'field_1', 2.0, soil_moisture=42.0))
+    store.ingest(reading('s3', 'field_3', 3.0, soil_moisture=43.0))
+    assert list(store.location_snapshot()) == ['field_1', 'field_3']
+    assert store.latest_readings('field_2') == {}
+
+def test_series_count_is_bounded():
+    store = SensorTimeSeriesStore(capacity=4, max_series=3)
+    for i in range(5):
+        store.ingest(reading(f's{i}', 'field_1', float(i), soil_moisture=40.0))
+    assert store.get_stats()['series'] == 3
+    assert [s.sensor_id for s in store.find_series()] == ['s2', 's3', 's4']
+
+def test_downsample_averages_buckets_and_skips_missing():
+    series = SensorSeries('s1', 'field_1', capacity=16)
+    for i in range(6):
+        values = {'temperature': 20.0 + i}
+        if i != 1:
+            values['soil_moisture'] = 40.0 + i
+        series.append(i * 60.0, values)
+    result = query_series(series, 0.0, 360.0, bucket_seconds=120)
+    assert result['metrics']['temperature'] == [20.5, 22.5, 24.5]
+    assert result['metrics']['soil_moisture'] == [40.0, 42.5, 44.5]
+
+def test_location_batch_feeds_feature_matrix():
+    store = SensorTimeSeriesStore(capacity=4)
+    store.ingest(reading('s1', 'field_1', 0.0, soil_moisture=40.0))
+    store.ingest(reading('s2', 'field_1', 1.0, temperature=25.0))
+    batch = store.location_batch(['field_1', 'field_9'])
+    assert batch.location_names() == ['field_1']
+    matrix = batch.feature_matrix()
+    assert np.shares_memory(matrix, batch.data)
+    assert batch.column('soil_moisture').tolist() == [40.0]
+    assert batch.column('temperature').tolist() == [25.0]
+    assert np.isnan(batch.column('soil_ph')[0])
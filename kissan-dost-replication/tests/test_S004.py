@@ -0,0 +1,49 @@
+import json
+import os
+import time
+
+from S004 import KnowledgeBase
+
+def write_kb(path, entries, mtime):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'citrus': entries}, f, ensure_ascii=False)
+    os.utime(path, (mtime, mtime))
+
+ENTRY = {'id': 'water', 'title': '柑橘灌溉', 'content': '开花期保持土壤湿度', 'keywords': ['浇水'], 'category': 'water'}
+
+def test_search_does_not_reload(tmp_path):
+    path = str(tmp_path / 'kb.json')
+    write_kb(path, [ENTRY], 1000)
+    kb = KnowledgeBase(path, check_interval=0)
+    assert [r['id'] for r in kb.search('要浇水吗')] == ['water']
+    write_kb(path, [dict(ENTRY, id='pest', keywords=['虫害'])], 2000)
+    # 检索路径不检查文件，只有后台检查（这里手动调用）才替换索引
+    assert [r['id'] for r in kb.search('要浇水吗')] == ['water']
+    old_index = kb.index
+    assert kb.reload_if_changed()
+    assert kb.index is not old_index
+    assert kb.search('要浇水吗') == []
+    assert [r['id'] for r in kb.search('有虫害')] == ['pest']
+
+def test_unchanged_entries_reuse_terms(tmp_path):
+    path = str(tmp_path / 'kb.json')
+    write_kb(path, [ENTRY], 1000)
+    kb = KnowledgeBase(path, check_interval=0)
+    terms = kb.index.doc_terms['water']
+    write_kb(path, [ENTRY, dict(ENTRY, id='pest', keywords=['虫害'])], 2000)
+    kb.reload_if_changed()
+    assert kb.index.doc_terms['water'] is terms
+    assert kb.get_stats()['documents'] == 2
+
+def test_background_watcher_swaps_index(tmp_path):
+    path = str(tmp_path / 'kb.json')
+    write_kb(path, [ENTRY], 1000)
+    kb = KnowledgeBase(path, check_interval=0.05)
+    try:
+        write_kb(path, [dict(ENTRY, id='pest', keywords=['虫害'])], 2000)
+        deadline = time.monotonic() + 5
+        while kb.get_stats()['reloads'] < 2 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert [r['id'] for r in kb.search('有虫害')] == ['pest']
+    finally:
+        kb.stop()
@@ -0,0 +1,82 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from S005 import AnalysisScheduler, ExecutorBusyError, InferenceExecutor
+
+def make_scheduler(**kwargs):
+    return AnalysisScheduler(lambda: {}, lambda locations: {}, interval=300.0, urgent_interval=60.0, **kwargs)
+
+def finish(scheduler, locations, now):
+    with scheduler.lock:
+        scheduler.in_flight.difference_update(locations)
+        for location in locations:
+            scheduler.last_run[location] = now
+
+def test_fresh_result_not_recomputed_before_interval():
+    scheduler = make_scheduler()
+    assert scheduler.due_locations({'field_1': 0}, 0.0) == ['field_1']
+    finish(scheduler, ['field_1'], 0.0)
+    assert scheduler.due_locations({'field_1': 0}, 100.0) == []
+
+def test_dirty_location_recomputed_after_dirty_interval():
+    scheduler = make_scheduler(dirty_interval=10.0)
+    scheduler.due_locations({'field_1': 0}, 0.0)
+    finish(scheduler, ['field_1'], 0.0)
+    scheduler.mark_dirty(['field_1'])
+    # 连续写入在 dirty_interval 内合并
+    assert scheduler.due_locations({'field_1': 0}, 5.0) == []
+    assert scheduler.due_locations({'field_1': 0}, 10.0) == ['field_1']
+    finish(scheduler, ['field_1'], 10.0)
+    assert scheduler.due_locations({'field_1': 0}, 30.0) == []
+
+def test_urgent_locations_scheduled_first():
+    scheduler = make_scheduler()
+    plan = {'field_1': 0, 'field_2': 3, 'field_3': 1}
+    assert scheduler.due_locations(plan, 0.0) == ['field_2', 'field_3', 'field_1']
+
+def test_in_flight_location_not_scheduled_twice():
+    scheduler = make_scheduler()
+    scheduler.due_locations({'field_1': 0}, 0.0)
+    scheduler.trigger('field_1')
+    assert scheduler.due_locations({'field_1': 0}, 1.0) == []
+
+def collect(executor, func, *args, **kwargs):
+    async def consume():
+        items = []
+        async for item in executor.stream(func, *args, **kwargs):
+            items.append(item)
+        return items
+    return asyncio.run(consume())
+
+def test_stream_runs_steps_on_executor_threads():
+    executor = InferenceExecutor(max_workers=2, timeout=5)
+    def generate(n):
+        for i in range(n):
+            yield (i, threading.current_thread().name)
+    items = collect(executor, generate, 3)
+    assert [i for i, _ in items] == [0, 1, 2]
+    assert all(name.startswith('inference') for _, name in items)
+    assert executor.get_stats()['queue_depth'] == 0
+    executor.shutdown()
+
+def test_stream_timeout_covers_whole_generation():
+    executor = InferenceExecutor(max_workers=1, timeout=0.3)
+    def slow():
+        for i in range(10):
+            time.sleep(0.1)
+            yield i
+    started = time.monotonic()
+    with pytest.raises(asyncio.TimeoutError):
+        collect(executor, slow)
+    assert time.monotonic() - started < 1.0
+    assert executor.get_stats()['timeouts'] >= 1
+    executor.shutdown()
+
+def test_stream_rejected_when_queue_full():
+    executor = InferenceExecutor(max_workers=1, max_queue=0)
+    with pytest.raises(ExecutorBusyError):
+        collect(executor, lambda: iter([1]))
+    executor.shutdown()
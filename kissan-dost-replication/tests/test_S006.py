@@ -0,0 +1,108 @@
+import pytest
+from sqlalchemy import delete
+
+from S006 import ChatHistoryStore, SharedState
+
+def reading(sensor_id, location, timestamp, **readings):
+    return {'sensor_id': sensor_id, 'location': location, 'timestamp': timestamp, 'readings': readings}
+
+@pytest.fixture
+def state(tmp_path):
+    return SharedState(str(tmp_path / 'state.db'))
+
+def test_two_handles_share_readings(state):
+    other = SharedState(state.db_path)
+    state.sensor_store.ingest_many([
+        reading('s1', 'field_1', 100.0, soil_moisture=40.0),
+        reading('s1', 'field_1', 200.0, temperature=25.0)
+    ])
+    assert other.sensor_store.latest_readings('field_1') == {'soil_moisture': 40.0, 'temperature': 25.0}
+    latest = other.sensor_store.latest('field_1', 's1')
+    assert latest[0]['readings'] == {'soil_moisture': 40.0, 'temperature': 25.0}
+    assert latest[0]['count'] == 2
+
+def test_stats_come_from_maintained_tables(state):
+    store = state.sensor_store
+    store.ingest_many([reading(f's{i % 3}', f'field_{i % 2}', float(i), soil_moisture=40.0) for i in range(10)])
+    stats = store.get_stats()
+    assert (stats['series'], stats['locations'], stats['total_readings']) == (6, 2, 10)
+    # 统计不再扫描读数表：清空读数表后计数不变
+    with state.engine.begin() as conn:
+        conn.execute(delete(state.sensor_readings))
+    assert store.get_stats()['total_readings'] == 10
+    assert len(store.latest()) == 6
+
+def test_existing_database_backfilled_once(state):
+    state.sensor_store.ingest_many([reading('s1', 'field_1', 1.0, soil_moisture=40.0),
+                                    reading('s1', 'field_1', 2.0, soil_moisture=41.0)])
+    with state.engine.begin() as conn:
+        conn.execute(delete(state.sensor_latest))
+        conn.execute(delete(state.store_counters))
+    reopened = SharedState(state.db_path)
+    assert reopened.sensor_store.get_stats()['total_readings'] == 2
+    assert reopened.sensor_store.latest()[0]['count'] == 2
+
+def test_window_and_location_batch(state):
+    store = state.sensor_store
+    store.ingest_many([reading('s1', 'field_1', 100.0 + i, soil_moisture=40.0 + i) for i in range(3)])
+    series = store.range('field_1', 's1', 0.0, 1000.0)
+    assert series[0]['metrics']['soil_moisture'] == [40.0, 41.0, 42.0]
+    batch = store.location_batch(['field_1'])
+    assert batch.column('soil_moisture').tolist() == [42.0]
+
+def spike_history(sensor_id='s1', location='field_1'):
+    # 预热后出现一次尖峰（温度保持正常）
+    payloads = [reading(sensor_id, location, 1000.0 + i * 60, soil_moisture=40.0 + (i % 3) * 0.2, temperature=25.0)
+                for i in range(20)]
+    payloads.append(reading(sensor_id, location, 1000.0 + 20 * 60, soil_moisture=95.0, temperature=25.0))
+    return payloads
+
+def test_processor_restores_last_clean_value_after_spike(state):
+    from S006 import SharedStreamProcessor
+    processor = SharedStreamProcessor(state)
+    processor.become_leader()
+    state.sensor_store.ingest_many(spike_history())
+    processor.process_batch()
+    faults = state.quarantine.quarantined('field_1')
+    assert [f['fault'] for f in faults] == ['spike']
+    # 故障值回退为最近一次正常值，指标不会从最新读数中消失
+    latest = state.sensor_store.latest('field_1', 's1')[0]['readings']
+    assert latest == {'soil_moisture': 40.2, 'temperature': 25.0}
+    assert state.sensor_store.latest_readings('field_1') == {'soil_moisture': 40.2, 'temperature': 25.0}
+    newest = state.sensor_store.range('field_1', 's1', 2200.0, 2200.0)[0]['metrics']
+    assert newest == {'temperature': [25.0]}
+
+def test_processor_keeps_newer_value_from_other_sensor(state):
+    from S006 import SharedStreamProcessor
+    processor = SharedStreamProcessor(state)
+    processor.become_leader()
+    state.sensor_store.ingest_many(spike_history())
+    state.sensor_store.ingest_many([reading('s2', 'field_1', 3000.0, soil_moisture=41.0)])
+    processor.process_batch()
+    assert state.sensor_store.latest_readings('field_1')['soil_moisture'] == 41.0
+
+def chat(user_id, n, timestamp=None):
+    return {'user_id': user_id, 'user_message': f'问题{n}', 'ai_response': f'回答{n}', 'timestamp': timestamp}
+
+def test_chat_history_pages_by_cursor(tmp_path):
+    store = ChatHistoryStore(db_path=str(tmp_path / 'chat.db'))
+    for n in range(5):
+        store.append(chat('u1', n))
+        store.append(chat('u2', n))
+    entries, cursor = store.page('u1', limit=2)
+    assert [e['user_message'] for e in entries] == ['问题3', '问题4']
+    entries, cursor = store.page('u1', limit=2, cursor=cursor)
+    assert [e['user_message'] for e in entries] == ['问题1', '问题2']
+    entries, cursor = store.page('u1', limit=2, cursor=cursor)
+    assert [e['user_message'] for e in entries] == ['问题0']
+    assert cursor is None
+    assert len(store.recent(limit=100)) == 10
+
+def test_chat_history_retention_is_per_user(tmp_path):
+    store = ChatHistoryStore(db_path=str(tmp_path / 'chat.db'), retention_per_user=3, retention_days=30, prune_every=2)
+    store.append(chat('u2', 'old', '2000-01-01T00:00:00'))
+    for n in range(6):
+        store.append(chat('u1', n))
+    store.append(chat('u2', 'new'))
+    assert [e['user_message'] for e in store.recent(limit=10, user_id='u1')] == ['问题3', '问题4', '问题5']
+    assert [e['user_message'] for e in store.recent(limit=10, user_id='u2')] == ['问题new']
@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+from S001 import LanguageTranslationModel
+from S007 import RollingFeatureEngine, RollingWindow, SensorAnomalyDetector
+
+HOUR = 3600.0
+
+def test_slope_none_for_two_close_readings():
+    window = RollingWindow(6 * HOUR)
+    window.update(0.0, 45.0)
+    window.update(30.0, 44.4)
+    features = window.features()
+    assert features['slope'] is None
+    assert features['count'] == 2
+    assert features['min'] == 44.4
+    assert features['max'] == 45.0
+
+def test_slope_none_until_min_points():
+    window = RollingWindow(HOUR, min_points=5)
+    for i in range(4):
+        window.update(i * 600.0, 50.0 - i)
+    assert window.features()['slope'] is None
+    window.update(4 * 600.0, 46.0)
+    assert window.features()['slope'] == pytest.approx(-6.0)
+
+def test_slope_none_until_min_span():
+    # 6h 窗口默认要求至少覆盖 1.5h
+    window = RollingWindow(6 * HOUR)
+    for i in range(30):
+        window.update(i * 60.0, 50.0 - i * 0.1)
+    assert window.features()['slope'] is None
+    for i in range(30, 100):
+        window.update(i * 60.0, 50.0 - i * 0.1)
+    assert window.features()['slope'] == pytest.approx(-6.0, abs=1e-3)
+
+def test_slope_matches_least_squares():
+    rng = np.random.default_rng(0)
+    times = np.sort(rng.uniform(0, 5 * HOUR, 200))
+    values = 40.0 - 1.5 * times / HOUR + rng.normal(0, 0.3, len(times))
+    window = RollingWindow(6 * HOUR)
+    for t, v in zip(times, values):
+        window.update(float(t), float(v))
+    expected = np.polyfit(times / HOUR, values, 1)[0]
+    assert window.features()['slope'] == pytest.approx(expected, abs=1e-3)
+
+def test_slope_dropped_after_window_evicts_history():
+    window = RollingWindow(HOUR)
+    for i in range(12):
+        window.update(i * 300.0, 50.0 - i * 0.5)
+    assert window.features()['slope'] is not None
+    # 长时间无数据后只剩新读数，跨度不足时不再给出斜率
+    window.update(10 * HOUR, 30.0)
+    features = window.features()
+    assert features['count'] == 1
+    assert features['slope'] is None
+
+def test_engine_short_burst_has_no_trend_advice():
+    engine = RollingFeatureEngine()
+    engine.update('s1', 'field_1', 0.0, {'soil_moisture': 45.0})
+    engine.update('s1', 'field_1', 30.0, {'soil_moisture': 44.4})
+    trend = engine.get_location_features('field_1', ['soil_moisture_6h_slope'])
+    assert trend.get('soil_moisture_6h_slope') is None
+    advice = LanguageTranslationModel().generate_water_advice('healthy', dict({'soil_moisture': 44.4}, **trend))
+    assert '📉' not in advice
+
+def test_engine_sustained_drying_reports_trend():
+    engine = RollingFeatureEngine()
+    for i in range(25):
+        engine.update('s1', 'field_1', i * 600.0, {'soil_moisture': 45.0 - i * 0.5})
+    trend = engine.get_location_features('field_1', ['soil_moisture_6h_slope'])
+    assert trend['soil_moisture_6h_slope'] == pytest.approx(-3.0, abs=1e-3)
+    advice = LanguageTranslationModel().generate_water_advice('healthy', dict({'soil_moisture': 33.0}, **trend))
+    assert '📉' in advice
+
+def test_engine_evicts_least_recent_sensor():
+    engine = RollingFeatureEngine(max_series=3)
+    for i in range(10):
+        engine.update(f's{i}', f'field_{i}', i * 60.0, {'soil_moisture': 40.0 + i})
+    assert engine.get_stats()['tracked_series'] == 3
+    assert engine.get_stats()['locations'] == 3
+    assert engine.get_location_features('field_0') == {}
+    assert engine.get_location_features('field_9')['soil_moisture_1h_max'] == 49.0
+
+def test_engine_eviction_keeps_location_fed_by_other_sensor():
+    engine = RollingFeatureEngine(max_series=2)
+    engine.update('a', 'field_1', 0.0, {'soil_moisture': 40.0})
+    engine.update('b', 'field_1', 60.0, {'soil_moisture': 41.0})
+    engine.update('c', 'field_2', 120.0, {'soil_moisture': 42.0})
+    assert engine.get_location_features('field_1')['soil_moisture_1h_max'] == 41.0
+
+def test_detector_state_bounded_by_max_sensors():
+    detector = SensorAnomalyDetector(max_sensors=4)
+    for i in range(100):
+        detector.screen(f'sensor_{i}', 'field_1', i * 60.0, {'soil_moisture': 40.0, 'temperature': 25.0})
+    stats = detector.get_stats()
+    assert stats['tracked_sensors'] == 4
+    assert stats['tracked_metrics'] == 8
+    assert all(len(group.values) <= 4 for group in detector.peers.values())
@@ -0,0 +1,73 @@
+import json
+import threading
+import time
+
+from S008 import BackendClient
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+def spilled_readings(client):
+    readings = []
+    for path in (client.spill_path, client.spill_path + '.draining'):
+        try:
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    payload = json.loads(line)['payload']
+                    readings.extend(payload if isinstance(payload, list) else [payload])
+        except OSError:
+            pass
+    return readings
+
+def test_spill_during_drain_is_kept(tmp_path, monkeypatch):
+    client = BackendClient(spill_path=str(tmp_path / 'spill.ndjson'), drain_batch_size=2)
+    for i in range(4):
+        client.spill('http://backend/api/v1/ingest', {'n': i})
+    delivered = []
+    def slow_post(url, payload, **kwargs):
+        time.sleep(0.05)
+        delivered.extend(payload)
+        # 第二批失败，剩余数据应保留
+        return FakeResponse(200 if len(delivered) <= 2 else 503)
+    monkeypatch.setattr(client, 'post_json', slow_post)
+    drainer = threading.Thread(target=client.drain_spill, args=('http://backend',))
+    drainer.start()
+    time.sleep(0.02)
+    for i in range(4, 6):
+        client.spill('http://backend/api/v1/ingest', {'n': i})
+    drainer.join()
+    assert client.get_stats()['drained'] == 2
+    assert [r['n'] for r in spilled_readings(client)] == [2, 3, 4, 5]
+    assert not (tmp_path / 'spill.ndjson.draining').exists()
+
+def test_trim_during_drain_does_not_corrupt_spill(tmp_path, monkeypatch):
+    client = BackendClient(spill_path=str(tmp_path / 'spill.ndjson'), spill_max_bytes=400)
+    for i in range(3):
+        client.spill('http://backend/api/v1/ingest', {'n': i})
+    def failing_post(url, payload, **kwargs):
+        # 补发期间大量写入触发裁剪
+        for i in range(100, 120):
+            client.spill('http://backend/api/v1/ingest', {'n': i})
+        return None
+    monkeypatch.setattr(client, 'post_json', failing_post)
+    assert client.drain_spill('http://backend') == 0
+    numbers = [r['n'] for r in spilled_readings(client)]
+    assert numbers == sorted(set(numbers))
+    assert numbers[-1] == 119
+    assert (tmp_path / 'spill.ndjson').stat().st_size <= 400
+
+def test_counters_consistent_under_concurrency(tmp_path, monkeypatch):
+    client = BackendClient(spill_path=str(tmp_path / 'spill.ndjson'), gzip_min_bytes=10 ** 6)
+    monkeypatch.setattr(client.session, 'request', lambda *a, **k: FakeResponse(200))
+    def worker():
+        for _ in range(200):
+            client.post_json('http://backend/api/v1/ingest', {'n': 1})
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stats = client.get_stats()
+    assert stats['requests'] == 1600
+    assert stats['bytes_raw'] == stats['bytes_sent'] == 1600 * len(b'{"n": 1}')
@@ -0,0 +1,73 @@
+import gzip
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+@pytest.fixture
+def client(monkeypatch):
+    from S003 import SensorTimeSeriesStore
+    from S007 import SensorAnomalyDetector
+    monkeypatch.setattr(main, 'sensor_store', SensorTimeSeriesStore(capacity=16))
+    monkeypatch.setattr(main, 'anomaly_detector', SensorAnomalyDetector())
+    return TestClient(main.app)
+
+def reading(index, **readings):
+    return {'sensor_id': f's{index}', 'location': 'field_1', 'readings': readings or {'soil_moisture': 40.0}}
+
+def test_batch_accepts_array_and_ndjson(client):
+    items = [reading(i) for i in range(3)]
+    result = client.post('/api/v1/ingest/batch', content=json.dumps(items)).json()
+    assert result['status'] == 'success'
+    assert result['accepted'] == 3
+    body = '\n'.join(json.dumps(item) for item in items)
+    result = client.post('/api/v1/ingest/batch', content=body,
+                         headers={'content-type': 'application/x-ndjson'}).json()
+    assert result['accepted'] == 3
+    assert main.sensor_store.get_stats()['total_readings'] == 6
+
+def test_batch_rejects_items_without_identity(client):
+    items = [reading(0), {'location': 'field_1', 'readings': {'soil_moisture': 40.0}},
+             {'sensor_id': 's2', 'readings': {'soil_moisture': 40.0}}, {'sensor_id': 's3', 'location': 'field_1'}]
+    result = client.post('/api/v1/ingest/batch', content=json.dumps(items)).json()
+    assert result['status'] == 'partial'
+    assert result['accepted'] == 1
+    assert [e['index'] for e in result['errors']] == [1, 2, 3]
+    assert 'sensor_id' in result['errors'][0]['error']
+
+def test_batch_counts_each_quarantined_reading_once(client):
+    # 温度和湿度同时超量程：两个故障，但只是一条读数
+    items = [reading(0), reading(1, temperature=120.0, humidity=150.0, soil_moisture=40.0),
+             reading(2, temperature=120.0)]
+    result = client.post('/api/v1/ingest/batch', content=json.dumps(items)).json()
+    assert result['status'] == 'partial'
+    assert result['quarantined'] == 2
+    assert result['accepted'] == 2
+    by_index = {item['index']: item for item in result['quarantined_items']}
+    assert sorted(by_index) == [1, 2]
+    assert by_index[1]['accepted'] is True
+    assert len(by_index[1]['faults']) == 2
+    assert by_index[2]['accepted'] is False
+
+def test_batch_all_rejected_has_distinct_status(client):
+    items = [{'sensor_id': 's0'}, reading(1, temperature=120.0)]
+    result = client.post('/api/v1/ingest/batch', content=json.dumps(items)).json()
+    assert result['status'] == 'rejected'
+    assert result['accepted'] == 0
+
+def test_batch_body_size_capped(client, monkeypatch):
+    import S005
+    monkeypatch.setattr(S005.read_limited_body, '__defaults__', (1024,))
+    items = [reading(i) for i in range(50)]
+    response = client.post('/api/v1/ingest/batch', content=json.dumps(items))
+    assert response.status_code == 413
+    response = client.post('/api/v1/ingest/batch', content=json.dumps(items[:2]))
+    assert response.json()['accepted'] == 2
+
+def test_batch_accepts_gzip_body(client):
+    items = [reading(i) for i in range(3)]
+    response = client.post('/api/v1/ingest/batch', content=gzip.compress(json.dumps(items).encode()),
+                           headers={'content-encoding': 'gzip'})
+    assert response.json()['accepted'] == 3